@@ -0,0 +1,336 @@
+import base64
+import datetime
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter, namedtuple
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, unquote
+
+# The owner and repo of the fake Github repo.
+REPO_OWNER = "bench"
+REPO_NAME = "docs"
+BRANCH = "master"
+
+# The id of the page at the root of the fake Confluence space.
+ROOT_PAGE_ID = "1"
+
+# The remaining requests reported by Github when there is no rate limit.
+UNLIMITED_REMAINING = 5000
+
+# A generated document: where it lives, when it last changed and who changed it.
+Doc = namedtuple("Doc", ["path", "parent", "title", "content", "changed_at", "changed_by"])
+
+_HISTORY_ALIAS = re.compile(r"(p\d+): history")
+
+
+def generate_docs(count: int, depth: int, breadth: int, size: int, seed: int = 0):
+    """
+    Generates a synthetic documentation tree.  Every document gets a frontmatter header (most of them with an owner)
+    and a body of roughly `size` bytes.  The last changes are spread over the past two years so about half of the
+    documents are stale with the default settings.
+    :param count: The number of documents
+    :param depth: The deepest level of folders (or pages) below the root
+    :param breadth: The number of folders at each level (for the Github repo)
+    :param size: The size of the body of each document
+    :param seed: Documents generated with the same seed are identical
+    :return: The documents in the order they were generated (parent pages before their children).  The page id of
+        each document is its position plus 2 (the root page is 1).
+    """
+    rng = random.Random(seed)
+    now = datetime.datetime.now(tz=datetime.timezone.utc)
+    body = ("Lorem ipsum dolor sit amet. " * (size // 28 + 1))[:size]
+    owners = [f"owner{i}@example.com" for i in range(max(1, count // 20))]
+    levels = {0: [ROOT_PAGE_ID]}
+
+    docs = []
+    for i in range(count):
+        level = rng.randint(0, depth)
+        folders = [f"section{rng.randrange(breadth)}" for _ in range(level)]
+        path = "/".join(folders + [f"doc{i}.md"])
+
+        # pages hang off a random page one level up (or the root if there isn't one yet)
+        page_level = min(level, max(levels)) + 1
+        page_id = str(i + 2)
+        parent = rng.choice(levels[page_level - 1])
+        levels.setdefault(page_level, []).append(page_id)
+
+        owner = rng.choice(owners) if rng.random() < 0.8 else None
+        header = f"---\ntitle: Document {i}\n" + (f"owner: {owner}\n" if owner else "") + "---\n"
+        changed_at = now - datetime.timedelta(days=rng.randint(0, 730), seconds=rng.randint(0, 86400))
+        docs.append(Doc(path, parent, f"Document {i}", (header + body).encode("utf-8"), changed_at,
+                        rng.choice(owners)))
+
+    return docs
+
+
+class FakeApi(object):
+    """
+    The state behind the fake servers: the generated documents, the simulated latency and rate limit, and a count
+    of the requests received by each API.
+    """
+    def __init__(self, docs, latency: float = 0.0, rate_limit: int = 0, rate_window: float = 1.0):
+        self.docs = docs
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.requests = Counter()
+        self.emails = 0
+        self._lock = threading.Lock()
+        self._window_start = time.time()
+        self._window_count = 0
+
+        self.files = {d.path: d for d in docs}
+        self.pages = {str(i + 2): d for i, d in enumerate(docs)}
+        self.children = {}
+        for page_id, d in self.pages.items():
+            self.children.setdefault(d.parent, []).append(page_id)
+
+        self.trees = {}
+        for d in docs:
+            parts = d.path.split("/")
+            for i in range(len(parts)):
+                folder = "/".join(parts[:i])
+                entry = ("blob" if i == len(parts) - 1 else "tree", "/".join(parts[:i + 1]))
+                self.trees.setdefault(folder, set()).add(entry)
+
+    def admit(self, api: str):
+        """
+        Counts a request and checks it against the rate limit.
+        :return: The remaining requests in the current window, when the window resets and whether the request is
+            over the limit.
+        """
+        with self._lock:
+            self.requests[api] += 1
+            now = time.time()
+            if now - self._window_start >= self.rate_window:
+                self._window_start = now
+                self._window_count = 0
+
+            self._window_count += 1
+            reset = self._window_start + self.rate_window
+            if not self.rate_limit:
+                return None, reset, False
+
+            return max(0, self.rate_limit - self._window_count), reset, self._window_count > self.rate_limit
+
+
+def blob_sha(path: str) -> str:
+    return hashlib.sha1(path.encode("utf-8")).hexdigest()
+
+
+def tree_sha(folder: str) -> str:
+    if not folder:
+        return BRANCH
+    return "tree-" + base64.urlsafe_b64encode(folder.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def folder_of_tree(sha: str) -> str:
+    if sha == BRANCH:
+        return ""
+    encoded = sha[len("tree-"):]
+    return base64.urlsafe_b64decode(encoded + "=" * (-len(encoded) % 4)).decode("utf-8")
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    """
+    Serves the parts of the Github REST and GraphQL APIs, the Confluence REST API and the SendGrid API that decay
+    uses, all from one server.
+    """
+    protocol_version = "HTTP/1.1"
+    # the headers and the body go out in one write - separate small writes on a kept alive connection are held back
+    #   by Nagle's algorithm and add ~40ms to every request
+    wbufsize = 1 << 16
+    api: FakeApi = None
+
+    def log_message(self, *args):
+        pass
+
+    def base(self) -> str:
+        return f"http://{self.headers['Host']}"
+
+    def reply(self, api: str, status: int, body=None):
+        remaining, reset, limited = self.api.admit(api)
+        if self.api.latency:
+            time.sleep(self.api.latency)
+
+        if limited:
+            status, body = 429, {"message": "API rate limit exceeded"}
+
+        payload = json.dumps(body).encode("utf-8") if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        if remaining is None and api == "github":
+            # Github always sends these (the client asks for them separately otherwise)
+            remaining = UNLIMITED_REMAINING
+        if remaining is not None:
+            self.send_header("X-RateLimit-Limit", str(self.api.rate_limit or UNLIMITED_REMAINING))
+            self.send_header("X-RateLimit-Remaining", str(remaining))
+            self.send_header("X-RateLimit-Reset", str(int(reset) + 1))
+        if limited:
+            self.send_header("Retry-After", str(max(1, int(reset - time.time() + 1))))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length)) if length else None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if url.path.startswith("/wiki/"):
+            return self.confluence_get(url.path, query)
+
+        repo = f"/repos/{REPO_OWNER}/{REPO_NAME}"
+        if url.path == repo:
+            return self.reply("github", 200, self.repository())
+        if url.path.startswith(repo + "/git/trees/"):
+            return self.git_tree(url.path[len(repo + "/git/trees/"):], query.get("recursive"))
+        if url.path.startswith(repo + "/contents/"):
+            return self.contents(unquote(url.path[len(repo + "/contents/"):]))
+        if url.path == repo + "/commits":
+            doc = self.api.files.get(query.get("path"))
+            return self.reply("github", 200, [self.commit(doc)] if doc else [])
+
+        self.reply("github", 404, {"message": "Not Found"})
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        body = self.read_body()
+        if path == "/graphql":
+            return self.graphql(body)
+        if path == "/v3/mail/send":
+            self.api.emails += len(body.get("personalizations", []))
+            return self.reply("sendgrid", 202)
+
+        self.reply("github", 404, {"message": "Not Found"})
+
+    def do_PUT(self):
+        body = self.read_body()
+        page_id = urlparse(self.path).path.split("/")[-1]
+        self.reply("confluence", 200, {"id": page_id, "title": body["title"], "version": body["version"]})
+
+    # GITHUB
+
+    def repository(self) -> dict:
+        base = self.base()
+        return {"id": 1, "name": REPO_NAME, "full_name": f"{REPO_OWNER}/{REPO_NAME}", "default_branch": BRANCH,
+                "owner": {"login": REPO_OWNER}, "url": f"{base}/repos/{REPO_OWNER}/{REPO_NAME}",
+                "html_url": f"{base}/{REPO_OWNER}/{REPO_NAME}"}
+
+    def git_tree(self, sha: str, recursive: str):
+        folder = folder_of_tree(sha)
+        if folder not in self.api.trees:
+            return self.reply("github", 404, {"message": "Not Found"})
+
+        pending = [folder]
+        entries = []
+        while pending:
+            current = pending.pop()
+            for kind, path in sorted(self.api.trees.get(current, ())):
+                relative = path[len(folder) + 1:] if folder else path
+                if kind == "tree":
+                    entries.append({"path": relative, "mode": "040000", "type": "tree", "sha": tree_sha(path)})
+                    if recursive:
+                        pending.append(path)
+                else:
+                    entries.append({"path": relative, "mode": "100644", "type": "blob", "sha": blob_sha(path),
+                                    "size": len(self.api.files[path].content)})
+
+        self.reply("github", 200, {"sha": sha, "tree": entries, "truncated": False})
+
+    def contents(self, path: str):
+        doc = self.api.files.get(path)
+        if not doc:
+            return self.reply("github", 404, {"message": "Not Found"})
+
+        base = self.base()
+        self.reply("github", 200, {
+            "type": "file", "encoding": "base64", "size": len(doc.content), "name": path.split("/")[-1],
+            "path": path, "sha": blob_sha(path), "content": base64.b64encode(doc.content).decode("ascii"),
+            "url": f"{base}/repos/{REPO_OWNER}/{REPO_NAME}/contents/{path}",
+            "html_url": f"{base}/{REPO_OWNER}/{REPO_NAME}/blob/{BRANCH}/{path}"})
+
+    @staticmethod
+    def committer(doc: Doc) -> dict:
+        return {"date": doc.changed_at.strftime("%Y-%m-%dT%H:%M:%SZ"), "name": doc.changed_by.split("@")[0],
+                "email": doc.changed_by}
+
+    def commit(self, doc: Doc) -> dict:
+        return {"sha": blob_sha(doc.path + "@commit"), "commit": {"committer": self.committer(doc)}}
+
+    def graphql(self, body: dict):
+        variables = body["variables"]
+        histories = {}
+        for alias in _HISTORY_ALIAS.findall(body["query"]):
+            doc = self.api.files.get(variables.get(alias))
+            histories[alias] = {"nodes": [{"committer": self.committer(doc)}] if doc else []}
+
+        self.reply("github", 200, {"data": {"repository": {"object": histories}}})
+
+    # CONFLUENCE
+
+    def page(self, page_id: str, expand: str) -> dict:
+        doc = self.api.pages.get(page_id)
+        title = doc.title if doc else "Root"
+        page = {"id": page_id, "type": "page", "title": title, "_links": {"webui": f"/pages/{page_id}"}}
+        if "version" in expand:
+            when = doc.changed_at if doc else datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+            by = doc.changed_by if doc else "admin@example.com"
+            page["version"] = {"when": when.isoformat(), "number": 1,
+                               "by": {"publicName": by.split("@")[0], "email": by}}
+        return page
+
+    def descendants(self, page_id: str):
+        found = []
+        pending = [page_id]
+        while pending:
+            children = self.api.children.get(pending.pop(), [])
+            found.extend(children)
+            pending.extend(children)
+        return found
+
+    def paginate(self, found, query: dict, path: str, expand: str) -> dict:
+        limit = int(query.get("limit", 25))
+        start = int(query.get("cursor", 0))
+        links = {"base": self.base() + "/wiki"}
+        if start + limit < len(found):
+            cql = f"cql={query['cql']}&" if "cql" in query else ""
+            links["next"] = f"{path[len('/wiki'):]}?{cql}expand={expand}&limit={limit}&cursor={start + limit}"
+        results = [self.page(p, expand) for p in found[start:start + limit]]
+        return {"results": results, "size": len(results), "_links": links}
+
+    def confluence_get(self, path: str, query: dict):
+        expand = query.get("expand", "")
+        parts = path.split("/")
+        if path == "/wiki/rest/api/content/search":
+            page_id = query["cql"].split("=")[1].split()[0]
+            return self.reply("confluence", 200, self.paginate(self.descendants(page_id), query, path, expand))
+
+        if path.endswith("/child/page"):
+            children = self.api.children.get(parts[-3], [])
+            return self.reply("confluence", 200, self.paginate(children, query, path, expand))
+
+        if parts[-1] != ROOT_PAGE_ID and parts[-1] not in self.api.pages:
+            return self.reply("confluence", 404, {"message": "No content found"})
+
+        page = self.page(parts[-1], expand)
+        page["_links"]["base"] = self.base() + "/wiki"
+        self.reply("confluence", 200, page)
+
+
+def start_server(api: FakeApi) -> ThreadingHTTPServer:
+    """
+    Starts serving the fake APIs on a free local port in a background thread.  Call `shutdown` on the returned
+    server when done.
+    """
+    handler = type("BoundFakeApiHandler", (FakeApiHandler,), {"api": api})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,161 @@
+"""
+Runs decay end to end against local stand-ins for the Github, Confluence and SendGrid APIs and reports how long it
+took, how many requests it made and how much memory it used.  For example:
+
+    python -m benchmarks.run --source github --docs 2000 --latency_ms 30 -- --workers 8
+
+Arguments after `--` are passed on to decay.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+from typing import List
+
+from benchmarks.fakes import FakeApi, REPO_NAME, REPO_OWNER, ROOT_PAGE_ID, generate_docs, start_server
+
+SOURCE_GITHUB = "github"
+SOURCE_CONFLUENCE = "confluence"
+
+SOURCES = [SOURCE_GITHUB, SOURCE_CONFLUENCE]
+
+
+def decay_arguments(source: str, base: str, actions: List[str], extra: List[str]) -> List[str]:
+    """
+    Builds the command line that points decay at the fake servers.
+    """
+    argv = list(actions) + ["-k", "bench", "--sendgrid_api_url", f"{base}/v3/mail/send",
+                            "-r", "noreply@example.com", "-m", "admin@example.com",
+                            # there is no network access to the mail domains of the generated addresses
+                            "--email_validation", "syntax"]
+    if source == SOURCE_GITHUB:
+        argv += ["-o", REPO_OWNER, "-g", REPO_NAME, "-f", "/", "-a", "bench", "--github_api_url", base,
+                 "--github_graphql_url", f"{base}/graphql"]
+    else:
+        argv += ["--confluence_hostname", f"{base}/wiki", "--confluence_username", "bench",
+                 "--confluence_password", "bench", "--confluence_parent_page_id", ROOT_PAGE_ID]
+    return argv + list(extra)
+
+
+def _run_decay(argv: List[str], results):
+    """
+    Runs decay in a fresh process (so that the peak memory is decay's own) and sends the measurements back.
+    """
+    import resource
+
+    from decay.main import main
+    from decay.metrics import metrics
+
+    sys.stdout = open(os.devnull, "w")
+    start = time.perf_counter()
+    main(argv)
+    seconds = time.perf_counter() - start
+
+    # linux reports the peak in KiB and macOS in bytes
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_mb = peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+    results.send({"seconds": seconds, "peak_rss_mb": peak_mb, "analyses": metrics.counters.get("analyses", 0)})
+
+
+def run_scenario(source: str, docs: int = 500, depth: int = 4, breadth: int = 4, doc_size: int = 2000,
+                 latency: float = 0.0, rate_limit: int = 0, rate_window: float = 1.0,
+                 actions: List[str] = ("email_owner", "send_admin_report"), extra: List[str] = (),
+                 seed: int = 0) -> dict:
+    """
+    Generates a documentation tree, serves it from the fake APIs and runs decay against it once.
+    :param source: One of SOURCES
+    :param docs: The number of documents in the tree
+    :param depth: The deepest level of folders (or pages)
+    :param breadth: The number of folders at each level of the Github repo
+    :param doc_size: The size of the body of each document in bytes
+    :param latency: The time (in seconds) the fake APIs take to answer each request
+    :param rate_limit: The number of requests allowed in each rate limit window (0 for no limit)
+    :param rate_window: The length of a rate limit window in seconds
+    :param actions: The decay actions to run
+    :param extra: Any other decay arguments
+    :param seed: The seed for the generated tree
+    :return: The wall time, requests made to each API, emails sent, peak memory and number of analyses.
+    """
+    api = FakeApi(generate_docs(docs, depth, breadth, doc_size, seed), latency, rate_limit, rate_window)
+    server = start_server(api)
+    try:
+        argv = decay_arguments(source, f"http://127.0.0.1:{server.server_port}", actions, extra)
+        spawn = multiprocessing.get_context("spawn")
+        receiver, sender = spawn.Pipe(duplex=False)
+        process = spawn.Process(target=_run_decay, args=(argv, sender))
+        process.start()
+        sender.close()
+        try:
+            measurements = receiver.recv()
+        except EOFError:
+            measurements = None
+        process.join()
+        if measurements is None:
+            raise RuntimeError(f"decay exited with {process.exitcode} when running {' '.join(argv)}")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    return dict(measurements, source=source, docs=docs, requests=sum(api.requests.values()),
+                requests_by_api=dict(api.requests), emails=api.emails)
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark decay against local fake APIs")
+    parser.add_argument('--source', dest="source", default="all", choices=SOURCES + ["all"],
+                        help="The documentation source to benchmark")
+    parser.add_argument('--docs', dest="docs", default=500, type=int,
+                        help="The number of documents in the generated tree")
+    parser.add_argument('--depth', dest="depth", default=4, type=int,
+                        help="The deepest level of folders (or pages) in the generated tree")
+    parser.add_argument('--breadth', dest="breadth", default=4, type=int,
+                        help="The number of folders at each level of the generated repo")
+    parser.add_argument('--doc_size', dest="doc_size", default=2000, type=int,
+                        help="The size of the body of each document in bytes")
+    parser.add_argument('--latency_ms', dest="latency_ms", default=20, type=float,
+                        help="The time the fake APIs take to answer each request")
+    parser.add_argument('--rate_limit', dest="rate_limit", default=0, type=int,
+                        help="The number of requests the fake APIs allow per window (0 for no limit)")
+    parser.add_argument('--rate_window', dest="rate_window", default=1.0, type=float,
+                        help="The length of a rate limit window in seconds")
+    parser.add_argument('--actions', dest="actions", default="email_owner,send_admin_report",
+                        help="The decay actions to run (comma separated)")
+    parser.add_argument('--repeat', dest="repeat", default=1, type=int,
+                        help="The number of runs of each scenario (the median time is reported)")
+    parser.add_argument('--seed', dest="seed", default=0, type=int,
+                        help="The seed for the generated tree")
+    parser.add_argument('--json', dest="json_path", required=False,
+                        help="Also write the results to this file")
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    extra = []
+    if "--" in argv:
+        argv, extra = argv[:argv.index("--")], argv[argv.index("--") + 1:]
+    args = get_parser().parse_args(argv)
+
+    results = []
+    for source in (SOURCES if args.source == "all" else [args.source]):
+        runs = [run_scenario(source, args.docs, args.depth, args.breadth, args.doc_size, args.latency_ms / 1000,
+                             args.rate_limit, args.rate_window, args.actions.split(","), extra, args.seed)
+                for _ in range(max(1, args.repeat))]
+        result = dict(runs[-1], seconds=statistics.median(r["seconds"] for r in runs),
+                      peak_rss_mb=max(r["peak_rss_mb"] for r in runs))
+        results.append(result)
+
+        by_api = ", ".join(f"{k}: {v}" for k, v in sorted(result["requests_by_api"].items()))
+        print(f"{source:<12} {result['docs']:>7} docs  {result['seconds']:>8.2f}s  {result['requests']:>7} requests "
+              f"({by_api})  {result['peak_rss_mb']:>7.1f} MiB peak  {result['emails']} emails")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
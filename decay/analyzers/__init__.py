@@ -1,5 +1,9 @@
 import datetime
-from typing import Union
+import math
+import sys
+from array import array
+from itertools import compress
+from typing import Dict, Iterable, Iterator, List, Union
 
 
 class FileAnalysis(object):
@@ -8,76 +12,153 @@ class FileAnalysis(object):
     phase of document decay detection.  Reports are usually generated from this information as well
     as the aggregation of data from multiple instances of this object.
     """
+    __slots__ = ("file_link", "file_identifier", "file_changed_recently", "last_change", "changed_by_email",
+                 "changed_by_name", "owner", "doc_name", "revision")
+
     def __init__(self):
-        self._file_link: str = ""
-        self._file_identifier: str = ""
-        self._file_changed_recently: bool = True
-        self._last_change: Union[datetime.datetime, None] = None
-        self._changed_by_email: Union[str, None] = None
-        self._changed_by_name: Union[str, None] = None
-        self._owner: str = ""
-        self._doc_name: str = ""
-
-    @property
-    def file_link(self) -> str:
-        return self._file_link
-
-    @file_link.setter
-    def file_link(self, val: str):
-        self._file_link = val
-
-    @property
-    def changed_by_email(self) -> Union[str, None]:
-        return self._changed_by_email
-
-    @changed_by_email.setter
-    def changed_by_email(self, val: Union[str, None]):
-        self._changed_by_email = val
-
-    @property
-    def changed_by_name(self) -> Union[str, None]:
-        return self._changed_by_name
-
-    @changed_by_name.setter
-    def changed_by_name(self, val: Union[str, None]):
-        self._changed_by_name = val
-
-    @property
-    def last_change(self) -> Union[datetime.datetime, None]:
-        return self._last_change
-
-    @last_change.setter
-    def last_change(self, val: Union[datetime.datetime, None]):
-        self._last_change = val
-
-    @property
-    def file_identifier(self) -> str:
-        return self._file_identifier
-
-    @file_identifier.setter
-    def file_identifier(self, val: str):
-        self._file_identifier = val
-
-    @property
-    def doc_name(self) -> str:
-        return self._doc_name
-
-    @doc_name.setter
-    def doc_name(self, val: str):
-        self._doc_name = val
-
-    @property
-    def file_changed_recently(self) -> bool:
-        return self._file_changed_recently
-
-    @file_changed_recently.setter
-    def file_changed_recently(self, val: bool):
-        self._file_changed_recently = val
-
-    @property
-    def owner(self) -> str:
-        return self._owner
-
-    @owner.setter
-    def owner(self, val: str):
-        self._owner = val
+        self.file_link: str = ""
+        self.file_identifier: str = ""
+        self.file_changed_recently: bool = True
+        self.last_change: Union[datetime.datetime, None] = None
+        self.changed_by_email: Union[str, None] = None
+        self.changed_by_name: Union[str, None] = None
+        self.owner: str = ""
+        self.doc_name: str = ""
+        self.revision: Union[int, None] = None
+
+    def to_dict(self) -> dict:
+        """
+        Converts the analysis to a dict that can be serialized to JSON.
+        """
+        return {
+            "file_link": self.file_link,
+            "file_identifier": self.file_identifier,
+            "file_changed_recently": self.file_changed_recently,
+            "last_change": self.last_change.isoformat() if self.last_change else None,
+            "changed_by_email": self.changed_by_email,
+            "changed_by_name": self.changed_by_name,
+            "owner": self.owner,
+            "doc_name": self.doc_name,
+            "revision": self.revision,
+        }
+
+    @staticmethod
+    def from_dict(data: dict) -> 'FileAnalysis':
+        """
+        Creates an analysis from a dict generated by `to_dict`.
+        """
+        analysis = FileAnalysis()
+        analysis.file_link = data.get("file_link", "")
+        analysis.file_identifier = data.get("file_identifier", "")
+        analysis.file_changed_recently = data.get("file_changed_recently", True)
+        analysis.last_change = datetime.datetime.fromisoformat(data["last_change"]) if data.get("last_change") \
+            else None
+        analysis.changed_by_email = data.get("changed_by_email")
+        analysis.changed_by_name = data.get("changed_by_name")
+        analysis.owner = data.get("owner", "")
+        analysis.doc_name = data.get("doc_name", "")
+        analysis.revision = data.get("revision")
+        return analysis
+
+
+def _intern(value: Union[str, None]) -> Union[str, None]:
+    return sys.intern(value) if value else value
+
+
+class AnalysisSet(object):
+    """
+    Holds a large number of analyses in columns rather than as separate objects.  The dates of change are kept as
+    POSIX timestamps in a float array (NaN when there isn't one), the freshness flags in a bytearray and the owner
+    and committer strings are interned so that each distinct person is stored only once.  Ordering, filtering and
+    grouping work on whole columns and return row indexes which can be turned back into FileAnalysis objects with
+    `take`.
+    """
+    def __init__(self, analyses: Iterable[FileAnalysis] = ()):
+        self.file_links: List[str] = []
+        self.file_identifiers: List[str] = []
+        self.doc_names: List[str] = []
+        self.revisions: List[Union[int, None]] = []
+        self.owners: List[str] = []
+        self.changed_by_emails: List[Union[str, None]] = []
+        self.changed_by_names: List[Union[str, None]] = []
+        self.timestamps = array("d")
+        self.stale = bytearray()
+        self.extend(analyses)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, index: int) -> FileAnalysis:
+        analysis = FileAnalysis()
+        analysis.file_link = self.file_links[index]
+        analysis.file_identifier = self.file_identifiers[index]
+        analysis.doc_name = self.doc_names[index]
+        analysis.revision = self.revisions[index]
+        analysis.owner = self.owners[index]
+        analysis.changed_by_email = self.changed_by_emails[index]
+        analysis.changed_by_name = self.changed_by_names[index]
+        analysis.file_changed_recently = not self.stale[index]
+        timestamp = self.timestamps[index]
+        analysis.last_change = None if math.isnan(timestamp) else \
+            datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc)
+        return analysis
+
+    def __iter__(self) -> Iterator[FileAnalysis]:
+        return self.take(range(len(self)))
+
+    def append(self, analysis: FileAnalysis):
+        last_change = analysis.last_change
+        if last_change is not None and last_change.tzinfo is None:
+            last_change = last_change.replace(tzinfo=datetime.timezone.utc)
+
+        self.file_links.append(analysis.file_link)
+        self.file_identifiers.append(analysis.file_identifier)
+        self.doc_names.append(analysis.doc_name)
+        self.revisions.append(analysis.revision)
+        self.owners.append(_intern(analysis.owner))
+        self.changed_by_emails.append(_intern(analysis.changed_by_email))
+        self.changed_by_names.append(_intern(analysis.changed_by_name))
+        self.timestamps.append(last_change.timestamp() if last_change else math.nan)
+        self.stale.append(0 if analysis.file_changed_recently else 1)
+
+    def extend(self, analyses: Iterable[FileAnalysis]):
+        for analysis in analyses:
+            self.append(analysis)
+
+    def take(self, indexes: Iterable[int]) -> Iterator[FileAnalysis]:
+        """
+        Yields the analyses in the given rows (in the order given).
+        """
+        return map(self.__getitem__, indexes)
+
+    def stale_indexes(self) -> List[int]:
+        """
+        The rows of the documents that haven't changed recently.
+        """
+        return list(compress(range(len(self)), self.stale))
+
+    def order_by_last_change(self, indexes: Iterable[int] = None, missing: float = None) -> List[int]:
+        """
+        Orders rows from the oldest change to the newest.
+        :param indexes: The rows to order (all of them if not given)
+        :param missing: The timestamp used for rows without a date of change (the oldest possible if not given)
+        :return: The ordered row indexes.
+        """
+        indexes = range(len(self)) if indexes is None else indexes
+        missing = -math.inf if missing is None else missing
+        keys = array("d", (missing if math.isnan(t) else t for t in self.timestamps))
+        return sorted(indexes, key=keys.__getitem__)
+
+    def group_by_owner(self, indexes: Iterable[int] = None, default: str = "") -> Dict[str, List[int]]:
+        """
+        Groups rows by the owner of the document.
+        :param indexes: The rows to group (all of them if not given)
+        :param default: The key to use for rows without an owner
+        :return: The row indexes of each owner (in the order given).
+        """
+        indexes = range(len(self)) if indexes is None else indexes
+        owners = self.owners
+        groups: Dict[str, List[int]] = {}
+        for index in indexes:
+            groups.setdefault(owners[index] or default, []).append(index)
+        return groups
@@ -1,45 +1,199 @@
+import asyncio
 import datetime
+import functools
+import json
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-from typing import List
+from typing import Callable, Iterator, List
 
 import arrow
 
 from decay.analyzers import FileAnalysis
-from decay.context import DocCheckerContext
+from decay.context import DocCheckerContext, CONFLUENCE_FETCH_CQL
+from decay.feedback import info, error
 
+# The version message of the title changes made by the marker.  The last change made by someone else is carried in
+#   the message so that decay's own changes never make a page look recently changed.
+MARK_VERSION_MESSAGE_PREFIX = "decay: title change only "
 
-def analyze_confluence_page_tree(page_id: str, ctx: DocCheckerContext) -> List[FileAnalysis]:
 
-    analyses = []
+def mark_version_message(a: FileAnalysis) -> str:
+    """
+    The version message for a title change made by the marker to the page with the given analysis.
+    """
+    return MARK_VERSION_MESSAGE_PREFIX + json.dumps({
+        "when": a.last_change.isoformat() if a.last_change else None,
+        "name": a.changed_by_name,
+        "email": a.changed_by_email,
+    })
+
+
+def last_real_change(version: dict) -> dict:
+    """
+    The version information of the last change that wasn't a title change made by the marker.  For a version made
+    by the marker, that's the change carried in its message.
+    """
+    message = version.get('message') or ""
+    if not message.startswith(MARK_VERSION_MESSAGE_PREFIX):
+        return version
+
+    try:
+        change = json.loads(message[len(MARK_VERSION_MESSAGE_PREFIX):])
+    except ValueError:
+        return version
 
-    # First iterate over children
-    child_pages = ctx.confluence.get_children(page_id)
-    if child_pages['size'] > 0:
-        children = child_pages['results']
-        for child in children:
-            a = analyze_confluence_page_tree(child['id'], ctx)
-            analyses = a + analyses
+    real = {'by': {'publicName': change.get('name'), 'email': change.get('email')}}
+    if change.get('when'):
+        real['when'] = change['when']
+    return real
 
-    # Now collect information about this file.
-    info = ctx.confluence.get_content(page_id)
 
+def build_page_analysis(page: dict, base: str, ctx: DocCheckerContext) -> FileAnalysis:
+    """
+    Generates the analysis of a single page from the page information returned by confluence.
+    :param page: The page (with at least the version expanded)
+    :param base: The base url of the links of the page
+    :param ctx:
+    :return:
+    """
     analysis = FileAnalysis()
-    if 'version' in info:
-        if 'when' in info['version']:
-            docChangeDate = arrow.get(info['version']['when'])
+    if 'version' in page:
+        analysis.revision = page['version'].get('number')
+        change = last_real_change(page['version'])
+
+        if 'when' in change:
+            docChangeDate = arrow.get(change['when'])
             currentDate = datetime.datetime.now(tz=docChangeDate.tzinfo)
             analysis.last_change = docChangeDate.datetime
             earliest_change_date = currentDate - datetime.timedelta(days=ctx.doc_is_stale_after_days)
             analysis.file_changed_recently = analysis.last_change > earliest_change_date
 
-        if 'by' in info['version']:
-            analysis.changed_by_name = info['version']['by']['publicName']
-            analysis.changed_by_email = info['version']['by']['email'] if 'email' in info['version']['by'] else None
+        if 'by' in change:
+            analysis.changed_by_name = change['by'].get('publicName')
+            analysis.changed_by_email = change['by'].get('email')
+
+    analysis.file_identifier = page['id']
+    analysis.file_link = base + page['_links']['webui']
+    analysis.doc_name = page['title']
+    return analysis
+
+
+def iter_confluence_descendants(page_id: str, ctx: DocCheckerContext) -> Iterator[FileAnalysis]:
+    """
+    Analyzes the given page and all the pages below it.  All the descendants are retrieved with paginated CQL
+    searches so the number of requests depends on the number of pages divided by the page size rather than the
+    shape of the tree.
+    :param page_id: The page at the root of the tree
+    :param ctx:
+    :return: Yields FileAnalysis objects as each page of search results arrives (the root page is last).
+    """
+    count = 0
+    for page, base in ctx.confluence.search_descendants(page_id, limit=ctx.confluence_page_size):
+        count += 1
+        yield build_page_analysis(page, base, ctx)
+
+    root = ctx.confluence.get_content(page_id, expand=("version",))
+    yield build_page_analysis(root, root['_links']['base'], ctx)
+
+    info(f"Found {count + 1} pages under {page_id}")
+
+
+async def _crawl_page_tree(page_id: str, ctx: DocCheckerContext, emit: Callable[[FileAnalysis], None]):
+    """
+    Walks the tree breadth first without recursion.  A fixed number of workers take pages off a queue, request the
+    version information and the children of the page at the same time and queue up the children.  The blocking
+    requests run on a thread pool which is sized to the concurrency limit.  Each analysis is passed to `emit` as
+    soon as it's ready.
+    """
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=ctx.confluence_concurrency)
+    pending = asyncio.Queue()
+
+    def fetch(fn, *args, **kwargs):
+        return loop.run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+
+    async def worker():
+        while True:
+            current = await pending.get()
+            try:
+                page, children = await asyncio.gather(
+                    fetch(ctx.confluence.get_content, current, expand=("version",)),
+                    fetch(ctx.confluence.get_child_pages, current, limit=ctx.confluence_page_size))
 
-    analysis.file_identifier = info['id']
-    analysis.file_link = info['_links']['base'] + info['_links']['webui']
-    analysis.doc_name = info['title']
+                emit(build_page_analysis(page, page['_links']['base'], ctx))
+                for child in children:
+                    pending.put_nowait(child['id'])
 
-    # collect all the analyses together and return them.
-    analyses.append(analysis)
-    return analyses
+            except Exception as e:
+                error(f"Received exception during processing of page {current}: {str(e)}", 1)
+
+            finally:
+                pending.task_done()
+
+    pending.put_nowait(page_id)
+    workers = [asyncio.ensure_future(worker()) for _ in range(ctx.confluence_concurrency)]
+    try:
+        await pending.join()
+    finally:
+        for w in workers:
+            w.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        executor.shutdown(wait=False)
+
+
+def iter_confluence_crawl(page_id: str, ctx: DocCheckerContext) -> Iterator[FileAnalysis]:
+    """
+    Crawls the tree under the given page on a background thread and yields each analysis as soon as it's ready.
+    :param page_id: The page at the root of the tree
+    :param ctx:
+    :return: Yields FileAnalysis objects in breadth first order (more or less - pages are fetched concurrently).
+    """
+    results = queue.Queue()
+    done = object()
+
+    def crawl():
+        try:
+            asyncio.run(_crawl_page_tree(page_id, ctx, results.put))
+        except Exception as e:
+            error(f"Received exception while crawling the pages under {page_id}: {str(e)}", 1)
+        finally:
+            results.put(done)
+
+    thread = threading.Thread(target=crawl, daemon=True)
+    thread.start()
+
+    count = 0
+    while True:
+        analysis = results.get()
+        if analysis is done:
+            break
+        count += 1
+        yield analysis
+
+    thread.join()
+    info(f"Found {count} pages under {page_id}")
+
+
+def iter_confluence_analyses(page_id: str, ctx: DocCheckerContext) -> Iterator[FileAnalysis]:
+    """
+    Analyzes the given page and all the pages below it, yielding each analysis as soon as it's ready.
+    :param page_id: The page at the root of the tree
+    :param ctx:
+    :return: Yields FileAnalysis objects.
+    """
+    if ctx.confluence_fetch == CONFLUENCE_FETCH_CQL:
+        return iter_confluence_descendants(page_id, ctx)
+
+    return iter_confluence_crawl(page_id, ctx)
+
+
+def analyze_confluence_page_tree(page_id: str, ctx: DocCheckerContext) -> List[FileAnalysis]:
+    """
+    Analyzes the given page and all the pages below it.
+    :param page_id: The page at the root of the tree
+    :param ctx:
+    :return: A list of FileAnalysis objects.
+    """
+    return list(iter_confluence_analyses(page_id, ctx))
@@ -1,64 +1,128 @@
-import os
-import frontmatter
-from email_validator import validate_email, EmailNotValidError
-from typing import List
-from github import Repository
-import datetime
+from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from typing import TYPE_CHECKING, Iterator, List, Set, Tuple, Union
 
 from decay.analyzers import FileAnalysis
-from decay.context import DocCheckerContext
-from decay.feedback import info, error, warning
+from decay.analyzers.github_history import LastChange, fetch_last_change, fetch_last_changes
+from decay.analyzers.metadata import apply_frontmatter, report_analysis
+from decay.context import DocCheckerContext, ENUMERATE_TREE
+from decay.feedback import info, error, warning, grouped
+from decay.markers import get_props_to_change
+from decay.matcher import PathMatcher
+from decay.metrics import metrics
+from decay.pipeline import by_last_change
+from decay.state import AnalysisState, load_state, save_state
+from decay.throttle import BudgetLane
+from decay.util import changed_within_days
+
+if TYPE_CHECKING:
+    from github import Repository
+
+# When the history isn't retrieved in batches, files are still analyzed in chunks of this size.
+ANALYSIS_CHUNK_SIZE = 50
+
+# Github only lists this many files when comparing two commits.
+COMPARE_FILE_LIMIT = 300
+
+# A file found during enumeration of the repo.  The sha is the blob sha of the file at the analyzed branch.
+RepoFile = namedtuple("RepoFile", ["path", "sha"])
+
+
+def observe_rate_limit(context: DocCheckerContext):
+    """
+    Passes the rate limit information from the last response received by the Github client on to the shared
+    request budget.  The headers of that response are read directly: asking the client for the rate limit requests
+    /rate_limit when they're missing, which fails on Github Enterprise servers without rate limiting.  Responses
+    without the headers leave the budget as it is.
+    """
+    # the client only keeps the headers of the last response in its requester
+    requester = getattr(context.github, "_Github__requester", None)
+    if requester is None:
+        return
+
+    remaining, limit = requester.rate_limiting
+    if limit < 0:
+        return
+    context.github_budget.observe(remaining, requester.rate_limiting_resettime)
+    metrics.set_gauge("github_rate_limit_remaining", remaining)
+
+
+@contextmanager
+def github_call(context: DocCheckerContext, name: str, budget: Union[BudgetLane, None] = None):
+    """
+    Wraps a request made through the Github client: the request is counted against the shared budget (or the given
+    lane of it), measured and the rate limit information it returned is observed afterwards:
+
+        with github_call(context, "get_contents"):
+            content = repo.get_contents(...)
+    """
+    with budget or context.github_budget, metrics.request(f"github-client {name}"):
+        yield
+    observe_rate_limit(context)
+
+
+def read_github_file(repo: "Repository", path_to_file: str, sha: Union[str, None],
+                     context: DocCheckerContext) -> Tuple[bytes, str, str]:
+    """
+    Loads the content of a file.  Blobs never change so if the blob sha is known and the content is in the cache,
+    no request is made at all.
+    :param repo: The repo object in the API client
+    :param path_to_file: The path to the file in the repo (as in "lib/myfile.md")
+    :param sha: The blob sha of the file if known
+    :param context: The context object containing all the config information as well as created Github resources.
+    :return: The content of the file, the link to the file on Github and the blob sha of the file.
+    """
+    if sha and context.cache:
+        entry = context.cache.get("blob:" + sha)
+        if entry:
+            return entry.body, f"{repo.html_url}/blob/{context.github_branch}/{path_to_file}", sha
+
+    with github_call(context, "get_contents"):
+        content = repo.get_contents(path_to_file, ref=context.github_branch)
+
+    if context.cache and content.decoded_content is not None:
+        context.cache.put("blob:" + content.sha, content.decoded_content)
 
+    return content.decoded_content, content.html_url, content.sha
 
-def analyze_github_file(repo: Repository, path_to_file: str, context: DocCheckerContext) -> FileAnalysis:
+
+def analyze_github_file(repo: "Repository", path_to_file: str, context: DocCheckerContext,
+                        last_change: Union[LastChange, None] = None, sha: Union[str, None] = None) -> FileAnalysis:
     """
     This will actually load the file and the commit information to get things like if it was changed recently
     and who the owner (is taken from the frontmatter).
     :param context:
     :param repo: The repo object in the API client
     :param path_to_file: The path to the file in the repo (as in "lib/myfile.md")
+    :param last_change: The last change to the file if it was already retrieved in bulk.  If not given, the
+        last commit for the file is requested.
+    :param sha: The blob sha of the file if it's known from the enumeration (allows the content to be cached)
     :return:
     """
     analysis = FileAnalysis()
 
     info(f"Checking file {path_to_file}...")
     try:
-        commits = repo.get_commits(path=path_to_file)
-        no_earlier_than = datetime.datetime.now() - datetime.timedelta(days=context.doc_is_stale_after_days)
-        if commits.totalCount > 0:
-            commit_date = commits[0].commit.committer.date
-            analysis.file_changed_recently = commit_date >= no_earlier_than
-            analysis.last_change = commit_date
-            analysis.changed_by_email = commits[0].commit.committer.email
-            analysis.changed_by_name = commits[0].commit.committer.name
+        if not last_change:
+            last_change = fetch_last_change(path_to_file, context)
 
-        content = repo.get_contents(path_to_file, ref=context.github_branch)
-        analysis.file_link = content.html_url
+        if last_change:
+            analysis.file_changed_recently = changed_within_days(last_change.date, context.doc_is_stale_after_days)
+            analysis.last_change = last_change.date
+            analysis.changed_by_email = last_change.email
+            analysis.changed_by_name = last_change.name
+
+        content, analysis.file_link, sha = read_github_file(repo, path_to_file, sha, context)
         analysis.file_identifier = path_to_file
 
-        if content.decoded_content:
-            doc = frontmatter.loads(content.decoded_content)
-            if not doc and not doc.metadata:
-                error(f"There was a problem when reading the frontmatter for {path_to_file}", 1)
-            else:
-                if 'title' in doc.metadata:
-                    analysis.doc_name = doc.metadata['title']
-                else:
-                    analysis.doc_name = path_to_file
-
-                if 'owner' in doc.metadata:
-                    analysis.owner = doc.metadata['owner']
-                    try:
-                        valid = validate_email(analysis.owner)
-                        analysis.owner = valid.email
-                    except EmailNotValidError as e:
-                        warning(f"Found an owner but the email {analysis.owner} is not valid: " + str(e), 1)
-                        analysis.owner = None
-
-        info(f"Owner: {analysis.owner if analysis.owner else 'Not found'}", 1)
-        info(f"Changed On: {analysis.last_change if analysis.last_change else 'Not found'}", 1)
-        info(f"Is Stale: {'No' if analysis.file_changed_recently else 'Yes'}", 1)
-        info(f"Changed By: {analysis.changed_by_email if analysis.changed_by_email else 'Not found'}", 1)
+        apply_frontmatter(analysis, content, path_to_file, context.email_validator)
+        if context.contents is not None and get_props_to_change(analysis):
+            # this file is going to be marked so hold on to what was just downloaded
+            context.contents.put(path_to_file, content, sha)
+
+        report_analysis(analysis)
 
     except Exception as e:
         error(f"Unable to load analysis due to exception: {str(e)} ", 1)
@@ -66,40 +130,280 @@ def analyze_github_file(repo: Repository, path_to_file: str, context: DocChecker
     return analysis
 
 
-def analyze_github_path(path: str, context: DocCheckerContext) -> List[FileAnalysis]:
+def should_analyze_file(path: str, context: DocCheckerContext) -> bool:
     """
-    A recursive function that will descend into a github repo's tree starting at the given path.  It will
-    generate a list of FileAnalysis objects for each matching file (based on context).
+    Determines whether a file found in the repo should be analyzed based on the extensions, ignored files and
+    ignored paths given in the context (see PathMatcher).  A file is skipped if any of the folders it lives in is an
+    ignored path.
+    :param path: The path to the file in the repo (as in "lib/myfile.md")
+    :param context: The context object containing all the config information.
+    :return: True if the file should be analyzed
+    """
+    return context.path_matcher.matches(path)
+
+
+def _walk_github_contents(path: str, context: DocCheckerContext) -> List[RepoFile]:
+    """
+    Enumerates files by descending into the repo's tree one directory at a time using the contents API.  This
+    costs one request per directory - ignored directories are skipped without a request.
     :param path: The path within the repo to start the search from.
     :param context: The context object containing all the config information as well as created Github resources.
-    :return: A list of FileAnalysis objects.
+    :return: A list of RepoFile objects for every file found under the path.
     """
-    analyses = []
+    files = []
     try:
-        contents = context.repo_ob.get_contents(path, ref=context.github_branch)
+        with github_call(context, "get_contents"):
+            contents = context.repo_ob.get_contents(path, ref=context.github_branch)
         for o in contents:
             if o.type == "file":
-                # We've come to a file.  Check that it's not in the ignore list and that the extension
-                # matches the ones we're looking for.
-                _, file_extension = os.path.splitext(o.path)
-                if file_extension in context.extensions:
-                    if o.path not in context.ignore_files:
-                        analysis = analyze_github_file(context.repo_ob, o.path, context)
-                        if analysis:
-                            analyses.append(analysis)
-
-            elif o.type == "dir":
-                # We've come to a directory.  Check that it's not in the ignore list
-                for a in analyze_github_path(o.path, context):
-                    if o.path not in context.ignore_paths:
-                        analyses.append(a)
+                files.append(RepoFile(o.path, o.sha))
+
+            elif o.type == "dir" and not context.path_matcher.is_pruned(o.path):
+                files.extend(_walk_github_contents(o.path, context))
 
     except Exception as e:
         error(f"Received exception during processing of directory {path}: {str(e)}", 1)
 
-    # sort in descending order by age.  If there is no date, set the date to something way in the past in the hopes
-    #   that it appears near the bottom of the list.
-    analyses.sort(key=lambda x: x.last_change or datetime.datetime.now() - datetime.timedelta(days=3650),
-                  reverse=False)
+    return files
+
+
+def _resolve_tree_sha(context: DocCheckerContext, branch: str, folder: str) -> str:
+    """
+    Finds the sha of the git tree for the given folder by walking down from the root tree of the branch.  This
+    costs one (small) request per path component of the folder.
+    :param context: The context object containing the repo object in the API client
+    :param branch: The branch to resolve the folder in
+    :param folder: The folder path without leading or trailing slashes ("" for the root)
+    :return: The sha of the folder's tree.
+    """
+    sha = branch
+    for component in [c for c in folder.split("/") if c]:
+        with github_call(context, "get_git_tree"):
+            tree = context.repo_ob.get_git_tree(sha)
+        matches = [t for t in tree.tree if t.type == "tree" and t.path == component]
+        if not matches:
+            raise ValueError(f"Unable to find the folder {folder} in branch {branch}")
+        sha = matches[0].sha
+
+    return sha
+
+
+def _list_git_tree(context: DocCheckerContext, sha: str, prefix: str, matcher: PathMatcher) -> List[RepoFile]:
+    """
+    Lists every blob under the given tree using a single recursive request.  If github truncates the response
+    (which it does for very large trees), we fall back to listing this level only and repeating the process for
+    each of the subtrees that isn't ignored.
+    :param context: The context object containing the repo object in the API client
+    :param sha: The sha of the tree to list
+    :param prefix: The path of the tree in the repo - prepended to the paths in the listing.
+    :param matcher: Decides which subtrees are ignored
+    :return: A list of RepoFile objects for every file found under the tree.
+    """
+    with github_call(context, "get_git_tree"):
+        tree = context.repo_ob.get_git_tree(sha, recursive=True)
+    if not tree.raw_data.get("truncated"):
+        return [RepoFile(prefix + t.path, t.sha) for t in tree.tree if t.type == "blob"]
+
+    warning(f"The tree at {prefix or '/'} is too large to be listed in one request - listing subtrees instead", 1)
+    with github_call(context, "get_git_tree"):
+        level = context.repo_ob.get_git_tree(sha)
+    files = []
+    for t in level.tree:
+        if t.type == "blob":
+            files.append(RepoFile(prefix + t.path, t.sha))
+        elif t.type == "tree" and not matcher.is_pruned(prefix + t.path):
+            files.extend(_list_git_tree(context, t.sha, prefix + t.path + "/", matcher))
+
+    return files
+
+
+def _list_github_tree(path: str, context: DocCheckerContext) -> List[RepoFile]:
+    """
+    Enumerates files using the git trees API which can return the entire subtree in one request.
+    :param path: The path within the repo to start the search from.
+    :param context: The context object containing all the config information as well as created Github resources.
+    :return: A list of RepoFile objects for every file found under the path.
+    """
+    folder = (path or "").strip("/")
+    try:
+        sha = _resolve_tree_sha(context, context.github_branch, folder)
+        return _list_git_tree(context, sha, folder + "/" if folder else "", context.path_matcher)
+    except Exception as e:
+        error(f"Received exception during listing of the tree at {path}: {str(e)}", 1)
+        return []
+
+
+def enumerate_github_files(path: str, context: DocCheckerContext) -> List[RepoFile]:
+    """
+    Generates the list of files that should be analyzed under the given path.  The listing is retrieved in one go
+    (either from the git trees API or by walking the directories) and filtering happens locally afterwards.
+    :param path: The path within the repo to start the search from.
+    :param context: The context object containing all the config information as well as created Github resources.
+    :return: A list of RepoFile objects for each file that passes the extension and ignore filters.
+    """
+    if context.github_enumeration == ENUMERATE_TREE:
+        files = _list_github_tree(path, context)
+    else:
+        files = _walk_github_contents(path, context)
+
+    return [f for f in files if should_analyze_file(f.path, context)]
+
+
+def compare_commits(base_sha: str, head_sha: str,
+                    context: DocCheckerContext) -> Union[Tuple[Set[str], Set[str]], None]:
+    """
+    Finds the files that changed between two commits.
+    :param base_sha: The sha of the older commit
+    :param head_sha: The sha of the newer commit
+    :param context: The context object containing all the config information as well as created Github resources.
+    :return: The paths of the files that were added or changed and the paths of the files that were removed (or
+        renamed), or None if they can't be determined (in which case everything should be analyzed).
+    """
+    if base_sha == head_sha:
+        return set(), set()
+
+    try:
+        with github_call(context, "compare"):
+            comparison = context.repo_ob.compare(base_sha, head_sha)
+            status = comparison.status
+            files = comparison.files
+    except Exception as e:
+        warning(f"Unable to compare {base_sha} with {head_sha} - analyzing all files: {str(e)}", 1)
+        return None
+
+    if status not in ("ahead", "identical"):
+        warning(f"The branch is {status} compared to {base_sha} - analyzing all files", 1)
+        return None
+
+    if len(files) >= COMPARE_FILE_LIMIT:
+        warning(f"{COMPARE_FILE_LIMIT} or more files changed since {base_sha} - analyzing all files", 1)
+        return None
+
+    changed, removed = set(), set()
+    for f in files:
+        if f.status == "removed":
+            removed.add(f.filename)
+        else:
+            changed.add(f.filename)
+        if f.previous_filename:
+            removed.add(f.previous_filename)
+
+    return changed, removed
+
+
+def _changed_paths(base_sha: str, head_sha: str, context: DocCheckerContext) -> Union[Set[str], None]:
+    """
+    Finds the paths of all the files that changed between two commits.
+    :param base_sha: The sha of the commit analyzed in the previous run
+    :param head_sha: The sha of the commit being analyzed now
+    :param context: The context object containing all the config information as well as created Github resources.
+    :return: The changed paths or None if they can't be determined (in which case everything should be analyzed).
+    """
+    changes = compare_commits(base_sha, head_sha, context)
+    if changes is None:
+        return None
+
+    changed, removed = changes
+    return changed | removed
+
+
+def reuse_analysis(analysis: FileAnalysis, context: DocCheckerContext) -> FileAnalysis:
+    """
+    Updates an analysis from a previous run for today.  The file itself hasn't changed but it may have become stale
+    since then.
+    """
+    if analysis.last_change:
+        analysis.file_changed_recently = changed_within_days(analysis.last_change, context.doc_is_stale_after_days)
+
+    return analysis
+
+
+def iter_github_analyses(path: str, context: DocCheckerContext) -> Iterator[FileAnalysis]:
+    """
+    Enumerates all the files in a github repo's tree starting at the given path and generates a FileAnalysis for
+    each matching file (based on context) as soon as it's ready.  The files are analyzed in chunks: the history of
+    a chunk is retrieved in one request and then the files in it are analyzed (concurrently if there are multiple
+    workers).  If a state path is given, only the files that changed since the previous run are analyzed again and
+    the results are saved for the next run once all the files have been analyzed.
+    :param path: The path within the repo to start the search from.
+    :param context: The context object containing all the config information as well as created Github resources.
+    :return: Yields FileAnalysis objects in no particular order.
+    """
+    target = f"{context.github_repo_owner}/{context.github_repo}@{context.github_branch}:{path}"
+    head_sha = None
+    previous = None
+    changed = None
+    if context.state_path:
+        with github_call(context, "get_branch"):
+            head_sha = context.repo_ob.get_branch(context.github_branch).commit.sha
+
+        previous = load_state(context.state_path)
+        if previous and previous.target == target:
+            changed = _changed_paths(previous.head_sha, head_sha, context)
+
+    with metrics.phase("enumerate"):
+        files = enumerate_github_files(path, context)
+    info(f"Found {len(files)} files to analyze under {path}")
+
+    # Analyses that failed have no identifier - leaving them out of the state means they will be analyzed
+    #   again next time.
+    state_analyses = {}
+
+    if changed is not None:
+        unchanged = [f for f in files if f.path not in changed and f.path in previous.analyses]
+        files = [f for f in files if f.path in changed or f.path not in previous.analyses]
+        info(f"Reusing the analysis of {len(unchanged)} unchanged files from the previous run", 1)
+        for f in unchanged:
+            analysis = reuse_analysis(previous.analyses[f.path], context)
+            state_analyses[f.path] = analysis
+            yield analysis
+
+    for analysis in analyze_github_files(files, context):
+        if context.state_path and analysis.file_identifier:
+            state_analyses[analysis.file_identifier] = analysis
+        yield analysis
+
+    if context.state_path:
+        save_state(context.state_path, AnalysisState(target, head_sha, state_analyses))
+
 
-    return analyses
+def analyze_github_files(files: List[RepoFile], context: DocCheckerContext) -> Iterator[FileAnalysis]:
+    """
+    Analyzes the given files in chunks: the history of a chunk is retrieved in one request and then the files in
+    it are analyzed (concurrently if there are multiple workers).
+    :param files: The files to analyze (the sha may be None if it isn't known)
+    :param context: The context object containing all the config information as well as created Github resources.
+    :return: Yields FileAnalysis objects in the order of the files.
+    """
+    last_changes = {}
+
+    def analyze(f: RepoFile) -> FileAnalysis:
+        with grouped():
+            return analyze_github_file(context.repo_ob, f.path, context, last_changes.get(f.path), f.sha)
+
+    # Almost all the time is spent waiting on the network so threads are enough here.  All the workers share
+    #   the request budget in the context so more workers doesn't mean more requests at once than github allows.
+    executor = ThreadPoolExecutor(max_workers=context.workers) if context.workers > 1 else None
+    chunk_size = context.github_history_batch_size or ANALYSIS_CHUNK_SIZE
+    try:
+        for start in range(0, len(files), chunk_size):
+            chunk = files[start:start + chunk_size]
+            if context.github_history_batch_size > 0:
+                last_changes = fetch_last_changes([f.path for f in chunk], context)
+
+            for analysis in (executor.map(analyze, chunk) if executor else map(analyze, chunk)):
+                if analysis:
+                    yield analysis
+    finally:
+        if executor:
+            executor.shutdown()
+
+
+def analyze_github_path(path: str, context: DocCheckerContext) -> List[FileAnalysis]:
+    """
+    Generates a list of FileAnalysis objects for each matching file (based on context) under the given path.
+    :param path: The path within the repo to start the search from.
+    :param context: The context object containing all the config information as well as created Github resources.
+    :return: A list of FileAnalysis objects from the oldest change to the newest.
+    """
+    return sorted(iter_github_analyses(path, context), key=by_last_change)
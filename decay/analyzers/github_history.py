@@ -0,0 +1,114 @@
+from collections import namedtuple
+from typing import Dict, List, Union
+
+import arrow
+
+from decay.context import DocCheckerContext
+from decay.feedback import info, error
+from decay.util import as_utc
+
+# The most recent change to a single file.
+LastChange = namedtuple("LastChange", ["date", "name", "email"])
+
+history_query_template = \
+    """
+query({variables}) {{
+  repository(owner: $owner, name: $name) {{
+    object(expression: $ref) {{
+      ... on Commit {{
+{histories}
+      }}
+    }}
+  }}
+}}
+"""
+history_item_template = ("        p{index}: history(first: 1, path: $p{index}) "
+                         "{{ nodes {{ committer {{ date name email }} }} }}")
+
+
+def build_history_query(count: int) -> str:
+    """
+    Builds a query that asks for the latest commit of `count` paths at once using one aliased `history` field per
+    path.  The paths themselves are passed in as the variables $p0...$pN.
+    :param count: The number of paths in the batch
+    :return: The GraphQL query
+    """
+    variables = ["$owner: String!", "$name: String!", "$ref: String!"]
+    variables.extend([f"$p{i}: String!" for i in range(count)])
+    histories = [history_item_template.format(index=i) for i in range(count)]
+    return history_query_template.format(variables=", ".join(variables), histories="\n".join(histories))
+
+
+def _fetch_batch(paths: List[str], context: DocCheckerContext) -> Dict[str, LastChange]:
+    variables = {
+        "owner": context.github_repo_owner,
+        "name": context.github_repo,
+        "ref": context.github_branch
+    }
+    for i, p in enumerate(paths):
+        variables[f"p{i}"] = p
+
+    # the shared session counts the request against the Github budget and observes the rate limit headers
+    response = context.http.post(context.github_graphql_url,
+                                 json={"query": build_history_query(len(paths)), "variables": variables},
+                                 headers={"Authorization": f"bearer {context.github_token}"})
+    response.raise_for_status()
+    result = response.json()
+    if result.get("errors"):
+        raise ValueError("; ".join(e.get("message", str(e)) for e in result["errors"]))
+
+    commit = ((result.get("data") or {}).get("repository") or {}).get("object") or {}
+
+    changes = {}
+    for i, p in enumerate(paths):
+        history = commit.get(f"p{i}")
+        if history and history["nodes"]:
+            committer = history["nodes"][0]["committer"]
+            changes[p] = LastChange(as_utc(arrow.get(committer["date"]).datetime), committer["name"],
+                                    committer["email"])
+
+    return changes
+
+
+def fetch_last_changes(paths: List[str], context: DocCheckerContext) -> Dict[str, LastChange]:
+    """
+    Retrieves the most recent commit for each of the given paths using the GraphQL API.  The paths are requested
+    in batches of `github_history_batch_size` so a single request covers many files.  Paths that could not be
+    resolved (because of an error or because they have no history) are left out of the result.
+    :param paths: The paths in the repo (as in "lib/myfile.md")
+    :param context: The context object containing all the config information.
+    :return: A dict mapping each resolved path to its last change.
+    """
+    changes = {}
+    batch_size = context.github_history_batch_size
+    info(f"Retrieving the last change of {len(paths)} files in batches of {batch_size}...")
+    for start in range(0, len(paths), batch_size):
+        batch = paths[start:start + batch_size]
+        try:
+            changes.update(_fetch_batch(batch, context))
+        except Exception as e:
+            error(f"Unable to retrieve the history of {len(batch)} files starting with {batch[0]}: {str(e)}", 1)
+
+    return changes
+
+
+def fetch_last_change(path_to_file: str, context: DocCheckerContext) -> Union[LastChange, None]:
+    """
+    Retrieves the most recent commit for a single path using the REST API.  Only the first commit is requested and
+    the request goes through the context's session so it's made conditional when a cached response exists.
+    :param path_to_file: The path in the repo (as in "lib/myfile.md")
+    :param context: The context object containing all the config information.
+    :return: The last change or None if the file has no history.
+    """
+    response = context.http.get(f"{context.github_api_url}/repos/{context.github_repo_owner}/"
+                                f"{context.github_repo}/commits",
+                                params={"sha": context.github_branch, "path": path_to_file, "per_page": 1},
+                                headers={"Authorization": f"token {context.github_token}"})
+    response.raise_for_status()
+
+    commits = response.json()
+    if not commits:
+        return None
+
+    committer = commits[0]["commit"]["committer"]
+    return LastChange(as_utc(arrow.get(committer["date"]).datetime), committer["name"], committer["email"])
@@ -0,0 +1,227 @@
+import os
+import re
+import subprocess
+from typing import Dict, Iterable, Iterator, List, Set, Union
+from urllib.parse import urlparse
+
+import arrow
+
+from decay.analyzers import FileAnalysis
+from decay.analyzers.github import should_analyze_file
+from decay.analyzers.github_history import LastChange
+from decay.analyzers.metadata import apply_frontmatter, report_analysis
+from decay.context import DocCheckerContext
+from decay.feedback import info, error, warning
+from decay.metrics import metrics
+from decay.pipeline import by_last_change
+from decay.util import as_utc, changed_within_days
+
+# Every commit in the log starts with a line beginning with this separator followed by the commit sha and the
+#   committer date, name and email separated by FIELD_SEPARATOR.  The lines that follow (up to the next commit) are
+#   the changed files.
+COMMIT_SEPARATOR = "\x1e"
+FIELD_SEPARATOR = "\x1f"
+LOG_FORMAT = "--format=%x1e%H%x1f%cI%x1f%cn%x1f%ce"
+
+
+def _git(repo_path: str, *args) -> List[str]:
+    return ["git", "-C", repo_path, "-c", "core.quotePath=false", *args]
+
+
+def list_local_files(repo_path: str, folder: str) -> List[str]:
+    """
+    Lists the files tracked by git under the given folder of a local checkout.
+    :param repo_path: The root of the local checkout
+    :param folder: The folder within the checkout to list (relative to the root)
+    :return: The paths of the tracked files relative to the root of the checkout.
+    """
+    folder = (folder or "").strip("/") or "."
+    output = subprocess.run(_git(repo_path, "ls-files", "-z", "--", folder), check=True,
+                            stdout=subprocess.PIPE).stdout
+    return [p for p in output.decode("utf-8").split("\0") if p]
+
+
+def shallow_commits(repo_path: str) -> Set[str]:
+    """
+    Finds the commits at the edge of the history of a shallow clone.  Their parents weren't fetched so the log
+    shows every file of the clone as changed by them.
+    :param repo_path: The root of the local checkout
+    :return: The shas of the commits (empty if the clone has its full history).
+    """
+    shallow = subprocess.run(_git(repo_path, "rev-parse", "--is-shallow-repository"), check=True,
+                             stdout=subprocess.PIPE, encoding="utf-8").stdout.strip()
+    if shallow != "true":
+        return set()
+
+    path = subprocess.run(_git(repo_path, "rev-parse", "--git-path", "shallow"), check=True,
+                          stdout=subprocess.PIPE, encoding="utf-8").stdout.strip()
+    with open(os.path.join(repo_path, path), "r", encoding="utf-8") as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def read_last_changes(repo_path: str, paths: Iterable[str], folder: str) -> Dict[str, LastChange]:
+    """
+    Finds the last change to each of the given paths with a single pass over `git log`.  The log is streamed from
+    the newest commit to the oldest and reading stops as soon as every path has been attributed.  In a shallow
+    clone, the paths that weren't changed since its oldest commit are left out (with a warning) since the date of
+    their last change isn't known.
+    :param repo_path: The root of the local checkout
+    :param paths: The paths (relative to the root) to attribute
+    :param folder: The folder within the checkout that contains all the paths (limits the log to this folder)
+    :return: A dict mapping each attributed path to its last change.
+    """
+    pending = set(paths)
+    changes = {}
+    folder = (folder or "").strip("/") or "."
+    edge = shallow_commits(repo_path)
+
+    process = subprocess.Popen(_git(repo_path, "log", "--name-only", "--no-renames", LOG_FORMAT, "HEAD", "--",
+                                    folder),
+                               stdout=subprocess.PIPE, encoding="utf-8")
+    try:
+        commit = None
+        for line in process.stdout:
+            line = line.rstrip("\n")
+            if line.startswith(COMMIT_SEPARATOR):
+                sha, date, name, email = line[1:].split(FIELD_SEPARATOR, 3)
+                # the files listed for the commits at the edge of a shallow clone weren't necessarily changed there
+                commit = None if sha in edge else LastChange(as_utc(arrow.get(date).datetime), name, email)
+
+            elif commit and line and line in pending:
+                changes[line] = commit
+                pending.discard(line)
+                if not pending:
+                    break
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.terminate()
+        process.wait()
+
+    if edge and pending:
+        warning(f"{repo_path} is a shallow clone - the last change of {len(pending)} files isn't part of its "
+                f"history so they're not reported as stale.  Fetch the full history with `git fetch --unshallow`.",
+                1)
+    return changes
+
+
+def github_web_url(api_url: str) -> str:
+    """
+    The address of the Github website served next to the given REST API: github.com for api.github.com and the
+    host itself for Github Enterprise (whose API is under /api/v3).
+    """
+    parts = urlparse(api_url)
+    if parts.netloc == "api.github.com":
+        return "https://github.com"
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def remote_web_url(repo_path: str) -> Union[str, None]:
+    """
+    The web address of the repo the `origin` remote of a local checkout points to.  Both ssh (git@host:owner/repo)
+    and http(s) remotes are understood.
+    :param repo_path: The root of the local checkout
+    :return: The address or None if there is no origin (or it's a path on disk).
+    """
+    remote = subprocess.run(_git(repo_path, "remote", "get-url", "origin"), stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL, encoding="utf-8").stdout.strip()
+    match = re.match(r"^[\w.-]+@([\w.-]+):/?(.+?)(?:\.git)?/?$", remote)
+    if match:
+        return f"https://{match.group(1)}/{match.group(2)}"
+
+    parts = urlparse(remote)
+    if parts.scheme not in ("http", "https", "ssh", "git") or not parts.hostname:
+        return None
+    path = parts.path.strip("/")
+    path = path[:-len(".git")] if path.endswith(".git") else path
+    return f"{'http' if parts.scheme == 'http' else 'https'}://{parts.hostname}/{path}"
+
+
+def local_link_base(context: DocCheckerContext) -> Union[str, None]:
+    """
+    The web address of the repo that the links to the files of a local checkout point into.  If the github owner
+    and repo are given, it's the repo on the Github instance of `github_api_url`.  Otherwise, it's the repo of the
+    checkout's origin remote.
+    :return: The address or None if the files are only on disk.
+    """
+    if context.github_repo_owner and context.github_repo:
+        return f"{github_web_url(context.github_api_url)}/{context.github_repo_owner}/{context.github_repo}"
+    return remote_web_url(context.local_repo_path)
+
+
+def local_file_link(path_to_file: str, context: DocCheckerContext, link_base: Union[str, None] = None) -> str:
+    """
+    Generates the link to a file in a local checkout.  If the web address of the repo is known (see
+    local_link_base), the link points to the file there.  Otherwise, it's the path to the file on disk.
+    """
+    if link_base:
+        return f"{link_base}/blob/{context.github_branch}/{path_to_file}"
+
+    return os.path.join(context.local_repo_path, path_to_file)
+
+
+def analyze_local_file(path_to_file: str, context: DocCheckerContext,
+                       last_change: LastChange = None, link_base: Union[str, None] = None) -> FileAnalysis:
+    """
+    Reads a file from the local checkout and generates the same analysis that would be produced for the file on
+    Github.
+    :param path_to_file: The path to the file relative to the root of the checkout
+    :param context: The context object containing all the config information.
+    :param last_change: The last change to the file as found in the log (if any)
+    :param link_base: The web address of the repo (see local_link_base)
+    :return:
+    """
+    analysis = FileAnalysis()
+
+    info(f"Checking file {path_to_file}...")
+    try:
+        if last_change:
+            analysis.file_changed_recently = changed_within_days(last_change.date, context.doc_is_stale_after_days)
+            analysis.last_change = last_change.date
+            analysis.changed_by_email = last_change.email
+            analysis.changed_by_name = last_change.name
+
+        analysis.file_link = local_file_link(path_to_file, context, link_base)
+        analysis.file_identifier = path_to_file
+
+        with open(os.path.join(context.local_repo_path, path_to_file), "rb") as f:
+            apply_frontmatter(analysis, f, path_to_file, context.email_validator)
+
+        report_analysis(analysis)
+
+    except Exception as e:
+        error(f"Unable to load analysis due to exception: {str(e)} ", 1)
+
+    return analysis
+
+
+def iter_local_analyses(path: str, context: DocCheckerContext) -> Iterator[FileAnalysis]:
+    """
+    Analyzes all the matching files under the given folder of a local git checkout.  No network requests are made:
+    the files are read from disk and the last change of every file comes from a single pass over the log.
+    :param path: The folder within the checkout to start the search from.
+    :param context: The context object containing all the config information.
+    :return: Yields FileAnalysis objects in no particular order.
+    """
+    try:
+        with metrics.phase("enumerate"):
+            files = [f for f in list_local_files(context.local_repo_path, path) if should_analyze_file(f, context)]
+        info(f"Found {len(files)} files to analyze under {path}")
+        last_changes = read_last_changes(context.local_repo_path, files, path)
+        link_base = local_link_base(context)
+    except Exception as e:
+        error(f"Received exception while reading the history of {context.local_repo_path}: {str(e)}", 1)
+        return
+
+    for f in files:
+        yield analyze_local_file(f, context, last_changes.get(f), link_base)
+
+
+def analyze_local_path(path: str, context: DocCheckerContext) -> List[FileAnalysis]:
+    """
+    Generates a list of FileAnalysis objects for each matching file under the given folder of a local checkout.
+    :param path: The folder within the checkout to start the search from.
+    :param context: The context object containing all the config information.
+    :return: A list of FileAnalysis objects from the oldest change to the newest.
+    """
+    return sorted(iter_local_analyses(path, context), key=by_last_change)
@@ -0,0 +1,82 @@
+import io
+from typing import BinaryIO, Iterable, Union
+
+import yaml
+from decay.analyzers import FileAnalysis
+from decay.feedback import info, error, warning
+from decay.validation import EmailValidator, InvalidEmail
+
+# The line that opens and closes the frontmatter header of a document.
+FRONTMATTER_DELIMITER = b"---"
+
+
+def read_frontmatter_header(lines: Iterable[bytes]) -> Union[dict, None]:
+    """
+    Reads the YAML header at the top of a document.  Lines are consumed only up to the closing delimiter so the
+    body of the document is never read or parsed.
+    :param lines: The lines of the document (a binary file object works)
+    :return: The fields in the header (empty if there is no header) or None if the header could not be parsed.
+    """
+    lines = iter(lines)
+    first = next(lines, b"")
+    if first.lstrip(b"\xef\xbb\xbf").rstrip() != FRONTMATTER_DELIMITER:
+        return {}
+
+    header = []
+    for line in lines:
+        if line.rstrip() == FRONTMATTER_DELIMITER:
+            break
+        header.append(line)
+    else:
+        return None
+
+    try:
+        fields = yaml.safe_load(b"".join(header))
+    except yaml.YAMLError:
+        return None
+
+    return fields if isinstance(fields, dict) else {}
+
+
+def apply_frontmatter(analysis: FileAnalysis, content: Union[bytes, BinaryIO], path_to_file: str,
+                      validator: Union[EmailValidator, None] = None):
+    """
+    Reads the frontmatter of a document and fills in the document name and the owner of the given analysis.
+    :param analysis: The analysis to update
+    :param content: The raw content of the document or a binary file object positioned at the start of it (in
+        which case only the header is read)
+    :param path_to_file: The path to the file (used as the name when the document has no title)
+    :param validator: Checks the owner's address (the context's validator remembers the result for each owner)
+    :return:
+    """
+    if not content:
+        return
+
+    metadata = read_frontmatter_header(io.BytesIO(content) if isinstance(content, bytes) else content)
+    if metadata is None:
+        error(f"There was a problem when reading the frontmatter for {path_to_file}", 1)
+    else:
+        if 'title' in metadata:
+            analysis.doc_name = metadata['title']
+        else:
+            analysis.doc_name = path_to_file
+
+        if 'owner' in metadata:
+            analysis.owner = metadata['owner']
+            try:
+                analysis.owner = (validator or EmailValidator()).validate(analysis.owner)
+            except InvalidEmail as e:
+                warning(f"Found an owner but the email {analysis.owner} is not valid: " + str(e), 1)
+                analysis.owner = None
+
+
+def report_analysis(analysis: FileAnalysis):
+    """
+    Prints the results of analyzing a single file.
+    :param analysis: The analysis to print
+    :return:
+    """
+    info(f"Owner: {analysis.owner if analysis.owner else 'Not found'}", 1)
+    info(f"Changed On: {analysis.last_change if analysis.last_change else 'Not found'}", 1)
+    info(f"Is Stale: {'No' if analysis.file_changed_recently else 'Yes'}", 1)
+    info(f"Changed By: {analysis.changed_by_email if analysis.changed_by_email else 'Not found'}", 1)
@@ -0,0 +1,114 @@
+import gzip
+import json
+import os
+from typing import IO, Iterator, Union
+
+from decay.analyzers import FileAnalysis
+from decay.history import history_target
+from decay.pipeline import Consumer
+from decay.util import changed_within_days
+
+ARTIFACT_VERSION = 2
+
+SOURCE_LOCAL = "local"
+SOURCE_GITHUB = "github"
+SOURCE_CONFLUENCE = "confluence"
+SOURCE_TARGETS = "targets"
+
+
+def artifact_source(context) -> Union[dict, None]:
+    """
+    Describes the documentation source given in the context: its kind and the same identity the history uses (the
+    path of a checkout, the repo, branch and folder on Github or the parent page in Confluence).  A run of a targets
+    file is identified by the path of the file.
+    :return: The description or None if no source was given.
+    """
+    if context.targets:
+        return {"kind": SOURCE_TARGETS, "id": os.path.abspath(context.targets)}
+    if context.local:
+        return {"kind": SOURCE_LOCAL, "id": history_target(context)}
+    if context.github_token:
+        return {"kind": SOURCE_GITHUB, "id": history_target(context)}
+    if context.confluence_hostname and context.confluence_parent_page_id:
+        return {"kind": SOURCE_CONFLUENCE, "id": history_target(context)}
+    return None
+
+
+def _open(path: str, mode: str) -> IO[str]:
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class AnalysisWriter(Consumer):
+    """
+    Streams the analyses of a run to a file so that other runs can mark the documents or send the reports without
+    analyzing the source again.  The file has a header line followed by one line of JSON per analysis (gzipped if the
+    path ends with .gz).  The header names the source that was analyzed (see artifact_source) so that the analyses
+    can't be replayed against another one.  It's written under a temporary name and only moved into place once every
+    analysis is in so that a run reading it never sees a partial file.
+    """
+    phase = "output"
+
+    def __init__(self, path: str, source: Union[dict, None]):
+        self.path = path
+        self.count = 0
+        self._temp_path = path + ".tmp" + (".gz" if path.endswith(".gz") else "")
+        self._file = _open(self._temp_path, "w")
+        self._write({"version": ARTIFACT_VERSION, "source": source})
+
+    def _write(self, data: dict):
+        self._file.write(json.dumps(data, separators=(",", ":")))
+        self._file.write("\n")
+
+    def consume(self, analysis: FileAnalysis):
+        if not analysis.file_identifier:
+            # the analysis failed
+            return
+
+        self._write({k: v for k, v in analysis.to_dict().items() if v is not None})
+        self.count += 1
+
+    def finish(self):
+        self._file.close()
+        os.replace(self._temp_path, self.path)
+
+
+def read_analyses(path: str, stale_after_days: int, source: Union[dict, None] = None) -> Iterator[FileAnalysis]:
+    """
+    Opens a file written by an AnalysisWriter.  The header is checked right away and the analyses are read one at a
+    time as they're iterated.  The staleness of each document is worked out again for the current date and
+    `stale_after_days` since the file may have been written a while ago.
+    :param path: The path to the file
+    :param stale_after_days: The number of days after which a document is stale
+    :param source: The source the analyses are used for (see artifact_source) - they must be of that source
+    :raises ValueError: If the file wasn't written by a compatible version of decay or is of another source.
+    """
+    f = _open(path, "r")
+    try:
+        header = json.loads(f.readline() or "{}")
+    except (ValueError, OSError):
+        header = {}
+
+    if header.get("version") != ARTIFACT_VERSION:
+        f.close()
+        raise ValueError(f"{path} does not contain analyses written by this version of decay")
+
+    written = header.get("source") or {}
+    if source and (written.get("kind"), written.get("id")) != (source["kind"], source["id"]):
+        f.close()
+        raise ValueError(f"{path} contains the analyses of {written.get('kind')} {written.get('id')} and not "
+                         f"{source['kind']} {source['id']}")
+
+    return _iter_analyses(f, stale_after_days)
+
+
+def _iter_analyses(f: IO[str], stale_after_days: int) -> Iterator[FileAnalysis]:
+    with f:
+        for line in f:
+            if not line.strip():
+                continue
+            analysis = FileAnalysis.from_dict(json.loads(line))
+            if analysis.last_change:
+                analysis.file_changed_recently = changed_within_days(analysis.last_change, stale_after_days)
+            yield analysis
@@ -0,0 +1,191 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from typing import Dict, Union
+
+import requests
+
+# A cached response body along with the validators that can be used to ask the server if it has changed.
+CacheEntry = namedtuple("CacheEntry", ["body", "etag", "last_modified"])
+
+# How long to wait for another process that is writing to the cache.
+LOCK_TIMEOUT_SECONDS = 60
+
+# The times cached entries are used are written to the database after this many hits or this many seconds.
+ACCESS_FLUSH_COUNT = 200
+ACCESS_FLUSH_SECONDS = 5
+
+# The content of a file as it was read during the analysis along with its blob sha.
+StoredContent = namedtuple("StoredContent", ["content", "sha"])
+
+
+class ResponseCache(object):
+    """
+    A persistent cache of response bodies stored in a sqlite database.  Entries are keyed either by URL (in which
+    case the ETag and Last-Modified validators are stored too so that conditional requests can be made) or by an
+    immutable identifier such as a blob sha.  Once the total size of the cached bodies grows over `max_bytes`, the
+    least recently used entries are evicted.
+
+    The database can be shared by several processes (the workers analyzing the targets of a targets file).  The total
+    size is kept as a running count in the database (updated along with the entries) so it never has to be summed up
+    again, and the times entries are used are written in batches (every ACCESS_FLUSH_COUNT hits or
+    ACCESS_FLUSH_SECONDS) rather than on every hit.
+    """
+    def __init__(self, path: str, max_bytes: int):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=LOCK_TIMEOUT_SECONDS, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # with WAL, commits are only synced to disk at checkpoints (a crash may lose the last entries, not the file)
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, body BLOB, etag TEXT, "
+                         "last_modified TEXT, size INTEGER, last_used REAL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER)")
+        self._db.execute("INSERT OR IGNORE INTO totals (id, size) "
+                         "SELECT 0, COALESCE(SUM(size), 0) FROM entries")
+        self._db.commit()
+        self._used: Dict[str, float] = {}
+        self._flushed_at = time.monotonic()
+
+    def get(self, key: str) -> Union[CacheEntry, None]:
+        """
+        Retrieves the entry with the given key and marks it as recently used.
+        :param key: The URL or identifier of the entry
+        :return: The entry or None if there isn't one.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT body, etag, last_modified FROM entries WHERE key = ?", (key,)).fetchone()
+            if not row:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._used[key] = time.time()
+            if len(self._used) >= ACCESS_FLUSH_COUNT or time.monotonic() - self._flushed_at >= ACCESS_FLUSH_SECONDS:
+                self._flush_used()
+                self._db.commit()
+            return CacheEntry(bytes(row[0]), row[1], row[2])
+
+    def put(self, key: str, body: bytes, etag: str = None, last_modified: str = None):
+        """
+        Stores an entry (replacing any existing entry with the same key) and evicts old entries if the cache is
+        over its size limit.
+        """
+        with self._lock:
+            # the write lock is taken right away so that other processes can't change the total in the meantime
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                replaced = self._db.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+                self._db.execute("INSERT OR REPLACE INTO entries (key, body, etag, last_modified, size, last_used) "
+                                 "VALUES (?, ?, ?, ?, ?, ?)",
+                                 (key, body, etag, last_modified, len(body), time.time()))
+                self._used.pop(key, None)
+                total = self._add_to_total(len(body) - (replaced[0] if replaced else 0))
+                if total > self.max_bytes:
+                    self._evict(total)
+                self._db.commit()
+            except BaseException:
+                self._db.rollback()
+                raise
+
+    def size(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT size FROM totals").fetchone()[0]
+
+    def _add_to_total(self, change: int) -> int:
+        self._db.execute("UPDATE totals SET size = size + ?", (change,))
+        return self._db.execute("SELECT size FROM totals").fetchone()[0]
+
+    def _flush_used(self):
+        if self._used:
+            self._db.executemany("UPDATE entries SET last_used = ? WHERE key = ?",
+                                 [(used, key) for key, used in self._used.items()])
+            self._used.clear()
+        self._flushed_at = time.monotonic()
+
+    def _evict(self, total: int):
+        self._flush_used()
+        evicted = []
+        removed = 0
+        for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY last_used ASC"):
+            if total - removed <= self.max_bytes:
+                break
+            evicted.append((key,))
+            removed += size
+
+        self._db.executemany("DELETE FROM entries WHERE key = ?", evicted)
+        self._add_to_total(-removed)
+
+    def close(self):
+        with self._lock:
+            self._flush_used()
+            self._db.commit()
+            self._db.close()
+
+
+class CachingSession(requests.Session):
+    """
+    A requests session that makes GET requests conditional when a cached copy of the response exists.  If the
+    server answers with 304 Not Modified, the cached body is returned as if it had been sent again (Github doesn't
+    count these against the rate limit).  Without a cache, this behaves like a regular session.
+    """
+    def __init__(self, cache: Union[ResponseCache, None] = None):
+        super().__init__()
+        self.cache = cache
+
+    def request(self, method, url, params=None, headers=None, **kwargs):
+        if not self.cache or method.upper() != "GET":
+            return super().request(method, url, params=params, headers=headers, **kwargs)
+
+        key = requests.Request(method, url, params=params).prepare().url
+        entry = self.cache.get(key)
+        headers = dict(headers or {})
+        if entry:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+
+        response = super().request(method, url, params=params, headers=headers, **kwargs)
+        if response.status_code == 304 and entry:
+            response.status_code = 200
+            response._content = entry.body
+            response.from_cache = True
+        elif response.status_code == 200:
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+            if etag or last_modified:
+                self.cache.put(key, response.content, etag, last_modified)
+
+        return response
+
+
+class ContentStore(object):
+    """
+    Keeps the content and blob sha of the files read during the analysis so that the markers can rewrite them
+    without downloading them again.  Only the files that are going to be marked should be put here and each entry
+    is removed once it has been used.
+    """
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def put(self, path: str, content: bytes, sha: str):
+        with self._lock:
+            self._entries[path] = StoredContent(content, sha)
+
+    def pop(self, path: str) -> Union[StoredContent, None]:
+        with self._lock:
+            return self._entries.pop(path, None)
@@ -0,0 +1,131 @@
+import time
+from typing import Iterator, List, Tuple, Union
+
+import requests
+from pyfluence import Confluence
+from pyfluence.confluence import ConfluenceResponseError, METHOD_GET, METHOD_POST, METHOD_PUT, METHOD_DELETE, \
+    METHOD_OPTIONS, METHOD_HEAD
+
+
+class ConfluenceClient(Confluence):
+    """
+    The pyfluence client makes every request through the requests module directly.  This sends them through the
+    given session instead so that connections are reused and GET responses can be served from the cache.
+    """
+    def __init__(self, username: str, password: str, host: str, session: requests.Session = None):
+        super().__init__(username, password, host)
+        self.session = session or requests.Session()
+
+    def _url(self, path: str, api: str = None) -> str:
+        api = api if api is not None else "rest/api/"
+        path = path[1:] if path[0] == "/" else path
+        host = self.host[0:-1] if self.host[-1] == "/" else self.host
+        return "{host}/{api}{path}".format(host=host, api=api, path=path)
+
+    def _query(self, path: str, data: dict = None, method: str = METHOD_GET, expand: List[str] = (),
+               files: dict = None, headers: dict = None, sync: bool = True, api_root: str = None):
+        url = self._url(path, api_root)
+
+        data = data or {}
+        data['expand'] = ",".join(expand)
+
+        # use form encoding for params if a file is given, otherwise assume that we can
+        #   put JSON in the body.
+        json_params = form_params = None
+        if files:
+            form_params = data
+        else:
+            json_params = data
+
+        auth = (self.username, self.password)
+        if method in (METHOD_POST, METHOD_PUT):
+            response = self.session.request(method, url, data=form_params, json=json_params, files=files,
+                                            headers=headers, auth=auth)
+        elif method == METHOD_DELETE:
+            response = self.session.request(method, url, files=files, headers=headers, auth=auth)
+        elif method in (METHOD_OPTIONS, METHOD_HEAD):
+            response = self.session.request(method, url, auth=auth)
+        else:
+            response = self.session.get(url, params=data, headers=headers, auth=auth)
+
+        if response.status_code >= 400:
+            raise ConfluenceResponseError(response.status_code, response.text)
+
+        if response.status_code == 204:
+            # no content to return
+            return None
+
+        if response.status_code == 202 and sync is True:
+            # poll until complete
+            while response.status_code == 202:
+                response = self.session.get(self._url(response.json()['links']['status'], api=""), auth=auth)
+                time.sleep(1)
+
+        return response.json()
+
+    def _paginate(self, path: str, params: dict) -> Iterator[Tuple[dict, str]]:
+        """
+        Requests every page of a paginated collection by following the next links until there are none left.
+        :param path: The path to the collection (excluding the root of the API)
+        :param params: The query parameters for the first request (the next links include them after that)
+        :return: Yields each item in the collection along with the base url of its links.
+        """
+        auth = (self.username, self.password)
+        url = self._url(path)
+        while url:
+            response = self.session.get(url, params=params, auth=auth)
+            if response.status_code >= 400:
+                raise ConfluenceResponseError(response.status_code, response.text)
+
+            result = response.json()
+            links = result.get('_links', {})
+            base = links.get('base', self.host)
+            for item in result['results']:
+                yield item, base
+
+            url = base + links['next'] if links.get('next') and result['results'] else None
+            params = None
+
+    def search_descendants(self, page_id: str, expand: List[str] = ("version",),
+                           limit: int = 100) -> Iterator[Tuple[dict, str]]:
+        """
+        Finds every page below the given page (at any depth) with a CQL search, following the pagination links
+        until all pages have been returned.  Only the given fields are expanded so page bodies are never requested.
+        :param page_id: The page whose descendants should be returned
+        :param expand: The parts of each page to include in the results
+        :param limit: The number of pages to request at once
+        :return: Yields each page along with the base url of its links.
+        """
+        params = {"cql": f"ancestor = {page_id} and type = page", "expand": ",".join(expand), "limit": limit}
+        return self._paginate("content/search", params)
+
+    def get_child_pages(self, page_id: str, limit: int = 100) -> List[dict]:
+        """
+        Gets all the direct children of the given page (unlike get_children, there is no cap on the number).
+        :param page_id: The parent page
+        :param limit: The number of pages to request at once
+        :return: The child pages (without any expanded fields)
+        """
+        return [page for page, _ in self._paginate(f"content/{page_id}/child/page", {"limit": limit})]
+
+    def set_title(self, page_id: str, title: str, version: Union[int, None] = None, page_type: str = "page",
+                  message: Union[str, None] = None):
+        """
+        Changes the title of a page.  If the current version of the page isn't known, the page is read first.
+        :param page_id: The page to rename
+        :param title: The new title
+        :param version: The version number the title was worked out from
+        :param page_type: The type of the content
+        :param message: The message of the new version
+        :return: The updated page.
+        :raises ConfluenceResponseError: With a 409 status if the page was changed since that version (the title is
+            left alone so that the change isn't overwritten).
+        """
+        if version is None:
+            version = self.get_content(page_id, expand=("version",))['version']['number']
+
+        new_version = {"number": version + 1}
+        if message:
+            new_version["message"] = message
+        return self._query(f"content/{page_id}", method=METHOD_PUT,
+                           data={"title": title, "version": new_version, "type": page_type})
@@ -1,40 +1,92 @@
-from typing import List
+import datetime
+from typing import Iterable, List
 
-from decay.analyzers import FileAnalysis
+from decay.analyzers import AnalysisSet, FileAnalysis
 from decay.context import DocCheckerContext, ACTION_EMAIL_OWNER, ACTION_SEND_ADMIN_REPORT
+from decay.delivery import create_delivery
 from decay.feedback import warning, info
+from decay.history import history_target
+from decay.pipeline import Consumer, SortedRuns, run_pipeline, NEVER_CHANGED_AGE
 from decay.reports import OwnerReport, AdminReport
 
 
-def send_results(all_file_analyses: List[FileAnalysis], context: DocCheckerContext):
+class OwnerDigest(Consumer):
+    """
+    Keeps the analyses of the stale documents in a compact AnalysisSet as they arrive and, at the end, groups them
+    under each email recipient and sends one report to each recipient.
+    """
+    phase = "report"
 
-    if context.should_take_action(ACTION_EMAIL_OWNER):
-        results = {}
-        info(f"Preparing to send email to owners for {len(all_file_analyses)} documents...", 0)
-
-        # Group all the analyses into lists under each email recipient.
-        for a in all_file_analyses:
-            if not a.file_changed_recently:
-                email = a.owner if a.owner else context.administrator
-                if not email:
-                    warning(
-                        "Found an old doc but there's no one to send it to.  Consider setting the --administrator "
-                        "argument to ensure there is a recipient for any stale docs.", 1)
-                else:
-                    if email not in results:
-                        results[email] = []
-                    results[email].append(a)
+    def __init__(self, context: DocCheckerContext):
+        self.context = context
+        self.analyses = AnalysisSet()
+
+    def consume(self, a: FileAnalysis):
+        if not a.file_changed_recently:
+            self.analyses.append(a)
+
+    def finish(self):
+        if len(self.analyses) == 0:
+            return
+
+        info(f"Preparing to send email to owners for {len(self.analyses)} stale documents...", 0)
+        results = self.analyses.group_by_owner(default=self.context.administrator or "")
+        for _ in results.pop("", []):
+            warning(
+                "Found an old doc but there's no one to send it to.  Consider setting the --administrator "
+                "argument to ensure there is a recipient for any stale docs.", 1)
 
+        missing = (datetime.datetime.now(tz=datetime.timezone.utc) - NEVER_CHANGED_AGE).timestamp()
         info(f"Sending {len(results)} owner report emails...", 1)
-        for email, stale_file_analyses in results.items():
-            owner_report = OwnerReport([email], context)
-            owner_report.add_analysis(stale_file_analyses)
-            owner_report.send()
+        with create_delivery(self.context) as delivery:
+            for email, indexes in results.items():
+                owner_report = OwnerReport([email], self.context)
+                owner_report.add_analysis(self.analyses.take(self.analyses.order_by_last_change(indexes, missing)))
+                owner_report.send(delivery)
 
-    if context.should_take_action(ACTION_SEND_ADMIN_REPORT):
-        info(f"Preparing to send the administrator report via email for {len(all_file_analyses)} documents...", 0)
-        admin_report = AdminReport([context.administrator], context)
-        admin_report.add_analysis(all_file_analyses)
+
+class AdminDigest(Consumer):
+    """
+    Collects every analysis for the administrator report which is sent at the end, ordered from the oldest change
+    to the newest.
+    """
+    phase = "report"
+
+    def __init__(self, context: DocCheckerContext):
+        self.context = context
+        self.runs = SortedRuns()
+
+    def consume(self, a: FileAnalysis):
+        self.runs.add(a)
+
+    def finish(self):
+        if len(self.runs) == 0:
+            return
+
+        info(f"Preparing to send the administrator report via email for {len(self.runs)} documents...", 0)
+        trends = None
+        if self.context.history:
+            # with a targets file, the report covers every target
+            target = None if self.context.targets else history_target(self.context)
+            trends = self.context.history.trends(target, self.context.history_trend_days)
+        admin_report = AdminReport([self.context.administrator], self.context, trends)
+        admin_report.add_analysis(self.runs)
         admin_report.send()
 
 
+def result_consumers(context: DocCheckerContext) -> List[Consumer]:
+    """
+    Creates the consumers for the reports requested in the context.
+    """
+    consumers = []
+    if context.should_take_action(ACTION_EMAIL_OWNER):
+        consumers.append(OwnerDigest(context))
+
+    if context.should_take_action(ACTION_SEND_ADMIN_REPORT):
+        consumers.append(AdminDigest(context))
+
+    return consumers
+
+
+def send_results(all_file_analyses: Iterable[FileAnalysis], context: DocCheckerContext):
+    run_pipeline(all_file_analyses, result_consumers(context))
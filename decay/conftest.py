@@ -0,0 +1,97 @@
+import datetime
+import os
+import subprocess
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from decay.analyzers import FileAnalysis
+
+
+def _commit(repo, files, date, name):
+    for path, content in files.items():
+        full_path = os.path.join(repo, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, "w") as f:
+            f.write(content)
+
+    env = dict(os.environ, GIT_AUTHOR_DATE=date, GIT_COMMITTER_DATE=date, GIT_AUTHOR_NAME=name,
+               GIT_COMMITTER_NAME=name, GIT_AUTHOR_EMAIL=f"{name}@example.com",
+               GIT_COMMITTER_EMAIL=f"{name}@example.com")
+    subprocess.run(["git", "-C", repo, "add", "-A"], check=True)
+    subprocess.run(["git", "-C", repo, "commit", "-q", "-m", "change"], check=True, env=env)
+
+
+def _make_repo(path):
+    repo = str(path)
+    subprocess.run(["git", "init", "-q", repo], check=True)
+    recent = (datetime.datetime.now(tz=datetime.timezone.utc) - datetime.timedelta(days=1)).isoformat()
+    _commit(repo, {"docs/old.md": "---\ntitle: Old\nowner: Not An Email\n---\nbody",
+                   "docs/new.md": "---\ntitle: New\n---\nfirst",
+                   "docs/skip.txt": "text",
+                   "other/outside.md": "outside"}, "2019-05-01T10:00:00+00:00", "ann")
+    _commit(repo, {"docs/new.md": "---\ntitle: New\n---\nsecond"}, recent, "bob")
+    return repo
+
+
+@pytest.fixture
+def commit():
+    """
+    Commits the given files (a dict of path to content) to a repo as the given person at the given date.
+    """
+    return _commit
+
+
+@pytest.fixture
+def make_repo():
+    """
+    Creates a git repo at the given path with a stale document (docs/old.md, last changed by ann in 2019), a
+    document changed yesterday by bob (docs/new.md), a file that isn't a document and a document outside of docs.
+    """
+    return _make_repo
+
+
+@pytest.fixture
+def make_analysis():
+    """
+    Creates an analysis of a document named after its identifier.  `days_ago` sets the last change relative to `now`
+    (the current time unless given) and `stale` sets whether the document was changed recently.  Any other field of
+    the analysis can be given as well.
+    """
+    def make(identifier, owner=None, days_ago=None, stale=None, now=None, **fields):
+        analysis = FileAnalysis()
+        analysis.file_identifier = identifier
+        analysis.doc_name = identifier
+        analysis.owner = owner
+        if days_ago is not None:
+            now = now or datetime.datetime.now(tz=datetime.timezone.utc)
+            analysis.last_change = now - datetime.timedelta(days=days_ago)
+        if stale is not None:
+            analysis.file_changed_recently = not stale
+        for name, value in fields.items():
+            setattr(analysis, name, value)
+        return analysis
+
+    return make
+
+
+@pytest.fixture
+def serve():
+    """
+    Starts a fake server for the tests with the given request handler class and returns its address.  The servers
+    are shut down at the end of the test.
+    """
+    servers = []
+
+    def start(handler):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}"
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
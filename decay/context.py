@@ -1,25 +1,71 @@
 from argparse import ArgumentParser
 import argparse
-
-from pyfluence import Confluence
-
-from email_validator import validate_email, EmailNotValidError
-from github import Github, Repository, GitRef
+import subprocess
+import threading
+from typing import TYPE_CHECKING, Union
 
 from decay.feedback import error
-from decay.util import remove_leading_trailing_slashes
+from decay.matcher import PathMatcher
+from decay.validation import EmailValidator, InvalidEmail
+from decay.throttle import RateLimitBudget
+from decay.util import is_loopback, remove_leading_trailing_slashes
+
+if TYPE_CHECKING:
+    # the HTTP stack and the clients are only imported once they are needed (see DocCheckerContext)
+    from github import Github, Repository, GitRef
+    from decay.clients import ConfluenceClient
 
 ACTION_EMAIL_OWNER = 'email_owner'
 ACTION_SEND_ADMIN_REPORT = 'send_admin_report'
 ACTION_MARK = 'mark'
+ACTION_SERVE = 'serve'
+ACTION_ANALYZE = 'analyze'
+
+ACTIONS = [ACTION_EMAIL_OWNER, ACTION_SEND_ADMIN_REPORT, ACTION_MARK, ACTION_SERVE, ACTION_ANALYZE]
+
+ENUMERATE_TREE = 'tree'
+ENUMERATE_WALK = 'walk'
+
+ENUMERATION_MODES = [ENUMERATE_TREE, ENUMERATE_WALK]
+
+CONFLUENCE_FETCH_CQL = 'cql'
+CONFLUENCE_FETCH_CRAWL = 'crawl'
+
+CONFLUENCE_FETCH_MODES = [CONFLUENCE_FETCH_CQL, CONFLUENCE_FETCH_CRAWL]
+
+MARK_BULK = 'bulk'
+MARK_PER_FILE = 'file'
+
+MARK_MODES = [MARK_BULK, MARK_PER_FILE]
+
+EMAIL_BACKEND_SENDGRID = 'sendgrid'
+EMAIL_BACKEND_SMTP = 'smtp'
+
+EMAIL_BACKENDS = [EMAIL_BACKEND_SENDGRID, EMAIL_BACKEND_SMTP]
+
+EMAIL_VALIDATION_DNS = 'dns'
+EMAIL_VALIDATION_SYNTAX = 'syntax'
 
-ACTIONS = [ACTION_EMAIL_OWNER, ACTION_SEND_ADMIN_REPORT, ACTION_MARK]
+EMAIL_VALIDATION_MODES = [EMAIL_VALIDATION_DNS, EMAIL_VALIDATION_SYNTAX]
 
 
 class DocCheckerContext:
+    """
+    Holds the configuration of a run along with the things shared by everything involved in it.  The Github and
+    Confluence clients (and the modules behind them) are only loaded when they are first used so that a run only
+    pays for the backend it analyzes.
+    """
     def __init__(self, args: argparse.Namespace, parser: ArgumentParser):
-        self.github = None
-        self.confluence = None
+        from decay.cache import ResponseCache, ContentStore
+        from decay.transport import Transport
+
+        self._github: Union["Github", None] = None
+        self._repo_ob: Union["Repository", None] = None
+        self._confluence: Union["ConfluenceClient", None] = None
+        self._uses_github = False
+        self._uses_confluence = False
+        self._clients_lock = threading.Lock()
+        self.local = None
 
         self.actions = args.actions
         self.github_branch = args.github_branch
@@ -27,13 +73,38 @@ class DocCheckerContext:
         self.github_repo_owner = args.github_owner
         self.github_repo_path = args.github_repo_folder
         self.github_token = args.github_access_token
+        self.github_api_url = args.github_api_url.rstrip("/")
+        self.github_enumeration = args.github_enumeration
+        self.github_mark_mode = args.github_mark_mode
+        self.github_graphql_url = args.github_graphql_url
+        self.github_history_batch_size = args.github_history_batch_size
+        self.github_page_size = args.github_page_size
+        self.state_path = args.state_path
+        self.workers = max(1, args.workers)
+        self.github_budget = RateLimitBudget(max_in_flight=self.workers,
+                                             requests_per_second=args.github_requests_per_second)
         self.confluence_hostname = args.confluence_hostname
         self.confluence_username = args.confluence_username
         self.confluence_password = args.confluence_password
         self.confluence_parent_page_id = args.confluence_parent_page_id
+        self.confluence_fetch = args.confluence_fetch
+        self.confluence_page_size = args.confluence_page_size
+        self.confluence_concurrency = max(1, args.confluence_concurrency)
+        self.confluence_budget = RateLimitBudget(max_in_flight=self.confluence_concurrency)
+        self.local_repo_path = args.local_repo_path
+        self.local_repo_folder = args.local_repo_folder
 
         self.doc_is_stale_after_days = args.stale_age_in_days
         self.sendgrid_api_key = args.sendgrid_api_key
+        self.sendgrid_api_url = args.sendgrid_api_url
+        self.report_max_rows = args.report_max_rows
+        self.email_backend = args.email_backend
+        self.smtp_host = args.smtp_host
+        self.smtp_port = args.smtp_port
+        self.smtp_username = args.smtp_username
+        self.smtp_password = args.smtp_password
+        self.smtp_starttls = args.smtp_starttls
+        self.smtp_connections = args.smtp_connections
         self.from_email = args.from_email
         self.administrator = args.administrator
         self.extensions = args.extensions.split(",")
@@ -41,34 +112,88 @@ class DocCheckerContext:
             map(lambda x: remove_leading_trailing_slashes(x), args.ignore_paths)) if args.ignore_paths else []
         self.ignore_files = list(
             map(lambda x: remove_leading_trailing_slashes(x), args.ignore_files)) if args.ignore_files else []
-        self.ref_with_changes: GitRef = None
+        self.path_matcher = PathMatcher(self.extensions, self.ignore_paths, self.ignore_files)
+        self.ref_with_changes: Union["GitRef", None] = None
+        self.serve_host = args.serve_host
+        self.serve_port = args.serve_port
+        self.webhook_secret = args.webhook_secret
+
+        # All the requests we make ourselves (as opposed to through the github client) share this session.  It
+        #   retries failed requests and throttles each host according to its rate limit headers - the Github hosts
+        #   share the budget used for the requests made through the github client and the Confluence host has a
+        #   budget of `confluence_concurrency` requests in flight.  If a cache path was given, responses are kept
+        #   across runs and GET requests are made conditional.
+        self.cache = ResponseCache(args.cache_path, args.cache_max_mb * 1024 * 1024) if args.cache_path else None
+        self.http_retries = args.http_retries
+        self.http = Transport(self.cache, retries=self.http_retries)
+        self.http.limit(self.github_api_url, self.github_budget)
+        self.http.limit(self.github_graphql_url, self.github_budget)
+        if self.confluence_hostname:
+            self.http.limit(self.confluence_hostname, self.confluence_budget)
+
+        # The results of every run are added to the history (if a path was given) for the trends in the admin
+        #   report.  With a targets file, the admin report covers the trends of all the targets.
+        self.targets = args.targets
+        self.history_trend_days = args.history_trend_days
+        self.history_keep_days = args.history_keep_days
+        self.history = None
+        if args.history_path:
+            from decay.history import HistoryStore
+            self.history = HistoryStore(args.history_path)
+
+        # The files read by the analyzer that are going to be marked are kept here for the marker.
+        #   In serve mode files are marked long after they were read so they aren't kept.
+        #   Nothing is read when the analyses come from an input file.
+        self.contents = ContentStore() if ACTION_MARK in self.actions and ACTION_SERVE not in self.actions \
+            and not args.input_path else None
 
         if ACTION_SEND_ADMIN_REPORT in self.actions and not self.administrator:
             parser.error(
                 "With the send_admin_report action, you must specify an administrator email using 'administrator' "
                 "argument")
 
+        # Every address (the owners of the documents included) is checked once per run.  With a cache path, the
+        #   results of deliverability checks are kept across runs too.
+        self.email_validator = EmailValidator(check_deliverability=args.email_validation == EMAIL_VALIDATION_DNS,
+                                              cache=self.cache, cache_days=args.email_cache_days)
+
         if self.administrator:
             try:
-                valid = validate_email(self.administrator)
-                self.administrator = valid.email
-            except EmailNotValidError as e:
+                self.administrator = self.email_validator.validate(self.administrator)
+            except InvalidEmail as e:
                 parser.error(f"{self.administrator} is not a valid email address: " + str(e))
 
-        if self.from_email:
+        # the sender is only used (and so only checked) when email is sent
+        sends_email = ACTION_EMAIL_OWNER in self.actions or ACTION_SEND_ADMIN_REPORT in self.actions
+        if sends_email and self.from_email:
             try:
-                valid = validate_email(self.from_email)
-                self.from_email = valid.email
-            except EmailNotValidError as e:
+                self.from_email = self.email_validator.validate(self.from_email)
+            except InvalidEmail as e:
                 parser.error(f"{self.from_email} is not a valid email address: " + str(e))
 
-        if ACTION_EMAIL_OWNER in self.actions or ACTION_SEND_ADMIN_REPORT in self.actions:
-            if not self.sendgrid_api_key:
+        if sends_email:
+            if self.email_backend == EMAIL_BACKEND_SENDGRID and not self.sendgrid_api_key:
                 parser.error(f"You must specify a sendgrid token if you are sending owner or admin reports via email")
 
+            if self.email_backend == EMAIL_BACKEND_SMTP and not self.smtp_host:
+                parser.error(f"You must specify an SMTP host if you are sending owner or admin reports via SMTP")
+
             if not self.from_email:
                 parser.error(f"You must specify a 'from' email if you are sending owner or admin reports via email")
 
+        if ACTION_SERVE in self.actions and not self.webhook_secret and not is_loopback(self.serve_host):
+            parser.error(f"A webhook secret is needed to serve on {self.serve_host} - without one, the service only "
+                         f"listens on the local machine")
+
+        if self.local_repo_path:
+            try:
+                self.local_repo_path = subprocess.run(
+                    ["git", "-C", self.local_repo_path, "rev-parse", "--show-toplevel"], check=True,
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout.decode("utf-8").strip()
+                self.local = True
+            except Exception:
+                parser.error(f"{self.local_repo_path} is not a local git checkout")
+
         if self.github_token:
             if not self.github_repo_owner or not self.github_repo:
                 parser.error(f"If you are analyzing a github repo, you must specify the owner and repo")
@@ -79,17 +204,54 @@ class DocCheckerContext:
                     f"'/')")
 
             else:
-                self.github = Github(login_or_token=self.github_token, per_page=10)
-                self.repo_ob: Repository = self.github.get_repo(f"{self.github_repo_owner}/{self.github_repo}")
-                if not self.repo_ob:
-                    error(f"Unable to find the {self.github_repo_owner}/{self.github_repo} repo.")
+                self._uses_github = True
 
         if self.confluence_password:
-            try:
-                self.confluence = Confluence(self.confluence_username, self.confluence_password,
-                                             self.confluence_hostname)
-            except Exception as e:
-                error(f"Unable to establish a connection to Confluence: " + str(e))
+            self._uses_confluence = True
+
+    @property
+    def github(self) -> Union["Github", None]:
+        """
+        The Github client (None unless a Github repo is analyzed).  It's created on first use.
+        """
+        if self._uses_github and self._github is None:
+            with self._clients_lock:
+                if self._github is None:
+                    from github import Github
+                    from decay.transport import github_client_options
+                    self._github = Github(login_or_token=self.github_token, base_url=self.github_api_url,
+                                          **github_client_options(self.github_page_size, self.http_retries))
+        return self._github
+
+    @property
+    def repo_ob(self) -> Union["Repository", None]:
+        """
+        The analyzed Github repo.  It's requested on first use.
+        """
+        if self._repo_ob is None and self.github:
+            with self._clients_lock:
+                if self._repo_ob is None:
+                    self._repo_ob = self.github.get_repo(f"{self.github_repo_owner}/{self.github_repo}")
+                    if not self._repo_ob:
+                        error(f"Unable to find the {self.github_repo_owner}/{self.github_repo} repo.")
+        return self._repo_ob
+
+    @property
+    def confluence(self) -> Union["ConfluenceClient", None]:
+        """
+        The Confluence client (None unless Confluence pages are analyzed).  It's created on first use.
+        """
+        if self._uses_confluence and self._confluence is None:
+            with self._clients_lock:
+                if self._confluence is None:
+                    from decay.clients import ConfluenceClient
+                    try:
+                        self._confluence = ConfluenceClient(self.confluence_username, self.confluence_password,
+                                                            self.confluence_hostname, session=self.http)
+                    except Exception as e:
+                        self._uses_confluence = False
+                        error(f"Unable to establish a connection to Confluence: " + str(e))
+        return self._confluence
 
     def should_take_action(self, action):
         return action in self.actions
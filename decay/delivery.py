@@ -0,0 +1,241 @@
+import base64
+import queue
+import smtplib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+from typing import List, Union
+
+import requests
+
+from decay.context import DocCheckerContext, EMAIL_BACKEND_SMTP
+from decay.feedback import success, error
+from decay.transport import Transport
+
+# A rendered email ready to be delivered.
+Message = namedtuple("Message", ["recipients", "subject", "text", "html", "attachments"], defaults=((),))
+
+# A file attached to a message.
+Attachment = namedtuple("Attachment", ["filename", "content_type", "content"])
+
+SENDGRID_API_URL = "https://api.sendgrid.com/v3/mail/send"
+
+# SendGrid accepts up to this many personalizations in a single request.
+SENDGRID_MAX_PERSONALIZATIONS = 1000
+
+# The substitutions of a single personalization can't be larger than this (in bytes).  Larger messages (and messages
+#   with attachments, which can't be personalized) are sent on their own.
+SENDGRID_SUBSTITUTION_LIMIT = 10000
+
+SENDGRID_TEXT_TAG = "-decay_text-"
+SENDGRID_HTML_TAG = "-decay_html-"
+
+# The number of messages queued by the SMTP backend before they are sent.
+SMTP_BATCH_SIZE = 100
+
+
+class Delivery(object):
+    """
+    Sends rendered messages.  Messages given to `send` may be held back so that several can be delivered together -
+    `flush` delivers everything that's still pending.  Used as a context manager, everything is flushed and the
+    connections are closed on exit.
+    """
+    def __init__(self):
+        self.pending: List[Message] = []
+        self.sent = 0
+        self.failed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            self.flush()
+        finally:
+            self.close()
+
+    def send(self, message: Message):
+        self.pending.append(message)
+
+    def flush(self):
+        pending, self.pending = self.pending, []
+        if pending:
+            self._deliver(pending)
+
+    def close(self):
+        pass
+
+    def _deliver(self, messages: List[Message]):
+        raise NotImplementedError()
+
+    def _report(self, messages: List[Message], reason: Union[str, None]):
+        recipients = ", ".join(r for m in messages for r in m.recipients)
+        if reason is None:
+            self.sent += len(messages)
+            success(f"Successfully sent {len(messages)} email(s) to {recipients}", 2)
+        else:
+            self.failed += len(messages)
+            error(f"Failed to send {len(messages)} email(s) to {recipients}: {reason}", 2)
+
+
+class SendGridDelivery(Delivery):
+    """
+    Delivers messages through the SendGrid API.  Messages are packed into as few requests as possible using one
+    personalization per message (with the body passed as substitutions).  Requests that are throttled or fail on
+    the server's side are retried by the session (see Transport).
+    """
+    def __init__(self, api_key: str, from_email: str, session: requests.Session = None, url: str = SENDGRID_API_URL):
+        super().__init__()
+        self.api_key = api_key
+        self.from_email = from_email
+        self.session = session or Transport()
+        self.url = url
+
+    def send(self, message: Message):
+        super().send(message)
+        if len(self.pending) >= SENDGRID_MAX_PERSONALIZATIONS:
+            self.flush()
+
+    def _deliver(self, messages: List[Message]):
+        packed = [m for m in messages if _can_pack(m)]
+        if packed:
+            self._post(self._packed_body(packed), packed)
+
+        for message in messages:
+            if not _can_pack(message):
+                self._post(self._single_body(message), [message])
+
+    def _packed_body(self, messages: List[Message]) -> dict:
+        return {
+            "from": {"email": self.from_email},
+            "subject": messages[0].subject,
+            "content": [{"type": "text/plain", "value": SENDGRID_TEXT_TAG},
+                        {"type": "text/html", "value": SENDGRID_HTML_TAG}],
+            "personalizations": [{
+                "to": [{"email": r} for r in m.recipients],
+                "subject": m.subject,
+                "substitutions": {SENDGRID_TEXT_TAG: m.text, SENDGRID_HTML_TAG: m.html},
+            } for m in messages],
+        }
+
+    def _single_body(self, message: Message) -> dict:
+        body = {
+            "from": {"email": self.from_email},
+            "subject": message.subject,
+            "content": [{"type": "text/plain", "value": message.text},
+                        {"type": "text/html", "value": message.html}],
+            "personalizations": [{"to": [{"email": r} for r in message.recipients]}],
+        }
+        if message.attachments:
+            body["attachments"] = [{"content": base64.b64encode(a.content).decode("ascii"), "filename": a.filename,
+                                    "type": a.content_type, "disposition": "attachment"}
+                                   for a in message.attachments]
+        return body
+
+    def _post(self, body: dict, messages: List[Message]):
+        try:
+            response = self.session.post(self.url, json=body, timeout=60,
+                                         headers={"Authorization": f"Bearer {self.api_key}"})
+        except requests.RequestException as e:
+            self._report(messages, str(e))
+            return
+
+        if 300 > response.status_code >= 200:
+            self._report(messages, None)
+        else:
+            self._report(messages, f"{response.status_code} - {response.text}")
+
+
+class SmtpDelivery(Delivery):
+    """
+    Delivers messages through an SMTP server.  Connections are kept open and reused for every message and up to
+    `connections` messages are sent at the same time, each over its own connection.
+    """
+    def __init__(self, host: str, port: int, from_email: str, username: str = None, password: str = None,
+                 starttls: bool = False, connections: int = 1):
+        super().__init__()
+        self.host = host
+        self.port = port
+        self.from_email = from_email
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.connections = max(1, connections)
+        self._pool = queue.LifoQueue()
+
+    def send(self, message: Message):
+        super().send(message)
+        if len(self.pending) >= SMTP_BATCH_SIZE:
+            self.flush()
+
+    def close(self):
+        while not self._pool.empty():
+            connection = self._pool.get_nowait()
+            try:
+                connection.quit()
+            except smtplib.SMTPException:
+                pass
+
+    def _connect(self) -> smtplib.SMTP:
+        connection = smtplib.SMTP(self.host, self.port, timeout=60)
+        if self.starttls:
+            connection.starttls()
+        if self.username:
+            connection.login(self.username, self.password)
+        return connection
+
+    def _deliver(self, messages: List[Message]):
+        with ThreadPoolExecutor(max_workers=self.connections) as executor:
+            for _ in executor.map(self._send_one, messages):
+                pass
+
+    def _send_one(self, message: Message):
+        mail = EmailMessage()
+        mail["From"] = self.from_email
+        mail["To"] = ", ".join(message.recipients)
+        mail["Subject"] = message.subject
+        mail.set_content(message.text)
+        mail.add_alternative(message.html, subtype="html")
+        for attachment in message.attachments:
+            maintype, subtype = attachment.content_type.split("/")
+            mail.add_attachment(attachment.content, maintype=maintype, subtype=subtype, filename=attachment.filename)
+
+        try:
+            connection = self._pool.get_nowait()
+        except queue.Empty:
+            connection = None
+
+        try:
+            try:
+                connection = connection or self._connect()
+                connection.send_message(mail)
+            except smtplib.SMTPServerDisconnected:
+                # the server closed the pooled connection since it was last used so open a new one
+                connection = self._connect()
+                connection.send_message(mail)
+
+            self._pool.put(connection)
+            self._report([message], None)
+
+        except Exception as e:
+            if connection:
+                connection.close()
+            self._report([message], str(e))
+
+
+def create_delivery(context: DocCheckerContext) -> Delivery:
+    """
+    Creates the delivery for the email backend given in the context.
+    """
+    if context.email_backend == EMAIL_BACKEND_SMTP:
+        return SmtpDelivery(context.smtp_host, context.smtp_port, context.from_email,
+                            username=context.smtp_username, password=context.smtp_password,
+                            starttls=context.smtp_starttls, connections=context.smtp_connections)
+
+    return SendGridDelivery(context.sendgrid_api_key, context.from_email, session=context.http,
+                            url=context.sendgrid_api_url)
+
+
+def _can_pack(message: Message) -> bool:
+    size = len(message.text.encode("utf-8")) + len(message.html.encode("utf-8"))
+    return not message.attachments and size <= SENDGRID_SUBSTITUTION_LIMIT
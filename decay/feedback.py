@@ -1,6 +1,34 @@
+import threading
+from contextlib import contextmanager
+
+_output_lock = threading.Lock()
+_local = threading.local()
+
 
 def generic_msg(msg, indent=0):
-    print((indent * 2) * ' ' + msg)
+    line = (indent * 2) * ' ' + msg
+    buffer = getattr(_local, "buffer", None)
+    if buffer is not None:
+        buffer.append(line)
+    else:
+        with _output_lock:
+            print(line)
+
+
+@contextmanager
+def grouped():
+    """
+    Holds back the messages of the current thread and prints them together at the end so that the output of
+    workers running at the same time doesn't interleave.
+    """
+    _local.buffer = []
+    try:
+        yield
+    finally:
+        lines, _local.buffer = _local.buffer, None
+        with _output_lock:
+            for line in lines:
+                print(line)
 
 
 def info(msg, indent=0):
@@ -0,0 +1,212 @@
+import datetime
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from typing import Dict, List, Union
+
+from decay.analyzers import FileAnalysis
+from decay.pipeline import Consumer
+
+DEFAULT_TREND_DAYS = 7
+DEFAULT_KEEP_DAYS = 365
+
+# The number of trend windows the owner backlog goes back (the current one included).
+BACKLOG_PERIODS = 4
+
+# The most owners listed in the backlog (the ones with the most stale documents now).
+BACKLOG_MAX_OWNERS = 20
+
+# A document that was fresh at the start of the trend window and is stale now.
+NewlyStale = namedtuple("NewlyStale", ["target", "document", "name", "link", "owner", "last_change"])
+
+# The aging trends of one or all targets: the documents that became stale in the last `days` and the number of stale
+#   documents of each owner at the end of each of the last BACKLOG_PERIODS windows of `days` (the most recent first).
+Trends = namedtuple("Trends", ["days", "newly_stale", "periods", "backlog"])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, target TEXT NOT NULL, started_at REAL NOT NULL,
+                                 finished_at REAL);
+CREATE INDEX IF NOT EXISTS runs_target_started ON runs (target, started_at);
+CREATE TABLE IF NOT EXISTS results (run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+                                    document TEXT NOT NULL, name TEXT, link TEXT, owner TEXT, last_change REAL,
+                                    stale INTEGER NOT NULL, changed_by TEXT, PRIMARY KEY (run_id, document))
+                                    WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS results_document ON results (document, run_id);
+"""
+
+# The last complete run of each target (of the given target if :target isn't null) that started before :before.
+#   Sqlite returns the other columns of the row with the max for a bare MAX() aggregate.
+_LATEST_RUNS = """
+SELECT id, target, MAX(started_at) FROM runs
+WHERE finished_at IS NOT NULL AND started_at <= :before AND (:target IS NULL OR target = :target)
+GROUP BY target
+"""
+
+
+def history_target(context) -> str:
+    """
+    The name the runs of the documentation source in the context are stored under.  It's the same for every run
+    of the same source so that runs can be compared.
+    """
+    if context.local:
+        return f"{context.local_repo_path}:{context.local_repo_folder}"
+    if context.github_token:
+        return f"{context.github_repo_owner}/{context.github_repo}@{context.github_branch}:{context.github_repo_path}"
+    return f"{context.confluence_hostname}:{context.confluence_parent_page_id}"
+
+
+class HistoryStore(object):
+    """
+    The results of every run kept in a sqlite database so that reports can show how documentation ages over time
+    without analyzing anything again.  Each run of a target gets a row in `runs` and the analysis of each document
+    gets a row in `results` keyed by the run and the document.  Runs are only used once they have finished so an
+    interrupted run never shows up in the trends.
+
+    Several processes (the workers analyzing targets) can write to the same database.
+    """
+    def __init__(self, path: str):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def start_run(self, target: str, started_at: Union[float, None] = None) -> int:
+        """
+        Adds a run.  The run is only used once `finish_run` has been called.
+        :return: The id of the run.
+        """
+        with self._lock:
+            cursor = self._db.execute("INSERT INTO runs (target, started_at) VALUES (?, ?)",
+                                      (target, time.time() if started_at is None else started_at))
+            self._db.commit()
+            return cursor.lastrowid
+
+    def add_results(self, run_id: int, analyses: List[FileAnalysis]):
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO results (run_id, document, name, link, owner, last_change, stale, changed_by) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(run_id, a.file_identifier, a.doc_name, a.file_link, a.owner or None,
+                  a.last_change.timestamp() if a.last_change else None, 0 if a.file_changed_recently else 1,
+                  a.changed_by_email) for a in analyses])
+            self._db.commit()
+
+    def finish_run(self, run_id: int):
+        with self._lock:
+            self._db.execute("UPDATE runs SET finished_at = ? WHERE id = ?", (time.time(), run_id))
+            self._db.commit()
+
+    def prune(self, keep_days: float) -> int:
+        """
+        Removes the runs (and their results) older than the given number of days.
+        :return: The number of runs removed.
+        """
+        with self._lock:
+            cursor = self._db.execute("DELETE FROM runs WHERE started_at < ?", (time.time() - keep_days * 86400,))
+            self._db.commit()
+            return cursor.rowcount
+
+    def _latest_runs(self, target: Union[str, None], before: float) -> Dict[str, int]:
+        rows = self._db.execute(_LATEST_RUNS, {"target": target, "before": before}).fetchall()
+        return {t: run_id for run_id, t, _ in rows}
+
+    def newly_stale(self, target: Union[str, None] = None, days: float = DEFAULT_TREND_DAYS,
+                    now: Union[float, None] = None) -> List[NewlyStale]:
+        """
+        The documents that are stale in the latest run of each target but were fresh in the latest run at the start
+        of the window (documents without a run that old are left out - there is nothing to compare them with).
+        :param target: The target (all of them if None)
+        :param days: The length of the window
+        :param now: The end of the window (now if None)
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            current = self._latest_runs(target, now)
+            baseline = self._latest_runs(target, now - days * 86400)
+            newly_stale = []
+            for t, run_id in sorted(current.items()):
+                if t not in baseline or baseline[t] == run_id:
+                    continue
+                rows = self._db.execute(
+                    "SELECT c.document, c.name, c.link, c.owner, c.last_change FROM results c "
+                    "JOIN results b ON b.document = c.document AND b.run_id = ? "
+                    "WHERE c.run_id = ? AND c.stale = 1 AND b.stale = 0 ORDER BY c.last_change",
+                    (baseline[t], run_id))
+                newly_stale.extend(NewlyStale(t, *row) for row in rows)
+            return newly_stale
+
+    def owner_backlog(self, target: Union[str, None] = None, days: float = DEFAULT_TREND_DAYS,
+                      periods: int = BACKLOG_PERIODS, now: Union[float, None] = None) -> Dict[str, List[int]]:
+        """
+        The number of stale documents of each owner at the end of each of the last `periods` windows of `days`
+        according to the latest run of each target before then.
+        :return: The counts of each owner (the most recent window first).  Documents without an owner are counted
+            under "".
+        """
+        now = time.time() if now is None else now
+        backlog: Dict[str, List[int]] = {}
+        with self._lock:
+            for period in range(periods):
+                run_ids = list(self._latest_runs(target, now - period * days * 86400).values())
+                if not run_ids:
+                    break
+                rows = self._db.execute(
+                    f"SELECT COALESCE(owner, ''), COUNT(*) FROM results WHERE stale = 1 AND run_id IN "
+                    f"({','.join('?' * len(run_ids))}) GROUP BY COALESCE(owner, '')", run_ids)
+                for owner, count in rows:
+                    backlog.setdefault(owner, [0] * periods)[period] = count
+        return backlog
+
+    def trends(self, target: Union[str, None] = None, days: float = DEFAULT_TREND_DAYS,
+               now: Union[float, None] = None) -> Trends:
+        now = time.time() if now is None else now
+        backlog = self.owner_backlog(target, days, BACKLOG_PERIODS, now)
+        owners = sorted(backlog, key=lambda o: (-backlog[o][0], o))[:BACKLOG_MAX_OWNERS]
+        periods = [datetime.datetime.fromtimestamp(now - p * days * 86400, tz=datetime.timezone.utc).date()
+                   for p in range(BACKLOG_PERIODS)]
+        return Trends(days, self.newly_stale(target, days, now), periods, [(o, backlog[o]) for o in owners])
+
+
+class HistoryRecorder(Consumer):
+    """
+    Stores the analyses of a run in the history as they arrive, in batches.  The run is marked as finished once
+    every analysis has been stored and old runs are pruned then.
+    """
+    phase = "history"
+    batch_size = 500
+
+    def __init__(self, context, target: Union[str, None] = None):
+        self.context = context
+        self.history: HistoryStore = context.history
+        self.target = target or history_target(context)
+        self.run_id = self.history.start_run(self.target)
+        self.batch: List[FileAnalysis] = []
+
+    def consume(self, analysis: FileAnalysis):
+        if not analysis.file_identifier:
+            # the analysis failed
+            return
+
+        self.batch.append(analysis)
+        if len(self.batch) >= self.batch_size:
+            self.history.add_results(self.run_id, self.batch)
+            self.batch = []
+
+    def finish(self):
+        if self.batch:
+            self.history.add_results(self.run_id, self.batch)
+            self.batch = []
+        self.history.finish_run(self.run_id)
+        self.history.prune(self.context.history_keep_days)
@@ -2,13 +2,14 @@
 
 import configargparse
 
-from decay.markers.github import mark_github_files
-from decay.markers.confluence import mark_confluence_files
-from decay.analyzers.github import analyze_github_path
-from decay.analyzers.confluence import analyze_confluence_page_tree
-from decay.comms import send_results
-from decay.context import DocCheckerContext, ACTIONS
-from decay.feedback import error
+from decay.context import DocCheckerContext, ACTIONS, ACTION_ANALYZE, ACTION_MARK, ACTION_SERVE, ENUMERATION_MODES, \
+    ENUMERATE_TREE, CONFLUENCE_FETCH_MODES, CONFLUENCE_FETCH_CQL, MARK_MODES, MARK_BULK, \
+    EMAIL_BACKENDS, EMAIL_BACKEND_SENDGRID, EMAIL_VALIDATION_MODES, EMAIL_VALIDATION_DNS
+from decay.feedback import error, info
+from decay.artifact import AnalysisWriter, artifact_source, read_analyses
+from decay.metrics import metrics, profiled, record_cache_metrics, METRICS_FORMATS, METRICS_FORMAT_JSON
+from decay.pipeline import run_pipeline
+from decay.scheduler import load_targets, open_target, marker_for, run_targets
 
 
 def get_parser():
@@ -31,10 +32,60 @@ def get_parser():
     parser.add_argument('-x', '--extensions', dest="extensions", required=False, default=".md,.html",
                         help="These are the file extensions that will be checked within the given root")
     parser.add_argument('-i', '--ignore_path', action='append', dest="ignore_paths", required=False,
-                        help="Use this for each path that should be skipped by the decay detector.")
+                        help="Use this for each path that should be skipped by the decay detector.  Glob patterns "
+                             "like '**/legacy' are supported.")
     parser.add_argument('-n', '--ignore_file', action='append', dest="ignore_files", required=False,
                         help="Use this for each file that should be skipped by the decay detector.  This should be "
                              "the path to the file in the repo.")
+    parser.add_argument('-t', '--targets', dest="targets", required=False,
+                        help="A YAML file listing many repos, folders or pages to analyze in one run (see the README). "
+                             "The reports cover all of them.")
+    parser.add_argument('--target_processes', dest="target_processes", default=4, type=int,
+                        help="The number of targets analyzed at the same time (each in its own process)")
+    parser.add_argument('--targets_per_host', dest="targets_per_host", default=2, type=int,
+                        help="The maximum number of targets on the same host analyzed at the same time")
+    parser.add_argument('--metrics_path', dest="metrics_path", required=False,
+                        help="The path to a file to which the timings, request counts and latencies, cache hits and "
+                             "rate limits of the run are written.")
+    parser.add_argument('--metrics_format', dest="metrics_format", default=METRICS_FORMAT_JSON,
+                        choices=METRICS_FORMATS,
+                        help="The format of the metrics file.  'prometheus' can be read by the node exporter's "
+                             "textfile collector.")
+    parser.add_argument('--profile', dest="profile", required=False,
+                        help="Profile the run and save the statistics to this path (with a summary of the slowest "
+                             "functions and the largest allocations next to it in a .txt file).")
+    parser.add_argument('--output', dest="output_path", required=False,
+                        help="Also write the analyses to this file (gzipped if it ends with .gz) so that later runs "
+                             "can mark or report from it with --input.  Use the analyze action to only analyze.")
+    parser.add_argument('--input', dest="input_path", required=False,
+                        help="Read the analyses from a file written with --output instead of analyzing the source")
+    parser.add_argument('--history_path', dest="history_path", required=False,
+                        help="The path to a sqlite database the results of every run are added to.  The admin report "
+                             "then shows the docs that became stale recently and the stale docs of each owner over "
+                             "time.")
+    parser.add_argument('--history_trend_days', dest="history_trend_days", default=7, type=float,
+                        help="With history_path, the length of the window the trends in the admin report compare")
+    parser.add_argument('--history_keep_days', dest="history_keep_days", default=365, type=float,
+                        help="With history_path, runs older than this are removed from the history")
+    parser.add_argument('--serve_host', dest="serve_host", default="127.0.0.1",
+                        help="With the serve action, the address the HTTP API and webhooks listen on")
+    parser.add_argument('--serve_port', dest="serve_port", default=8080, type=int,
+                        help="With the serve action, the port the HTTP API and webhooks listen on")
+    parser.add_argument('--webhook_secret', dest="webhook_secret", required=False,
+                        help="With the serve action, the secret Github webhooks are signed with.  Confluence webhooks "
+                             "and the /stale, /reports and /mark requests must pass it in the X-Decay-Token header "
+                             "or the token query parameter.  Required unless serve_host is a loopback address")
+    parser.add_argument('-w', '--workers', dest="workers", default=1, type=int,
+                        help="The number of files to analyze at the same time.")
+    parser.add_argument('--http_retries', dest="http_retries", default=4, type=int,
+                        help="The number of times a request is retried after a connection error or a rate limited "
+                             "or failed response (with a jittered backoff)")
+    parser.add_argument('--cache_path', dest="cache_path", required=False,
+                        help="The path to a file in which responses are cached between runs.  Cached responses are "
+                             "revalidated with conditional requests and file contents are reused until they change.")
+    parser.add_argument('--cache_max_mb', dest="cache_max_mb", default=256, type=int,
+                        help="The maximum size of the response cache.  The least recently used responses are removed "
+                             "once it grows larger than this.")
 
     # CONFLUENCE OPTIONS
     parser.add_argument('--confluence_hostname', dest="confluence_hostname", required=False,
@@ -46,6 +97,14 @@ def get_parser():
                              "your actual password")
     parser.add_argument('--confluence_parent_page_id', dest="confluence_parent_page_id", required=False,
                         help="The parent page under which pages should be analyzed.")
+    parser.add_argument('--confluence_fetch', dest="confluence_fetch", default=CONFLUENCE_FETCH_CQL,
+                        choices=CONFLUENCE_FETCH_MODES,
+                        help="How pages are found.  'cql' searches for all the descendants of the parent page at "
+                             "once while 'crawl' requests the children and content of each page separately.")
+    parser.add_argument('--confluence_page_size', dest="confluence_page_size", default=100, type=int,
+                        help="The number of pages requested at once when searching for pages.")
+    parser.add_argument('--confluence_concurrency', dest="confluence_concurrency", default=8, type=int,
+                        help="The maximum number of requests made at the same time when crawling pages.")
 
     # GITHUB OPTIONS
     parser.add_argument('-o', '--github_owner', dest="github_owner", required=False,
@@ -59,14 +118,71 @@ def get_parser():
     parser.add_argument('-a', '--github_access_token', dest="github_access_token", required=False,
                         help="The personal access token to use - keeping in mind that the token needs to have access "
                              "to any SSO-protected repo")
+    parser.add_argument('--github_api_url', dest="github_api_url", default="https://api.github.com",
+                        help="The root of the Github REST API (change this for Github Enterprise)")
+    parser.add_argument('--github_enumeration', dest="github_enumeration", default=ENUMERATE_TREE,
+                        choices=ENUMERATION_MODES,
+                        help="How files are found in the repo.  'tree' lists the whole folder in one recursive git "
+                             "tree request while 'walk' requests the contents of each directory separately.")
+    parser.add_argument('--github_page_size', dest="github_page_size", default=100, type=int,
+                        help="The number of items requested at once from paginated Github endpoints (up to 100)")
+    parser.add_argument('--github_mark_mode', dest="github_mark_mode", default=MARK_BULK, choices=MARK_MODES,
+                        help="How marked files are committed.  'bulk' uploads all the changed files and creates a "
+                             "single commit while 'file' creates a separate commit for each file.")
+    parser.add_argument('--github_history_batch_size', dest="github_history_batch_size", default=50, type=int,
+                        help="The number of files whose last change is requested at once through the GraphQL API. "
+                             "Use 0 to request the commits of each file separately.")
+    parser.add_argument('--github_graphql_url', dest="github_graphql_url", default="https://api.github.com/graphql",
+                        help="The GraphQL endpoint to use for batched requests (change this for Github Enterprise)")
+    parser.add_argument('--state_path', dest="state_path", required=False,
+                        help="The path to a file in which the results of the analysis are saved.  On the next run, "
+                             "only the files that changed since the saved commit are analyzed again.")
+    parser.add_argument('--github_requests_per_second', dest="github_requests_per_second", default=10, type=float,
+                        help="The maximum rate at which requests are sent to Github across all workers (0 for no "
+                             "limit).")
+
+    # LOCAL OPTIONS
+    parser.add_argument('-l', '--local_repo_path', dest="local_repo_path", required=False,
+                        help="The path to a local git checkout to analyze instead of a remote Github repo.  When "
+                             "given, github_owner and github_repo are only used to generate links to the files.")
+    parser.add_argument('--local_repo_folder', dest="local_repo_folder", default="/",
+                        help="The folder within the local checkout to start the analysis in - uses the root by "
+                             "default.")
 
     # EMAIL  OPTIONS
     parser.add_argument('-k', '--sendgrid_api_key', dest="sendgrid_api_key", required=False,
                         help="This is the sendgrid api key to use when an action is being performed that requires email"
                              "to be sent. This IS required if one of the actions requested requires email sending.")
+    parser.add_argument('--sendgrid_api_url', dest="sendgrid_api_url", default="https://api.sendgrid.com/v3/mail/send",
+                        help="The SendGrid endpoint used to send mail")
+    parser.add_argument('--email_backend', dest="email_backend", default=EMAIL_BACKEND_SENDGRID, choices=EMAIL_BACKENDS,
+                        help="How emails are sent.  'sendgrid' packs many reports into each SendGrid request while "
+                             "'smtp' sends them through an SMTP server over pooled connections.")
+    parser.add_argument('--smtp_host', dest="smtp_host", required=False,
+                        help="The SMTP server to send mail through (required with the smtp email backend)")
+    parser.add_argument('--smtp_port', dest="smtp_port", default=587, type=int,
+                        help="The port of the SMTP server")
+    parser.add_argument('--smtp_username', dest="smtp_username", required=False,
+                        help="The user to log into the SMTP server with (no login if not given)")
+    parser.add_argument('--smtp_password', dest="smtp_password", required=False,
+                        help="The password to log into the SMTP server with")
+    parser.add_argument('--smtp_starttls', dest="smtp_starttls", action="store_true",
+                        help="Upgrade the SMTP connections with STARTTLS")
+    parser.add_argument('--smtp_connections', dest="smtp_connections", default=2, type=int,
+                        help="The number of connections to the SMTP server used to send mail at the same time")
     parser.add_argument('-r', '--from_email', dest="from_email", required=False, default="noreply@underarmour.com",
                         help="This is the email that sent emails will appear to come from")
 
+    parser.add_argument('--email_validation', dest="email_validation", default=EMAIL_VALIDATION_DNS,
+                        choices=EMAIL_VALIDATION_MODES,
+                        help="How addresses (owners, the administrator and the sender) are checked.  'dns' also "
+                             "checks that the domain can receive email while 'syntax' makes no lookups (for "
+                             "environments without DNS).  Each address is only checked once per run.")
+    parser.add_argument('--email_cache_days', dest="email_cache_days", default=7, type=float,
+                        help="With cache_path, the results of DNS checks of addresses are reused for this many days")
+    parser.add_argument('--report_max_rows', dest="report_max_rows", default=500, type=int,
+                        help="Reports with more documents than this attach them as a gzipped CSV file instead of "
+                             "listing them in the email (0 to always list them)")
     parser.add_argument('-m', '--administrator', dest="administrator", required=False,
                         help="The admin will receive the admin report (if arg set) and any emails that would be sent "
                              "to an owner - but one does not exist.")
@@ -77,20 +193,68 @@ def main(argv=None):
     parser = get_parser()
     args = parser.parse_args(args=argv)
     ctx = DocCheckerContext(args, parser)
-    analyzed_results = None
-    if ctx.github:
-        analyzed_results = analyze_github_path(ctx.github_repo_path, ctx)
-        mark_github_files(analyzed_results, ctx)
-    elif ctx.confluence:
-        analyzed_results = analyze_confluence_page_tree(ctx.confluence_parent_page_id, ctx)
-        mark_confluence_files(analyzed_results, ctx)
+
+    if args.profile:
+        with profiled(args.profile):
+            run(ctx, args, parser)
     else:
-        error("Unable to determine which documentation source to analyze.", 0)
-        exit(1)
+        run(ctx, args, parser)
+
+    if args.metrics_path:
+        metrics.write(args.metrics_path, args.metrics_format)
+        info(f"Metrics written to {args.metrics_path}")
+
+
+def run(ctx: DocCheckerContext, args, parser):
+    from decay.comms import result_consumers
 
-    if analyzed_results:
-        send_results(analyzed_results, ctx)
+    if args.input_path and (args.targets or ctx.should_take_action(ACTION_SERVE)):
+        parser.error("The input argument can't be used with a targets file or the serve action")
+
+    if set(ctx.actions) == {ACTION_ANALYZE} and not args.output_path:
+        parser.error("The analyze action on its own needs the output argument (the analyses would go nowhere)")
+
+    if ctx.should_take_action(ACTION_SERVE):
+        from decay.service import serve
+        serve(ctx)
+        return
+
+    if args.targets:
+        # Each target is analyzed (and marked) in a worker process and the reports are sent from here once all
+        #   the analyses are in so that each owner gets a single email covering every target.
+        targets = load_targets(args.targets, args, parser)
+        info(f"Analyzing {len(targets)} targets with {args.target_processes} processes...")
+        consumers = result_consumers(ctx)
+        if args.output_path:
+            consumers.insert(0, AnalysisWriter(args.output_path, artifact_source(ctx)))
+        run_pipeline(run_targets(targets, args.target_processes, args.targets_per_host), consumers)
+        return
+
+    # The analyzers yield each analysis as soon as it's ready and the markers and reports process them as they
+    #   arrive so that the complete list of analyses is never built.  Analyses read from an input file are
+    #   processed the same way without making any requests to the source.
+    if args.input_path:
+        try:
+            analyses = read_analyses(args.input_path, ctx.doc_is_stale_after_days, artifact_source(ctx))
+        except (OSError, ValueError) as e:
+            parser.error(f"Unable to read the analyses in {args.input_path}: {str(e)}")
+        marker = marker_for(ctx) if ctx.should_take_action(ACTION_MARK) else None
+    else:
+        try:
+            analyses, marker = open_target(ctx)
+        except ValueError as e:
+            error(str(e), 0)
+            exit(1)
 
+    consumers = result_consumers(ctx)
+    if ctx.should_take_action(ACTION_MARK):
+        consumers.insert(0, marker)
+    if args.output_path:
+        consumers.insert(0, AnalysisWriter(args.output_path, artifact_source(ctx)))
+    if ctx.history and not args.input_path:
+        # the run is stored before the admin report asks for the trends
+        from decay.history import HistoryRecorder
+        consumers.insert(0, HistoryRecorder(ctx))
 
-if __name__ == "__main__":
-    main()
+    run_pipeline(analyses, consumers)
+    record_cache_metrics(ctx)
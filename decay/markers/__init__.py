@@ -0,0 +1,38 @@
+from decay.analyzers import FileAnalysis
+
+
+def get_props_to_change(file: FileAnalysis) -> dict:
+    """
+    Determines which frontmatter properties should be set on a document based on its analysis.
+    :param file: The analysis of the document
+    :return: A dict of property names and the values they should have.  Empty if nothing should be changed.
+    """
+    # we will add to this dict as we determine that there
+    #   are properties that need to be changed.  If, at the end,
+    #   we have no changed properties, then we will do nothing with the file in
+    #   the source repo.
+    props_to_change = {}
+
+    # Check `out_of_date` property.
+    if not file.file_changed_recently:
+        props_to_change = {
+            "out_of_date": True
+        }
+
+    return props_to_change
+
+
+def apply_props(parsed, props_to_change: dict) -> bool:
+    """
+    Sets the given properties on a parsed frontmatter document.
+    :param parsed: The document as loaded by frontmatter
+    :param props_to_change: The properties to set (see get_props_to_change)
+    :return: True if any property was different than what was already there.
+    """
+    changed = False
+    for k, v in props_to_change.items():
+        if (k in parsed and parsed[k] != v) or k not in parsed:
+            parsed[k] = v
+            changed = True
+
+    return changed
@@ -1,23 +1,109 @@
-from typing import List
-# import datetime
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, Union
+
+from pyfluence.confluence import ConfluenceResponseError
 
-# from decay.feedback import error
 from decay.analyzers import FileAnalysis
+from decay.analyzers.confluence import build_page_analysis, mark_version_message
 from decay.context import DocCheckerContext, ACTION_MARK
-from pyfluence import UPDATE_APPEND
+from decay.feedback import error, info
+from decay.pipeline import Consumer, run_pipeline
 
 TITLE_POSTFIX_OUT_OF_DATE = " (Stale)"
 
 
-def mark_confluence_files(all_file_analyses: List[FileAnalysis], ctx: DocCheckerContext) -> None:
+def planned_title(a: FileAnalysis) -> Union[str, None]:
+    """
+    Determines the title a page should have based on its analysis.  Stale pages get the postfix and pages that
+    were changed recently lose it.
+    :param a: The analysis of the page (the title is the one that was fetched during the analysis)
+    :return: The new title or None if the title is already right.
+    """
+    title = a.doc_name or ""
+    if not a.file_changed_recently and not title.endswith(TITLE_POSTFIX_OUT_OF_DATE):
+        return title + TITLE_POSTFIX_OUT_OF_DATE
+
+    if a.file_changed_recently and title.endswith(TITLE_POSTFIX_OUT_OF_DATE):
+        return title[:-len(TITLE_POSTFIX_OUT_OF_DATE)]
+
+    return None
+
+
+class ConfluenceMarker(Consumer):
+    """
+    Updates the title of each page that needs it as soon as its analysis is available.  Pages whose title is
+    already right are skipped and the updates run on a pool of `confluence_concurrency` threads.  Their requests
+    (including the pages read again after a conflict) are counted against a lane of the Confluence budget so that
+    they don't wait for the analysis to finish with its slots.
+    """
+    phase = "mark"
+
+    def __init__(self, ctx: DocCheckerContext):
+        self.ctx = ctx
+        self.updates: Dict[str, Future] = {}
+        self._executor: Union[ThreadPoolExecutor, None] = None
+        self._lane = ctx.confluence_budget.lane(ctx.confluence_concurrency)
+
+    def consume(self, a: FileAnalysis):
+        title = planned_title(a)
+        if title is None:
+            return
+
+        if not self._executor:
+            self._executor = ThreadPoolExecutor(max_workers=self.ctx.confluence_concurrency)
+        self.updates[a.file_identifier] = self._executor.submit(self._counted_update, a, title)
+
+    def _counted_update(self, a: FileAnalysis, title: str):
+        with self.ctx.http.counted_against(self._lane):
+            return self._update(a, title)
+
+    def _update(self, a: FileAnalysis, title: str):
+        """
+        Writes the new title of a page.  The new version carries the last change made by someone else so that the
+        next analysis doesn't see the title change as a change to the page.  If the page was changed since it was
+        analyzed (even just renamed), it's analyzed again and the title is worked out from its current title.  If it
+        changes again in the meantime, the conflict is reported and the page is left alone.
+        """
+        confluence = self.ctx.confluence
+        try:
+            return confluence.set_title(a.file_identifier, title, version=a.revision, message=mark_version_message(a))
+        except ConfluenceResponseError as e:
+            if e.status_code != 409:
+                raise
+
+        page = confluence.get_content(a.file_identifier, expand=("version",))
+        current = build_page_analysis(page, "", self.ctx)
+        title = planned_title(current)
+        if title is None:
+            return None
+        return confluence.set_title(current.file_identifier, title, version=current.revision,
+                                    message=mark_version_message(current))
+
+    def finish(self):
+        if not self._executor:
+            return
+
+        updated = 0
+        try:
+            for page_id, update in self.updates.items():
+                try:
+                    update.result()
+                    updated += 1
+                except Exception as e:
+                    error(f"Unable to update the title of page {page_id}: {str(e)}", 1)
+        finally:
+            self._executor.shutdown()
+
+        info(f"Updated the titles of {updated} pages")
+
+
+def mark_confluence_files(all_file_analyses: Iterable[FileAnalysis], ctx: DocCheckerContext) -> None:
     """
-    This will update the given file in the repository based on the results of the file analyses.  It will create
-    multiple commits but assemble them together into a PR which can be squashed before merge (manually).
+    This will update the titles of the pages based on the results of the file analyses.  Only the pages whose
+    title doesn't match their state are changed.
     :param all_file_analyses: All the results of the file analsis phase
     :param ctx:
-    :return: Returns a PR if changes were made as a result of the file analyses, otherwise returns None.
+    :return:
     """
     if ctx.should_take_action(ACTION_MARK):
-        for a in all_file_analyses:
-            ctx.confluence.update_title(a.file_identifier, title=TITLE_POSTFIX_OUT_OF_DATE,
-                                        update_type=UPDATE_APPEND)
+        run_pipeline(all_file_analyses, [ConfluenceMarker(ctx)])
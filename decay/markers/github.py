@@ -1,96 +1,279 @@
-from typing import List
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, List, Tuple, Union
 import datetime
 from os.path import basename
-from github import PullRequest, GitRef, ContentFile
+from github import PullRequest, GitRef, GitBlob, GitCommit, ContentFile, InputGitTreeElement, GitTreeElement
 import frontmatter
 
-from decay.feedback import error
+from decay.cache import StoredContent
+from decay.feedback import error, info, warning
 from decay.analyzers import FileAnalysis
-from decay.context import DocCheckerContext, ACTION_MARK
+from decay.analyzers.github import github_call
+from decay.markers import get_props_to_change, apply_props
+from decay.context import DocCheckerContext, ACTION_MARK, MARK_BULK
+from decay.pipeline import Consumer, run_pipeline
+from decay.throttle import BudgetLane
 
+# The number of blobs uploaded at the same time by the bulk marker.  The uploads have their own allowance of requests
+#   in flight so that they don't wait for the workers of the analysis.
+BLOB_UPLOAD_WORKERS = 8
 
-def create_ref(ctx: DocCheckerContext) -> GitRef:
+
+def create_ref(ctx: DocCheckerContext, sha: Union[str, None] = None) -> GitRef:
+    """
+    Creates the branch the changes are made on.
+    :param ctx:
+    :param sha: The commit the branch starts at (the head of the analyzed branch if not given)
+    """
     branch_name = "decay-marker-" + str(datetime.datetime.now().timestamp())
-    source_branch = ctx.repo_ob.get_branch(ctx.github_branch)
-    return ctx.repo_ob.create_git_ref(ref=f'refs/heads/{branch_name}', sha=source_branch.commit.sha)
+    if sha is None:
+        with github_call(ctx, "get_branch"):
+            sha = ctx.repo_ob.get_branch(ctx.github_branch).commit.sha
+    with github_call(ctx, "create_git_ref"):
+        return ctx.repo_ob.create_git_ref(ref=f'refs/heads/{branch_name}', sha=sha)
+
+
+def tree_entries(ctx: DocCheckerContext, tree_sha: str, paths: Iterable[str]) -> Dict[str, GitTreeElement]:
+    """
+    Finds the entries of the given files in a tree.  Only the folders on the way to the files are listed (once
+    each).
+    :param ctx:
+    :param tree_sha: The sha of the root tree
+    :param paths: The paths of the files
+    :return: The entry of each file that is in the tree.
+    """
+    listed: Dict[str, Dict[str, GitTreeElement]] = {}
+
+    def list_folder(folder: str) -> Dict[str, GitTreeElement]:
+        if folder not in listed:
+            if folder:
+                parent, _, name = folder.rpartition("/")
+                entry = list_folder(parent).get(name)
+                sha = entry.sha if entry is not None and entry.type == "tree" else None
+            else:
+                sha = tree_sha
+
+            listed[folder] = {}
+            if sha:
+                with github_call(ctx, "get_git_tree"):
+                    listed[folder] = {e.path: e for e in ctx.repo_ob.get_git_tree(sha).tree}
+        return listed[folder]
+
+    entries = {}
+    for path in paths:
+        folder, _, name = path.rpartition("/")
+        entry = list_folder(folder).get(name)
+        if entry is not None and entry.type == "blob":
+            entries[path] = entry
+    return entries
+
+
+def open_pull_request(ctx: DocCheckerContext) -> PullRequest:
+    with github_call(ctx, "create_pull"):
+        return ctx.repo_ob.create_pull(
+            title="Decay automated updates",
+            body="This PR was generated automatically by Decay because properties on some files were changed.",
+            head=basename(ctx.ref_with_changes.ref), base=ctx.github_branch)
+
 
+class GithubMarker(Consumer):
+    """
+    Updates each file in the repository as soon as its analysis is available.  Every change is a separate commit
+    on a new branch and once all the analyses have been processed, a PR is opened with all the commits.
+    """
+    phase = "mark"
+
+    def __init__(self, ctx: DocCheckerContext):
+        self.ctx = ctx
+        self.commits = []
+        self.pull_request: Union[PullRequest, None] = None
+
+    def consume(self, file: FileAnalysis):
+        new_commit = update_file(self.ctx, file)
+        if new_commit:
+            self.commits.append(new_commit)
+
+    def finish(self):
+        if len(self.commits) > 0:
+            self.pull_request = open_pull_request(self.ctx)
+
+
+class BulkGithubMarker(Consumer):
+    """
+    Uploads the new content of each file that needs to be marked as a blob as soon as its analysis is available
+    (several uploads run at the same time).  Once all the analyses have been processed, the blobs are put in a
+    single tree and commit on a new branch and a PR is opened for it.
 
-def mark_github_files(all_file_analyses: List[FileAnalysis], ctx: DocCheckerContext) -> PullRequest:
+    The new branch starts at the head of the analyzed branch at that point so files that were changed after they
+    were read are left out (rather than reverting the change) - they're marked on the next run.
     """
-    This will update the given file in the repository based on the results of the file analyses.  It will create
-    multiple commits but assemble them together into a PR which can be squashed before merge (manually).
+    phase = "mark"
+
+    def __init__(self, ctx: DocCheckerContext):
+        self.ctx = ctx
+        # the upload of the new content of each file and the blob sha of the content it was worked out from
+        self.blobs: Dict[str, Tuple[Future, str]] = {}
+        self.changed_props = set()
+        self.commit: Union[GitCommit, None] = None
+        self.pull_request: Union[PullRequest, None] = None
+        self._executor: Union[ThreadPoolExecutor, None] = None
+        self._uploads = ctx.github_budget.lane(BLOB_UPLOAD_WORKERS)
+
+    def consume(self, file: FileAnalysis):
+        try:
+            marked = marked_content(self.ctx, file)
+        except Exception as e:
+            error(f"Unable to mark {file.file_identifier}: {str(e)}", 1)
+            return
+
+        if marked:
+            content, sha, props_to_change = marked
+            if not self._executor:
+                self._executor = ThreadPoolExecutor(max_workers=self._uploads.max_in_flight)
+            self.changed_props.update(props_to_change.keys())
+            self.blobs[file.file_identifier] = (self._executor.submit(create_blob, self.ctx, content, self._uploads),
+                                                sha)
+
+    def finish(self):
+        if not self.blobs:
+            return
+
+        uploaded: Dict[str, str] = {}
+        try:
+            for path, (blob, _) in self.blobs.items():
+                try:
+                    uploaded[path] = blob.result().sha
+                except Exception as e:
+                    error(f"Unable to upload the marked content of {path}: {str(e)}", 1)
+        finally:
+            self._executor.shutdown()
+
+        if not uploaded:
+            return
+
+        ctx = self.ctx
+        with github_call(ctx, "get_branch"):
+            head_sha = ctx.repo_ob.get_branch(ctx.github_branch).commit.sha
+        with github_call(ctx, "get_git_commit"):
+            parent = ctx.repo_ob.get_git_commit(head_sha)
+        elements = self.tree_elements(uploaded, tree_entries(ctx, parent.tree.sha, uploaded.keys()))
+        if not elements:
+            return
+
+        ctx.ref_with_changes = create_ref(ctx, head_sha)
+        with github_call(ctx, "get_git_tree"):
+            base_tree = ctx.repo_ob.get_git_tree(parent.tree.sha)
+        with github_call(ctx, "create_git_tree"):
+            tree = ctx.repo_ob.create_git_tree(elements, base_tree=base_tree)
+        with github_call(ctx, "create_git_commit"):
+            self.commit = ctx.repo_ob.create_git_commit(
+                message=f"decay updated these fields in {len(elements)} files: " +
+                        ",".join(sorted(self.changed_props)),
+                tree=tree, parents=[parent])
+        with github_call(ctx, "edit_ref"):
+            ctx.ref_with_changes.edit(sha=self.commit.sha)
+
+        info(f"Marked {len(elements)} files in a single commit on {basename(ctx.ref_with_changes.ref)}")
+        self.pull_request = open_pull_request(ctx)
+
+    def tree_elements(self, uploaded: Dict[str, str], entries: Dict[str, GitTreeElement]) -> List[InputGitTreeElement]:
+        """
+        Creates the tree elements for the uploaded blobs of the files that haven't changed since they were read.
+        Each file keeps its mode.
+        :param uploaded: The sha of the uploaded blob of each file
+        :param entries: The entry of each file in the tree of the new branch
+        """
+        elements = []
+        for path, blob_sha in uploaded.items():
+            entry = entries.get(path)
+            if entry is None or entry.sha != self.blobs[path][1]:
+                warning(f"{path} was changed after it was analyzed so it will be marked on the next run", 1)
+                continue
+            elements.append(InputGitTreeElement(path, entry.mode, "blob", sha=blob_sha))
+        return elements
+
+
+def github_marker(ctx: DocCheckerContext) -> Consumer:
+    """
+    Creates the marker for the mark mode given in the context.
+    """
+    return BulkGithubMarker(ctx) if ctx.github_mark_mode == MARK_BULK else GithubMarker(ctx)
+
+
+def mark_github_files(all_file_analyses: Iterable[FileAnalysis], ctx: DocCheckerContext) -> PullRequest:
+    """
+    This will update the given file in the repository based on the results of the file analyses.  Depending on the
+    mark mode, the changes are either made in a single commit or in one commit per file, assembled together into a
+    PR which can be squashed before merge (manually).
     :param all_file_analyses: All the results of the file analsis phase
     :param ctx:
     :return: Returns a PR if changes were made as a result of the file analyses, otherwise returns None.
     """
-    ref = None
     if ctx.should_take_action(ACTION_MARK):
+        marker = github_marker(ctx)
+        run_pipeline(all_file_analyses, [marker])
+        return marker.pull_request
 
-        # first create a new branch for all the changes to be made in
-        commits = []
-        for file in all_file_analyses:
-            new_commit = update_file(ctx, file)
-            if new_commit:
-                commits.append(new_commit)
 
-        if len(commits) > 0:
-            new_pr = ctx.repo_ob.create_pull(title="Decay automated updates",
-                                             body="This PR was generated automatically by Decay because properties on "
-                                                  "some files were changed.",
-                                             head=basename(ctx.ref_with_changes.ref), base=ctx.github_branch)
-            return new_pr
-        else:
-            return None
+def create_blob(ctx: DocCheckerContext, content: str, budget: Union[BudgetLane, None] = None) -> GitBlob:
+    with github_call(ctx, "create_git_blob", budget):
+        return ctx.repo_ob.create_git_blob(content, "utf-8")
 
 
-def update_file(ctx, file):
+def marked_content(ctx: DocCheckerContext, file: FileAnalysis) -> Union[Tuple[str, str, dict], None]:
+    """
+    Determines the new content of a file based on its analysis.  The content read by the analyzer is used if it
+    was kept, otherwise the file is loaded from the analyzed branch.
+    :param ctx:
+    :param file: The analysis of the file
+    :return: The new content, the blob sha of the current content and the properties that were changed or None
+        if nothing needs to change.
+    """
+    props_to_change = get_props_to_change(file)
+    if len(props_to_change) == 0:
+        return None
 
-    # we will add to this dict as we determine that there
-    #   are properties that need to be changed.  If, at the end,
-    #   we have no changed properties, then we will do nothing with the file in
-    #   the source repo.
-    props_to_change = {}
+    stored = ctx.contents.pop(file.file_identifier) if ctx.contents is not None else None
+    if not stored:
+        # the analyzer didn't keep the content (e.g. the analysis was reused from a previous run) so load it now
+        with github_call(ctx, "get_contents"):
+            gh_file: ContentFile = ctx.repo_ob.get_contents(file.file_identifier, ref=ctx.github_branch)
+        stored = StoredContent(gh_file.decoded_content, gh_file.sha)
 
-    # Check `out_of_date` property.
-    if not file.file_changed_recently:
-        props_to_change = {
-            "out_of_date": True
-        }
+    parsed = frontmatter.loads(stored.content)
 
-    if len(props_to_change) == 0:
+    # Okay, we have determined that one or more properties should be set to a certain value.  Now
+    #   let's see if any of these properties are different than what's already there.  If not, we
+    #   will not make any changes.
+    if not apply_props(parsed, props_to_change):
         return None
 
-    gh_file: ContentFile = ctx.repo_ob.get_contents(file.file_identifier)
-    parsed = frontmatter.loads(gh_file.decoded_content)
-    changed = False
+    return frontmatter.dumps(parsed), stored.sha, props_to_change
 
-    # Okay, we have determined that one or more properties should be set to a certain value.  Now
-    #   let's load the content from the repo and see if any of these properties are different
-    #   than what's already there.  If not, we will not make any changes and exit the function.
-    for k, v in props_to_change.items():
-        if (k in parsed and parsed[k] != v) or k not in parsed:
-            parsed[k] = v
-            changed = True
-
-    if changed:
-        if not ctx.ref_with_changes:
-            # if we haven't created the branch, do so now.  We wait to create in case
-            #   there are no changes that need to be made.
-            ctx.ref_with_changes = create_ref(ctx)
-
-        if not ctx.ref_with_changes:
-            # something went wrong
-            error("There was a problem while creating a branch to host marker changes", 1)
 
+def update_file(ctx, file):
+
+    marked = marked_content(ctx, file)
+    if not marked:
+        # Nothing changed so skip
+        return None
+
+    content, sha, props_to_change = marked
+    if not ctx.ref_with_changes:
+        # if we haven't created the branch, do so now.  We wait to create in case
+        #   there are no changes that need to be made.
+        ctx.ref_with_changes = create_ref(ctx)
+
+    if not ctx.ref_with_changes:
+        # something went wrong
+        error("There was a problem while creating a branch to host marker changes", 1)
+
+    with github_call(ctx, "update_file"):
         new_commit, _ = ctx.repo_ob.update_file(path=file.file_identifier,
                                                 message="decay updated these fields: " + ",".join(
                                                     props_to_change.keys()),
-                                                content=frontmatter.dumps(parsed),
-                                                sha=gh_file.sha,
+                                                content=content,
+                                                sha=sha,
                                                 branch=basename(ctx.ref_with_changes.ref))
 
-        return new_commit
-    else:
-
-        # Nothing changed so skip
-        return None
+    return new_commit
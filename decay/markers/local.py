@@ -0,0 +1,68 @@
+import os
+from typing import Iterable, List
+
+from decay.analyzers import FileAnalysis
+from decay.context import DocCheckerContext, ACTION_MARK
+from decay.feedback import info, error
+from decay.markers import get_props_to_change, apply_props
+from decay.pipeline import Consumer, run_pipeline
+
+
+class LocalMarker(Consumer):
+    """
+    Updates each file in the local checkout as soon as its analysis is available.
+    """
+    phase = "mark"
+
+    def __init__(self, ctx: DocCheckerContext):
+        self.ctx = ctx
+        self.changed_files = []
+
+    def consume(self, file: FileAnalysis):
+        if update_local_file(self.ctx, file):
+            self.changed_files.append(file.file_identifier)
+
+    def finish(self):
+        info(f"Marked {len(self.changed_files)} files in {self.ctx.local_repo_path}")
+
+
+def mark_local_files(all_file_analyses: Iterable[FileAnalysis], ctx: DocCheckerContext) -> List[str]:
+    """
+    This will update the files in the local checkout based on the results of the file analyses.  Nothing is
+    committed - that is left to the process that owns the checkout.
+    :param all_file_analyses: All the results of the file analsis phase
+    :param ctx:
+    :return: Returns the paths of the files that were changed.
+    """
+    if ctx.should_take_action(ACTION_MARK):
+        marker = LocalMarker(ctx)
+        run_pipeline(all_file_analyses, [marker])
+        return marker.changed_files
+
+    return []
+
+
+def update_local_file(ctx: DocCheckerContext, file: FileAnalysis) -> bool:
+    props_to_change = get_props_to_change(file)
+    if len(props_to_change) == 0:
+        return False
+
+    # only needed once a file is actually marked
+    import frontmatter
+
+    full_path = os.path.join(ctx.local_repo_path, file.file_identifier)
+    try:
+        with open(full_path, "rb") as f:
+            parsed = frontmatter.loads(f.read())
+
+        if not apply_props(parsed, props_to_change):
+            return False
+
+        with open(full_path, "w", encoding="utf-8") as f:
+            f.write(frontmatter.dumps(parsed))
+
+        return True
+
+    except Exception as e:
+        error(f"Unable to mark {file.file_identifier}: {str(e)}", 1)
+        return False
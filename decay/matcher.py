@@ -0,0 +1,148 @@
+import os
+import re
+from typing import Dict, Iterable, List, Union
+
+# The characters that make an ignored path or file a glob pattern rather than a literal path.
+GLOB_CHARACTERS = set("*?[")
+
+# The key of a node in the trie of ignored folders that marks the end of an ignored path.
+_IGNORED = ""
+
+
+def glob_to_regex(pattern: str) -> str:
+    """
+    Translates a glob pattern for a path into a regular expression.  Unlike fnmatch, `*` and `?` don't match
+    across folders - `**` does (and `**/` also matches no folder at all):
+
+        "_posts"           only the top level _posts folder
+        "*/drafts"         a drafts folder one level down
+        "**/legacy"        a legacy folder at any depth
+        "docs/**/*.tmp.md" any .tmp.md file under docs
+    """
+    parts = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+            continue
+        if pattern.startswith("**", i):
+            parts.append(".*")
+            i += 2
+            continue
+
+        if c == "*":
+            parts.append("[^/]*")
+        elif c == "?":
+            parts.append("[^/]")
+        elif c == "[" and _class_end(pattern, i) > 0:
+            end = _class_end(pattern, i)
+            body = pattern[i + 1:end].replace("\\", "\\\\")
+            parts.append("[" + ("^" + body[1:] if body.startswith("!") else body) + "]")
+            i = end
+        else:
+            parts.append(re.escape(c))
+        i += 1
+
+    return "".join(parts)
+
+
+def _class_end(pattern: str, start: int) -> int:
+    """
+    Finds the closing bracket of the character class opened at `start` (-1 if it isn't closed).
+    """
+    i = start + 1
+    if pattern[i:i + 1] == "!":
+        i += 1
+    if pattern[i:i + 1] == "]":
+        i += 1
+    return pattern.find("]", i)
+
+
+def _compile_globs(patterns: List[str]) -> Union[re.Pattern, None]:
+    if not patterns:
+        return None
+    return re.compile("(?:" + "|".join(glob_to_regex(p) for p in patterns) + r")\Z")
+
+
+def _is_glob(pattern: str) -> bool:
+    return not GLOB_CHARACTERS.isdisjoint(pattern)
+
+
+class PathMatcher(object):
+    """
+    Decides which paths in a documentation source are analyzed.  The ignored paths, ignored files and extensions
+    are compiled once: literal ignored folders go into a trie keyed by path component, literal ignored files and
+    extensions into sets and all the glob patterns of each kind into a single regular expression.
+
+    `is_pruned` tells a crawler whether a folder can be skipped entirely (before anything under it is requested)
+    and `matches` checks a single file.  The decision for each folder is remembered so files that share folders
+    are cheap to check.
+    """
+    def __init__(self, extensions: Iterable[str], ignore_paths: Iterable[str] = (),
+                 ignore_files: Iterable[str] = ()):
+        self.extensions = set(extensions)
+
+        ignore_paths = [p.strip("/") for p in ignore_paths if p.strip("/")]
+        self._folder_trie: Dict[str, dict] = {}
+        for path in ignore_paths:
+            if not _is_glob(path):
+                node = self._folder_trie
+                for component in path.split("/"):
+                    node = node.setdefault(component, {})
+                node[_IGNORED] = True
+        self._folder_globs = _compile_globs([p for p in ignore_paths if _is_glob(p)])
+
+        ignore_files = [f.strip("/") for f in ignore_files]
+        self._files = {f for f in ignore_files if not _is_glob(f)}
+        self._file_globs = _compile_globs([f for f in ignore_files if _is_glob(f)])
+
+        self._pruned_folders: Dict[str, bool] = {}
+
+    def _is_ignored_folder(self, folder: str) -> bool:
+        """
+        Whether the folder itself (not considering the folders it lives in) is ignored.
+        """
+        if self._folder_globs and self._folder_globs.match(folder):
+            return True
+
+        node = self._folder_trie
+        for component in folder.split("/"):
+            node = node.get(component)
+            if node is None:
+                return False
+        return _IGNORED in node
+
+    def is_pruned(self, folder: str) -> bool:
+        """
+        Whether nothing under the given folder is analyzed because the folder or one of the folders it lives in is
+        ignored.
+        :param folder: The path of the folder relative to the root of the source (as in "docs/legacy")
+        """
+        folder = folder.strip("/")
+        if not folder:
+            return False
+
+        pruned = self._pruned_folders.get(folder)
+        if pruned is None:
+            parent, _, _ = folder.rpartition("/")
+            pruned = self.is_pruned(parent) or self._is_ignored_folder(folder)
+            self._pruned_folders[folder] = pruned
+        return pruned
+
+    def matches(self, path: str) -> bool:
+        """
+        Whether the file at the given path should be analyzed based on its extension, the ignored files and the
+        ignored folders.
+        :param path: The path of the file relative to the root of the source (as in "lib/myfile.md")
+        """
+        _, extension = os.path.splitext(path)
+        if extension not in self.extensions:
+            return False
+
+        if path in self._files or (self._file_globs and self._file_globs.match(path)):
+            return False
+
+        folder, _, _ = path.rpartition("/")
+        return not self.is_pruned(folder)
@@ -0,0 +1,226 @@
+import cProfile
+import io
+import json
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, Union
+from urllib.parse import urlparse
+
+METRICS_FORMAT_JSON = 'json'
+METRICS_FORMAT_PROMETHEUS = 'prometheus'
+
+METRICS_FORMATS = [METRICS_FORMAT_JSON, METRICS_FORMAT_PROMETHEUS]
+
+# The upper bounds (in seconds) of the buckets of the request latency histograms.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+# Path segments that identify a single item (numbers and shas) are replaced so that requests for different items of
+#   the same kind are counted together.
+_ITEM_SEGMENT = re.compile(r"/(\d+|[0-9a-f]{40})(?=/|$)")
+
+
+def endpoint_name(method: str, url: str) -> str:
+    parsed = urlparse(url)
+    return f"{method.upper()} {parsed.netloc}{_ITEM_SEGMENT.sub('/:id', parsed.path)}"
+
+
+class Metrics(object):
+    """
+    Collects the measurements of a run: how long each phase took, how many requests were made to each endpoint
+    (with a latency histogram) and the last value of gauges such as the remaining rate limit.  Everything is safe
+    to record from several threads.  A snapshot (see `snapshot`) can be merged into another instance which is how
+    the measurements of worker processes end up in the main one.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.phases: Dict[str, float] = {}
+            self.requests: Dict[str, dict] = {}
+            self.counters: Dict[str, float] = {}
+            self.gauges: Dict[str, float] = {}
+
+    def add_time(self, phase: str, seconds: float):
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Adds the time spent in the block to the given phase.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def increment(self, name: str, amount: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_gauge(self, name: str, value: Union[float, None]):
+        if value is None:
+            return
+        with self._lock:
+            self.gauges[name] = float(value)
+
+    def observe_request(self, endpoint: str, seconds: float, failed: bool = False):
+        """
+        Records a request to an endpoint (see endpoint_name) and how long it took.
+        """
+        with self._lock:
+            stats = self.requests.get(endpoint)
+            if not stats:
+                stats = self.requests[endpoint] = {"count": 0, "errors": 0, "seconds": 0.0,
+                                                   "buckets": [0] * len(LATENCY_BUCKETS)}
+            stats["count"] += 1
+            stats["errors"] += 1 if failed else 0
+            stats["seconds"] += seconds
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    stats["buckets"][i] += 1
+                    break
+
+    @contextmanager
+    def request(self, endpoint: str):
+        """
+        Records a request made in the block (it's counted as an error if the block raises).
+        """
+        start = time.perf_counter()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            self.observe_request(endpoint, time.perf_counter() - start, failed)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "phases": dict(self.phases),
+                "requests": {k: dict(v, buckets=list(v["buckets"])) for k, v in self.requests.items()},
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+            }
+
+    def merge(self, snapshot: dict):
+        """
+        Adds the measurements in a snapshot taken from another instance.  Times, counts and histograms are summed
+        and gauges are replaced.
+        """
+        with self._lock:
+            for name, seconds in snapshot["phases"].items():
+                self.phases[name] = self.phases.get(name, 0.0) + seconds
+            for name, amount in snapshot["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + amount
+            self.gauges.update(snapshot["gauges"])
+            for endpoint, other in snapshot["requests"].items():
+                stats = self.requests.setdefault(endpoint, {"count": 0, "errors": 0, "seconds": 0.0,
+                                                            "buckets": [0] * len(LATENCY_BUCKETS)})
+                stats["count"] += other["count"]
+                stats["errors"] += other["errors"]
+                stats["seconds"] += other["seconds"]
+                stats["buckets"] = [a + b for a, b in zip(stats["buckets"], other["buckets"])]
+
+    def to_json(self) -> str:
+        snapshot = self.snapshot()
+        lookups = snapshot["counters"].get("cache_hits", 0) + snapshot["counters"].get("cache_misses", 0)
+        if lookups:
+            snapshot["cache_hit_ratio"] = snapshot["counters"].get("cache_hits", 0) / lookups
+        return json.dumps(snapshot, indent=2, sort_keys=True)
+
+    def to_prometheus(self) -> str:
+        """
+        Formats the measurements for the Prometheus node exporter's textfile collector.
+        """
+        snapshot = self.snapshot()
+        lines = ["# TYPE decay_phase_seconds gauge"]
+        for name, seconds in sorted(snapshot["phases"].items()):
+            lines.append(f'decay_phase_seconds{{phase="{name}"}} {seconds}')
+
+        lines.append("# TYPE decay_request_duration_seconds histogram")
+        for endpoint, stats in sorted(snapshot["requests"].items()):
+            label = f'endpoint="{_escape_label(endpoint)}"'
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, stats["buckets"]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else str(bound)
+                lines.append(f'decay_request_duration_seconds_bucket{{{label},le="{le}"}} {cumulative}')
+            lines.append(f'decay_request_duration_seconds_sum{{{label}}} {stats["seconds"]}')
+            lines.append(f'decay_request_duration_seconds_count{{{label}}} {stats["count"]}')
+
+        lines.append("# TYPE decay_request_errors_total counter")
+        for endpoint, stats in sorted(snapshot["requests"].items()):
+            lines.append(f'decay_request_errors_total{{endpoint="{_escape_label(endpoint)}"}} {stats["errors"]}')
+
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append(f"# TYPE decay_{name} counter")
+            lines.append(f"decay_{name} {value}")
+
+        for name, value in sorted(snapshot["gauges"].items()):
+            lines.append(f"# TYPE decay_{name} gauge")
+            lines.append(f"decay_{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str, metrics_format: str = METRICS_FORMAT_JSON):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus() if metrics_format == METRICS_FORMAT_PROMETHEUS else self.to_json())
+
+
+def record_cache_metrics(context):
+    """
+    Adds the hits and misses of the response cache in the context (if any) to the metrics.
+    """
+    if context.cache:
+        metrics.increment("cache_hits", context.cache.hits)
+        metrics.increment("cache_misses", context.cache.misses)
+
+
+@contextmanager
+def profiled(path: str, top: int = 25):
+    """
+    Profiles the block (with cProfile) and traces its memory allocations.  The profile is saved to `path` (it can be
+    loaded with pstats or a viewer like snakeviz) and a summary of the functions with the highest cumulative time,
+    the largest allocations and the peak memory use is written to `path` + ".txt".
+    """
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        allocations = tracemalloc.take_snapshot().statistics("lineno")[:top]
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        profiler.dump_stats(path)
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top)
+        summary.write(f"Peak memory: {peak / 1024 / 1024:.1f} MiB\n\nLargest allocations:\n")
+        summary.writelines(f"{stat}\n" for stat in allocations)
+        with open(path + ".txt", "w", encoding="utf-8") as f:
+            f.write(summary.getvalue())
+
+
+def metric_name(value: str) -> str:
+    """
+    Turns something like a host name into a string that can be used in a metric name.
+    """
+    return re.sub(r"[^a-zA-Z0-9_]", "_", value)
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"')
+
+
+# The measurements of the current process.
+metrics = Metrics()
@@ -0,0 +1,141 @@
+import datetime
+import heapq
+import json
+import os
+import tempfile
+import time
+from typing import Callable, Iterable, Iterator, List
+
+from decay.analyzers import FileAnalysis
+from decay.metrics import metrics
+
+# Analyses without a date of change are ordered as if they were changed this long ago.
+NEVER_CHANGED_AGE = datetime.timedelta(days=3650)
+
+# The number of analyses sorted in memory at once by sorted_merge.
+DEFAULT_RUN_SIZE = 5000
+
+
+def by_last_change(analysis: FileAnalysis) -> datetime.datetime:
+    """
+    The key used to order analyses from the oldest change to the newest.  If there is no date, use something way in
+    the past in the hopes that it appears near the bottom of the list.
+    """
+    return analysis.last_change or datetime.datetime.now(tz=datetime.timezone.utc) - NEVER_CHANGED_AGE
+
+
+class Consumer(object):
+    """
+    Something that processes analyses as they are produced by the analyzers (a marker or a report).  `consume` is
+    called once for every analysis as soon as it's available and `finish` is called once all the analyses have been
+    produced.  The time spent in both is added to the consumer's `phase` in the metrics.
+    """
+    phase = "consume"
+
+    def consume(self, analysis: FileAnalysis):
+        raise NotImplementedError()
+
+    def finish(self):
+        pass
+
+
+def run_pipeline(analyses: Iterable[FileAnalysis], consumers: List[Consumer]) -> int:
+    """
+    Passes each analysis to every consumer as soon as the analyzer produces it so that marking and reporting
+    happen while the crawl is still going and the complete list is never needed.  The time spent waiting on the
+    analyzer is added to the "analyze" phase in the metrics.
+    :param analyses: The analyses (usually a generator returned by an analyzer)
+    :param consumers: The consumers to pass the analyses to
+    :return: The number of analyses that were processed.
+    """
+    count = 0
+    analyses = iter(analyses)
+    clock = time.perf_counter
+    while True:
+        start = clock()
+        analysis = next(analyses, None)
+        metrics.add_time("analyze", clock() - start)
+        if analysis is None:
+            break
+
+        count += 1
+        for consumer in consumers:
+            start = clock()
+            consumer.consume(analysis)
+            metrics.add_time(consumer.phase, clock() - start)
+
+    for consumer in consumers:
+        with metrics.phase(consumer.phase):
+            consumer.finish()
+
+    metrics.increment("analyses", count)
+    return count
+
+
+class SortedRuns(object):
+    """
+    Orders analyses without holding more than `run_size` of them in memory.  Analyses are added one at a time and
+    sorted in runs of `run_size`.  Every full run is written to a temporary file and iterating merges the runs.
+    """
+    def __init__(self, key: Callable = by_last_change, run_size: int = DEFAULT_RUN_SIZE):
+        self.key = key
+        self.run_size = run_size
+        self.count = 0
+        self._run: List[FileAnalysis] = []
+        self._run_paths: List[str] = []
+
+    def __len__(self):
+        return self.count
+
+    def add(self, analysis: FileAnalysis):
+        self.count += 1
+        self._run.append(analysis)
+        if len(self._run) >= self.run_size:
+            self._run.sort(key=self.key)
+            self._run_paths.append(_write_run(self._run))
+            self._run = []
+
+    def __iter__(self) -> Iterator[FileAnalysis]:
+        """
+        Yields all the analyses added so far in order.  The runs written to disk are removed once they have been
+        read so this can only be done once.
+        """
+        self._run.sort(key=self.key)
+        run_paths, self._run_paths = self._run_paths, []
+        if not run_paths:
+            return iter(self._run)
+
+        return heapq.merge(*[_read_run(p) for p in run_paths], self._run, key=self.key)
+
+
+def sorted_merge(analyses: Iterable[FileAnalysis], key: Callable = by_last_change,
+                 run_size: int = DEFAULT_RUN_SIZE) -> Iterator[FileAnalysis]:
+    """
+    Orders analyses without holding more than `run_size` of them in memory (see SortedRuns).
+    :param analyses: The analyses in any order
+    :param key: The key to sort the analyses by
+    :param run_size: The maximum number of analyses sorted in memory at once
+    :return: Yields the analyses in order.
+    """
+    runs = SortedRuns(key, run_size)
+    for analysis in analyses:
+        runs.add(analysis)
+
+    return iter(runs)
+
+
+def _write_run(run: List[FileAnalysis]) -> str:
+    handle, path = tempfile.mkstemp(prefix="decay-run-", suffix=".jsonl")
+    with os.fdopen(handle, "w", encoding="utf-8") as f:
+        for analysis in run:
+            f.write(json.dumps(analysis.to_dict()) + "\n")
+    return path
+
+
+def _read_run(path: str) -> Iterator[FileAnalysis]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                yield FileAnalysis.from_dict(json.loads(line))
+    finally:
+        os.remove(path)
@@ -1,18 +1,30 @@
+import csv
 import datetime
-from typing import List, Union
-
-import sendgrid
-from markdown2 import Markdown
+import gzip
+import io
+from html import escape
+from itertools import chain
+from typing import Iterable, List, Tuple, Union
 
 from decay.analyzers import FileAnalysis
 from decay.context import DocCheckerContext
-from decay.feedback import success, error
+from decay.delivery import Attachment, Delivery, Message, create_delivery
+from decay.history import Trends
+from decay.util import as_utc
 
 owner_subject_template = "Documentation Checker Owner Report - {stale_doc_count} docs found that are more than {" \
                          "stale_doc_days} days old"
 admin_subject_template = "Documentation Checker Admin Report"
-line_item_template = "| {file_path} | {stale_days} | {changed_by} | [{file_link}]({file_link}) |"
-body_template = \
+
+# The templates are compiled once into bound format methods and each row is formatted straight into the text and the
+#   HTML bodies (there is no Markdown conversion).
+text_line_item = "| {file_path} | {stale_days} | {changed_by} | [{file_link}]({file_link}) |".format
+html_line_item = "<tr><td>{file_path}</td><td>{stale_days}</td><td>{changed_by}</td>" \
+                 "<td><a href=\"{file_link}\">{file_link}</a></td></tr>".format
+text_attachment_line = "{count} docs are listed in the attached {filename}".format
+html_attachment_line = "<tr><td colspan=\"4\">{count} docs are listed in the attached {filename}</td></tr>".format
+
+text_body_template = \
     """
 ## Documentation Report
 
@@ -22,14 +34,31 @@ body_template = \
 |--------|------------|------------| ----------|
 {item_list}
 
+{trends}
 
-
-### Parameters 
+### Parameters
 
 | Github Repo   | Repo Root          | Max Age          |
 |---------------|--------------------|------------------|
 | {github_repo} | {github_repo_root} | {max_stale_days} |
-"""
+""".format
+
+html_body_template = \
+    """<h2>Documentation Report</h2>
+<h3>Stale Docs</h3>
+<table>
+<thead><tr><th>Name</th><th>Age (Days)</th><th>Changed By</th><th>Link</th></tr></thead>
+<tbody>
+{item_list}
+</tbody>
+</table>
+{trends}
+<h3>Parameters</h3>
+<table>
+<thead><tr><th>Github Repo</th><th>Repo Root</th><th>Max Age</th></tr></thead>
+<tbody><tr><td>{github_repo}</td><td>{github_repo_root}</td><td>{max_stale_days}</td></tr></tbody>
+</table>
+""".format
 
 css = \
     """
@@ -37,25 +66,97 @@ css = \
     tr:nth-child(even){
         background: #efefef;
     }
-    
+
     th {
         font-weight:bold;
         text-align:left;
         border-bottom: 1px solid #333
     }
-    
+
     th, td {
         padding: 7px;
     }
 </style>
 """
 
+text_trends_template = \
+    """
+### Became Stale In The Last {days} Days
+
+| Name   | Owner | Link      |
+|--------|-------|-----------|
+{newly_stale}
+
+### Stale Docs By Owner
+
+| Owner | {period_headers} |
+|-------|{period_rules}|
+{backlog}
+""".format
+
+html_trends_template = \
+    """<h3>Became Stale In The Last {days} Days</h3>
+<table>
+<thead><tr><th>Name</th><th>Owner</th><th>Link</th></tr></thead>
+<tbody>
+{newly_stale}
+</tbody>
+</table>
+<h3>Stale Docs By Owner</h3>
+<table>
+<thead><tr><th>Owner</th>{period_headers}</tr></thead>
+<tbody>
+{backlog}
+</tbody>
+</table>
+""".format
+
+NO_OWNER = "(no owner)"
+
+CSV_FILENAME = "decay-report.csv.gz"
+CSV_HEADER = ("Name", "Age (Days)", "Changed By", "Link")
+
+# A row of the report: the name, age, last editor and link of a document.
+Row = Tuple[str, Union[int, str], str, str]
+
+
+def render_trends(trends: Trends) -> Tuple[str, str]:
+    """
+    Renders the trends from the history as the text and HTML sections of the admin report.
+    """
+    days = f"{trends.days:g}"
+    periods = [str(p) for p in trends.periods]
+    text = text_trends_template(
+        days=days,
+        newly_stale="\n".join(f"| {d.name} | {d.owner or NO_OWNER} | [{d.link}]({d.link}) |"
+                              for d in trends.newly_stale),
+        period_headers=" | ".join(periods),
+        period_rules="|".join("-" * (len(p) + 2) for p in periods),
+        backlog="\n".join(f"| {owner or NO_OWNER} | " + " | ".join(map(str, counts)) + " |"
+                          for owner, counts in trends.backlog))
+    html = html_trends_template(
+        days=days,
+        newly_stale="\n".join(f"<tr><td>{escape(str(d.name))}</td><td>{escape(d.owner or NO_OWNER)}</td>"
+                              f"<td><a href=\"{escape(str(d.link))}\">{escape(str(d.link))}</a></td></tr>"
+                              for d in trends.newly_stale),
+        period_headers="".join(f"<th>{p}</th>" for p in periods),
+        backlog="\n".join(f"<tr><td>{escape(owner or NO_OWNER)}</td>" + "".join(f"<td>{c}</td>" for c in counts)
+                          + "</tr>" for owner, counts in trends.backlog))
+    return text, html
+
+
+def report_row(a: FileAnalysis, now: datetime.datetime) -> Row:
+    stale_days = (now - as_utc(a.last_change)).days if a.last_change else "Never updated"
+    return a.doc_name, stale_days, a.changed_by_email, a.file_link
+
 
 class DocReport(object):
-    def __init__(self, recipients: List[str], context: DocCheckerContext):
+    def __init__(self, recipients: List[str], context: DocCheckerContext, trends: Union[Trends, None] = None):
         self.context: DocCheckerContext = context
         self.recipients: List[str] = recipients
-        self.analyses: List[FileAnalysis] = []
+        self.sources: List[Iterable[FileAnalysis]] = []
+        self.trends = trends
+        self.count = 0
 
     def title(self):
         raise NotImplemented()
@@ -63,43 +164,77 @@ class DocReport(object):
     def subject(self):
         raise NotImplemented()
 
-    def add_analysis(self, analysis: Union[List[FileAnalysis], FileAnalysis]):
-        if isinstance(analysis, list):
-            self.analyses = [*self.analyses, *analysis]
-        else:
-            self.analyses.append(analysis)
-
-    def send(self):
-        sg = sendgrid.SendGridAPIClient(api_key=self.context.sendgrid_api_key)
-        markdowner = Markdown(extras=["tables"])
-
-        from_email = sendgrid.Email(self.context.from_email)
-        body = []
-        for a in self.analyses:
-            stale_days = (datetime.datetime.now(tz=a.last_change.tzinfo) - a.last_change).days if a.last_change else "Never updated"
-            body.append(line_item_template.format(file_path=a.doc_name, file_link=a.file_link,
-                                                  changed_by=a.changed_by_email, stale_days=stale_days))
-
-        plain_text = body_template.format(item_list="\n".join(body),
-                                          github_repo=self.context.github_repo,
-                                          github_repo_root=self.context.github_repo_path,
-                                          max_stale_days=self.context.doc_is_stale_after_days)
-        html_text = markdowner.convert(plain_text)
-
-        content_text = sendgrid.Content("text/plain", plain_text)
-        content_html = sendgrid.Content("text/html", html_text + "\n" + css)
-
-        recipients = list(map(lambda x: sendgrid.To(x), self.recipients))
-        mail = sendgrid.Mail(from_email, recipients, self.subject(), plain_text_content=content_text,
-                             html_content=content_html)
-        response = sg.client.mail.send.post(request_body=mail.get())
-
-        if 300 > response.status_code >= 200:
-            success(f"Successfully sent email to {', '.join(self.recipients)} regarding {len(self.analyses)} files", 2)
+    def add_analysis(self, analysis: Union[Iterable[FileAnalysis], FileAnalysis]):
+        """
+        Adds one analysis or many.  Iterables are only consumed once the report is rendered.
+        """
+        self.sources.append([analysis] if isinstance(analysis, FileAnalysis) else analysis)
+
+    def message(self) -> Message:
+        """
+        Renders the report as an email in a single pass over the analyses.  Once there are more than
+        `report_max_rows` rows, the rows are no longer inlined - they're streamed into a gzipped CSV attachment
+        instead.
+        """
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
+        max_rows = self.context.report_max_rows
+        rows: List[Row] = []
+        attachment = writer = None
+
+        self.count = 0
+        for a in chain.from_iterable(self.sources):
+            self.count += 1
+            row = report_row(a, now)
+            if writer:
+                writer.writerow(row)
+            elif max_rows and self.count > max_rows:
+                attachment = io.BytesIO()
+                csv_file = io.TextIOWrapper(gzip.GzipFile(fileobj=attachment, mode="wb"), encoding="utf-8",
+                                            newline="")
+                writer = csv.writer(csv_file)
+                writer.writerow(CSV_HEADER)
+                writer.writerows(rows)
+                writer.writerow(row)
+                rows = []
+            else:
+                rows.append(row)
+
+        attachments = []
+        if writer:
+            csv_file.close()
+            attachments.append(Attachment(CSV_FILENAME, "application/gzip", attachment.getvalue()))
+            text_items = text_attachment_line(count=self.count, filename=CSV_FILENAME)
+            html_items = html_attachment_line(count=self.count, filename=CSV_FILENAME)
         else:
-            error(
-                f"Failed to send email to {', '.join(self.recipients)} regarding {len(self.analyses)} files: "
-                f"{response.status_code} - {response.body}", 2)
+            text_items = "\n".join(text_line_item(file_path=r[0], stale_days=r[1], changed_by=r[2], file_link=r[3])
+                                   for r in rows)
+            html_items = "\n".join(html_line_item(file_path=escape(str(r[0])), stale_days=r[1],
+                                                  changed_by=escape(str(r[2] or "")), file_link=escape(str(r[3])))
+                                   for r in rows)
+
+        parameters = {
+            "github_repo": self.context.github_repo,
+            "github_repo_root": self.context.github_repo_path,
+            "max_stale_days": self.context.doc_is_stale_after_days,
+        }
+        text_trends, html_trends = render_trends(self.trends) if self.trends else ("", "")
+        plain_text = text_body_template(item_list=text_items, trends=text_trends, **parameters)
+        html_text = html_body_template(item_list=html_items, trends=html_trends,
+                                       **{k: escape(str(v)) for k, v in parameters.items()})
+
+        return Message(list(self.recipients), self.subject(), plain_text, html_text + "\n" + css, attachments)
+
+    def send(self, delivery: Union[Delivery, None] = None):
+        """
+        Sends the report.  If a delivery is given, the report is handed to it (and may only be sent when the
+        delivery is flushed) otherwise it's sent right away.
+        """
+        if delivery:
+            delivery.send(self.message())
+            return
+
+        with create_delivery(self.context) as delivery:
+            delivery.send(self.message())
 
 
 class OwnerReport(DocReport):
@@ -107,7 +242,7 @@ class OwnerReport(DocReport):
         return "Documentation Owner Report"
 
     def subject(self):
-        return owner_subject_template.format(stale_doc_count=len(self.analyses),
+        return owner_subject_template.format(stale_doc_count=self.count,
                                              stale_doc_days=self.context.doc_is_stale_after_days)
 
 
@@ -0,0 +1,245 @@
+import argparse
+import os
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Dict, Iterator, List, Tuple
+from urllib.parse import urlparse
+
+import yaml
+from configargparse import ArgumentParser
+
+from decay.analyzers import AnalysisSet, FileAnalysis
+from decay.context import DocCheckerContext, ACTION_MARK
+from decay.feedback import error, info
+from decay.metrics import metrics, record_cache_metrics
+from decay.pipeline import Consumer, run_pipeline
+
+# One of the documentation sources listed in a targets file.  The args are the command line arguments with the
+#   settings of the target applied and the host is used to limit the number of targets analyzed at once per host.
+Target = namedtuple("Target", ["name", "host", "args"])
+
+LOCAL_HOST = "local"
+
+# Arguments that only make sense on the command line
+COMMAND_LINE_ONLY = ("help", "config", "targets")
+
+
+def open_target(ctx: DocCheckerContext) -> Tuple[Iterator[FileAnalysis], Consumer]:
+    """
+    Starts the analysis of the documentation source given in the context.  Only the modules of that source are
+    imported.
+    :param ctx:
+    :return: The analyses (a generator) and the marker for the source.
+    :raises ValueError: If the context doesn't name a source.
+    """
+    if ctx.local:
+        from decay.analyzers.local import iter_local_analyses
+        return iter_local_analyses(ctx.local_repo_folder, ctx), marker_for(ctx)
+    elif ctx.github:
+        from decay.analyzers.github import iter_github_analyses
+        return iter_github_analyses(ctx.github_repo_path, ctx), marker_for(ctx)
+    elif ctx.confluence:
+        from decay.analyzers.confluence import iter_confluence_analyses
+        return iter_confluence_analyses(ctx.confluence_parent_page_id, ctx), marker_for(ctx)
+
+    raise ValueError("Unable to determine which documentation source to analyze.")
+
+
+def marker_for(ctx: DocCheckerContext) -> Consumer:
+    """
+    Creates a marker for the documentation source given in the context.  Markers are used once - create a new one
+    for every set of analyses to mark.
+    """
+    if ctx.local:
+        from decay.markers.local import LocalMarker
+        return LocalMarker(ctx)
+    elif ctx.github:
+        from decay.markers.github import github_marker
+        return github_marker(ctx)
+
+    from decay.markers.confluence import ConfluenceMarker
+    return ConfluenceMarker(ctx)
+
+
+def target_host(args: argparse.Namespace) -> str:
+    if args.local_repo_path:
+        return LOCAL_HOST
+    if args.github_access_token:
+        return urlparse(args.github_api_url).netloc
+    return urlparse(args.confluence_hostname or "").netloc or args.confluence_hostname or ""
+
+
+def target_options(parser: ArgumentParser) -> Dict[str, argparse.Action]:
+    """
+    The arguments that can be set in a targets file by their long name (without the dashes).
+    """
+    options = {}
+    for action in parser._actions:
+        if action.dest in COMMAND_LINE_ONLY:
+            continue
+        for option in action.option_strings:
+            if option.startswith("--"):
+                options[option[2:]] = action
+    return options
+
+
+def _convert_setting(action: argparse.Action, value: Any) -> Any:
+    """
+    Converts a value read from a targets file the way the parser converts the value of the argument.  Arguments
+    that can be given several times take a list (or a single value).
+    :raises ValueError: If the value isn't valid for the argument.
+    """
+    if action.nargs == 0:
+        if not isinstance(value, bool):
+            raise ValueError("expected true or false")
+        return value
+
+    if isinstance(action, argparse._AppendAction):
+        return [_convert_setting_value(action, item) for item in (value if isinstance(value, list) else [value])]
+    return _convert_setting_value(action, value)
+
+
+def _convert_setting_value(action: argparse.Action, value: Any) -> Any:
+    if isinstance(value, (list, dict)):
+        raise ValueError("expected a single value")
+
+    try:
+        converted = (action.type or str)(value if isinstance(value, str) else str(value))
+    except (TypeError, ValueError, argparse.ArgumentTypeError):
+        raise ValueError(f"invalid value {value!r}")
+    if action.choices is not None and converted not in action.choices:
+        raise ValueError(f"{converted!r} isn't one of {', '.join(map(str, action.choices))}")
+    return converted
+
+
+def load_targets(path: str, args: argparse.Namespace, parser: ArgumentParser) -> List[Target]:
+    """
+    Reads a targets file.  It's a YAML file with a list of targets under `targets` where each target sets any of the
+    command line arguments (using the long names) on top of the ones given on the command line, for example:
+
+        targets:
+          - name: handbook
+            github_owner: acme
+            github_repo: handbook
+            github_repo_folder: /
+            ignore_path: [drafts, archive]
+          - name: wiki
+            confluence_parent_page_id: "12345"
+
+    The values are converted like the command line arguments and the arguments that can be given several times
+    take a list.
+
+    Reports are sent by the main process so the email settings are removed from each target.  If a state path was
+    given on the command line, each target saves its state to a separate file named after the target.
+    :param path: The path to the targets file
+    :param args: The command line arguments
+    :param parser: The parser used to report errors
+    :return: The targets in the order they appear in the file.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f) or {}
+
+    entries = config.get("targets") if isinstance(config, dict) else config
+    if not isinstance(entries, list) or not entries:
+        parser.error(f"{path} must contain a list of targets")
+
+    targets = []
+    options = target_options(parser)
+    for i, entry in enumerate(entries):
+        settings = dict(entry or {})
+        name = str(settings.pop("name", f"target-{i + 1}"))
+        target_args = argparse.Namespace(**vars(args))
+        for key, value in settings.items():
+            if key not in options:
+                parser.error(f"'{key}' can't be set in target {name} in {path}")
+            try:
+                setattr(target_args, options[key].dest, _convert_setting(options[key], value))
+            except ValueError as e:
+                parser.error(f"'{key}' in target {name} in {path}: {str(e)}")
+
+        target_args.targets = None
+        target_args.actions = [ACTION_MARK] if ACTION_MARK in args.actions else []
+        target_args.from_email = None
+        target_args.administrator = None
+        if args.state_path and "state_path" not in settings:
+            root, ext = os.path.splitext(args.state_path)
+            target_args.state_path = f"{root}-{name}{ext}"
+
+        targets.append(Target(name, target_host(target_args), target_args))
+
+    return targets
+
+
+class _Collector(Consumer):
+    def __init__(self):
+        self.analyses = AnalysisSet()
+
+    def consume(self, analysis: FileAnalysis):
+        self.analyses.append(analysis)
+
+
+def analyze_target(args: argparse.Namespace) -> Tuple[AnalysisSet, dict]:
+    """
+    Analyzes (and marks) a single target.  This runs in a worker process so the analyses are returned in a compact
+    AnalysisSet which is cheap to send back to the main process, along with the metrics of the target.
+    """
+    # imported here because the main module imports this one
+    from decay.main import get_parser
+
+    # worker processes are reused for several targets so only the measurements of this one are returned
+    metrics.reset()
+    try:
+        ctx = DocCheckerContext(args, get_parser())
+    except SystemExit:
+        # the parser has printed what's wrong with the settings of the target
+        raise ValueError("The settings of the target are invalid")
+    analyses, marker = open_target(ctx)
+    collector = _Collector()
+    consumers = [marker, collector] if ctx.should_take_action(ACTION_MARK) else [collector]
+    if ctx.history:
+        from decay.history import HistoryRecorder
+        consumers.insert(0, HistoryRecorder(ctx))
+    run_pipeline(analyses, consumers)
+    record_cache_metrics(ctx)
+    return collector.analyses, metrics.snapshot()
+
+
+def run_targets(targets: List[Target], processes: int, per_host: int) -> Iterator[FileAnalysis]:
+    """
+    Analyzes the targets in a pool of worker processes.  No more than `per_host` targets on the same host are
+    analyzed at the same time (each worker has its own request budget, so this is what keeps the combined load on
+    one API in check).  A target that fails is reported and skipped.
+    :param targets: The targets to analyze
+    :param processes: The number of worker processes
+    :param per_host: The maximum number of targets on the same host analyzed at the same time
+    :return: Yields the analyses of each target once it's done.
+    """
+    processes = max(1, processes)
+    per_host = max(1, per_host)
+    pending = list(targets)
+    running = {}
+    busy_hosts = Counter()
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        while pending or running:
+            for target in list(pending):
+                if len(running) >= processes:
+                    break
+                if busy_hosts[target.host] < per_host:
+                    pending.remove(target)
+                    busy_hosts[target.host] += 1
+                    running[executor.submit(analyze_target, target.args)] = target
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                target = running.pop(future)
+                busy_hosts[target.host] -= 1
+                try:
+                    analyses, target_metrics = future.result()
+                    metrics.merge(target_metrics)
+                except Exception as e:
+                    error(f"Unable to analyze {target.name}: {str(e)}", 0)
+                    continue
+
+                info(f"Analyzed {len(analyses)} documents in {target.name}")
+                yield from analyses
@@ -0,0 +1,443 @@
+import hashlib
+import hmac
+import json
+import queue
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Callable, Dict, Iterable, List, Set, Tuple, Union
+from urllib.parse import urlparse, parse_qs
+
+from decay.analyzers import FileAnalysis
+from decay.context import DocCheckerContext, ACTION_MARK, ACTION_EMAIL_OWNER, ACTION_SEND_ADMIN_REPORT
+from decay.feedback import info, error, warning
+from decay.pipeline import Consumer, run_pipeline
+from decay.util import changed_within_days
+
+# Github lists at most this many commits in a push webhook.
+PUSH_COMMIT_LIMIT = 20
+
+# Confluence events that add or change a page and the ones that take a page away.
+CONFLUENCE_UPDATE_EVENTS = ("page_created", "page_updated", "page_restored", "page_moved")
+CONFLUENCE_REMOVE_EVENTS = ("page_removed", "page_trashed")
+
+
+class DocIndex(Consumer):
+    """
+    The analyses of every document in the source kept in memory, keyed by the file identifier and indexed by
+    recipient (the owner of the document, or the administrator if it has none) so the stale documents of one owner
+    can be found without going through the rest.  Staleness is worked out when the index is read so documents
+    become stale while the service runs.  As a Consumer, it takes in the analyses of a crawl.
+    """
+    phase = "index"
+
+    def __init__(self, context: DocCheckerContext):
+        self.context = context
+        self.updated_at: Union[float, None] = None
+        self._analyses: Dict[str, FileAnalysis] = {}
+        self._by_recipient: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._analyses)
+
+    def consume(self, analysis: FileAnalysis):
+        self.put(analysis)
+
+    def _recipient(self, analysis: FileAnalysis) -> str:
+        return (analysis.owner or self.context.administrator or "").lower()
+
+    def put(self, analysis: FileAnalysis):
+        if not analysis.file_identifier:
+            # the analysis failed
+            return
+
+        with self._lock:
+            self._remove(analysis.file_identifier)
+            self._analyses[analysis.file_identifier] = analysis
+            self._by_recipient.setdefault(self._recipient(analysis), set()).add(analysis.file_identifier)
+            self.updated_at = time.time()
+
+    def remove(self, identifier: str):
+        with self._lock:
+            self._remove(identifier)
+            self.updated_at = time.time()
+
+    def _remove(self, identifier: str):
+        previous = self._analyses.pop(identifier, None)
+        if previous:
+            self._by_recipient.get(self._recipient(previous), set()).discard(identifier)
+
+    def _refresh(self, analysis: FileAnalysis) -> FileAnalysis:
+        if analysis.last_change:
+            analysis.file_changed_recently = changed_within_days(analysis.last_change,
+                                                                 self.context.doc_is_stale_after_days)
+        return analysis
+
+    def replace(self, analyses: Iterable[FileAnalysis]):
+        """
+        Replaces everything in the index with the given analyses.  The index keeps answering from the previous
+        analyses until the new ones are all in.
+        """
+        index = DocIndex(self.context)
+        for analysis in analyses:
+            index.put(analysis)
+
+        with self._lock:
+            self._analyses, self._by_recipient = index._analyses, index._by_recipient
+            self.updated_at = time.time()
+
+    def analyses(self) -> List[FileAnalysis]:
+        """
+        All the analyses with their staleness brought up to date.
+        """
+        with self._lock:
+            return [self._refresh(a) for a in self._analyses.values()]
+
+    def stale(self, recipient: Union[str, None] = None) -> List[FileAnalysis]:
+        """
+        The stale documents - only the ones that would be reported to the given recipient if one is given.
+        """
+        with self._lock:
+            if recipient is None:
+                candidates = self._analyses.values()
+            else:
+                candidates = [self._analyses[i] for i in self._by_recipient.get(recipient.lower(), ())]
+            return [a for a in map(self._refresh, candidates) if not a.file_changed_recently]
+
+
+def _in_scope(changed: Set[str], removed: Set[str], context: DocCheckerContext) -> Tuple[Set[str], Set[str]]:
+    """
+    Keeps the changed files that are analyzed and the removed files that were under the analyzed folder.
+    """
+    folder = (context.github_repo_path or "").strip("/")
+    prefix = folder + "/" if folder else ""
+
+    def analyzed(path: str) -> bool:
+        return path.startswith(prefix) and context.path_matcher.matches(path)
+
+    return {p for p in changed if analyzed(p)}, {p for p in removed if p.startswith(prefix)}
+
+
+def push_may_be_truncated(payload: dict) -> bool:
+    """
+    Whether the commits of a push webhook may not cover every change: Github only lists the first PUSH_COMMIT_LIMIT
+    commits and force pushes and new branches don't list what changed compared to the previous head.
+    """
+    return bool(payload.get("forced") or payload.get("created")) or \
+        len(payload.get("commits") or []) >= PUSH_COMMIT_LIMIT
+
+
+def github_push_changes(payload: dict, context: DocCheckerContext) -> Union[Tuple[Set[str], Set[str]], None]:
+    """
+    Works out which analyzed files a Github push touched from the commits listed in the webhook.
+    :param payload: The body of a push webhook
+    :param context:
+    :return: The paths to analyze again and the paths that were removed, or None if the push wasn't to the
+        analyzed branch.
+    """
+    if payload.get("ref") != f"refs/heads/{context.github_branch}":
+        return None
+
+    changed, removed = set(), set()
+    for commit in payload.get("commits") or []:
+        for path in (commit.get("added") or []) + (commit.get("modified") or []):
+            changed.add(path)
+            removed.discard(path)
+        for path in commit.get("removed") or []:
+            removed.add(path)
+            changed.discard(path)
+
+    return _in_scope(changed, removed, context)
+
+
+def recrawl(index: DocIndex, context: DocCheckerContext) -> int:
+    """
+    Analyzes the whole source again and replaces the index with the results.
+    :return: The number of documents in the index.
+    """
+    from decay.scheduler import open_target
+
+    analyses, _ = open_target(context)
+    index.replace(analyses)
+    info(f"Indexed {len(index)} documents")
+    return len(index)
+
+
+def update_from_github_push(index: DocIndex, payload: dict, context: DocCheckerContext) -> int:
+    """
+    Analyzes the files touched by a push again and drops the ones that were removed.  When the webhook may not list
+    every commit, the changes are found by comparing the commits before and after the push instead and if that's
+    not possible (a force push, a new branch or too many changed files), everything is analyzed again.
+    :return: The number of documents that were updated or removed.
+    """
+    from decay.analyzers.github import RepoFile, analyze_github_files, compare_commits
+
+    if context.local or not context.github or payload.get("deleted"):
+        return 0
+
+    if payload.get("ref") != f"refs/heads/{context.github_branch}":
+        return 0
+
+    if not push_may_be_truncated(payload):
+        changed, removed = github_push_changes(payload, context)
+    else:
+        changes = None
+        if not payload.get("forced") and not payload.get("created"):
+            changes = compare_commits(payload.get("before"), payload.get("after"), context)
+        if changes is None:
+            info("Unable to tell which files a push changed - analyzing everything again", 1)
+            return recrawl(index, context)
+        changed, removed = _in_scope(*changes, context)
+
+    for path in removed:
+        index.remove(path)
+
+    for analysis in analyze_github_files([RepoFile(p, None) for p in sorted(changed)], context):
+        index.put(analysis)
+
+    info(f"Updated {len(changed)} and removed {len(removed)} documents after a push", 1)
+    return len(changed) + len(removed)
+
+
+def update_from_confluence_event(index: DocIndex, payload: dict, context: DocCheckerContext) -> int:
+    """
+    Fetches a page that was created or changed again (if it's under the analyzed page) or drops a page that was
+    removed.
+    :return: The number of documents that were updated or removed.
+    """
+    from decay.analyzers.confluence import build_page_analysis
+
+    event = payload.get("event") or payload.get("webhookEvent") or ""
+    page_id = str((payload.get("page") or {}).get("id") or "")
+    if not page_id or not context.confluence:
+        return 0
+
+    if event in CONFLUENCE_REMOVE_EVENTS:
+        index.remove(page_id)
+        return 1
+
+    if event not in CONFLUENCE_UPDATE_EVENTS:
+        return 0
+
+    page = context.confluence.get_content(page_id, expand=("version", "ancestors"))
+    ancestors = [str(a.get("id")) for a in page.get("ancestors") or []]
+    root = str(context.confluence_parent_page_id)
+    if page_id != root and root not in ancestors:
+        # the page isn't (or is no longer) under the analyzed page
+        index.remove(page_id)
+        return 1
+
+    index.put(build_page_analysis(page, page['_links']['base'], context))
+    return 1
+
+
+def verify_github_signature(secret: Union[str, None], body: bytes, signature: Union[str, None]) -> bool:
+    if not secret:
+        return True
+    expected = "sha256=" + hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return bool(signature) and hmac.compare_digest(expected, signature)
+
+
+class DocService(object):
+    """
+    Keeps the index of a documentation source warm.  After the initial crawl, the index is only updated from
+    webhooks and reports and marking run from the index rather than from a new crawl.  Updates, reports and marking
+    are queued and run one at a time on a single worker thread so they never overlap.
+    """
+    def __init__(self, context: DocCheckerContext):
+        self.context = context
+        self.index = DocIndex(context)
+        self._tasks = queue.Queue()
+        self._worker = threading.Thread(target=self._work, daemon=True)
+
+    def start(self, crawl: bool = True):
+        if crawl:
+            self.submit("crawl", self.crawl)
+        self._worker.start()
+
+    def stop(self):
+        self._tasks.put(None)
+        self._worker.join()
+
+    def submit(self, name: str, task: Callable[[], object]):
+        self._tasks.put((name, task))
+
+    def wait(self):
+        """
+        Waits until everything submitted so far has run.
+        """
+        self._tasks.join()
+
+    def _work(self):
+        while True:
+            item = self._tasks.get()
+            try:
+                if item is None:
+                    return
+                name, task = item
+                try:
+                    task()
+                except Exception as e:
+                    error(f"Unable to {name}: {str(e)}", 0)
+            finally:
+                self._tasks.task_done()
+
+    def crawl(self):
+        # imported here because the scheduler imports the analyzers of every source
+        from decay.scheduler import open_target
+
+        analyses, _ = open_target(self.context)
+        run_pipeline(analyses, [self.index])
+        info(f"Indexed {len(self.index)} documents")
+
+    def report(self):
+        from decay.comms import result_consumers
+
+        run_pipeline(self.index.analyses(), result_consumers(self.context))
+
+    def mark(self):
+        from decay.scheduler import marker_for
+
+        # every mark starts a new branch
+        self.context.ref_with_changes = None
+        run_pipeline(self.index.analyses(), [marker_for(self.context)])
+
+    def status(self) -> dict:
+        return {"documents": len(self.index), "stale": len(self.index.stale()), "updated_at": self.index.updated_at,
+                "pending_tasks": self._tasks.unfinished_tasks}
+
+
+def analysis_json(a: FileAnalysis) -> dict:
+    return {"id": a.file_identifier, "name": a.doc_name, "link": a.file_link, "owner": a.owner,
+            "last_change": a.last_change.isoformat() if a.last_change else None,
+            "changed_by": a.changed_by_email}
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    """
+    The HTTP API of the service:
+
+        GET  /status                 the number of documents, stale documents and pending tasks
+        GET  /stale?owner=EMAIL      the stale documents reported to the given owner (all of them without an owner)
+        POST /webhooks/github        a Github push webhook
+        POST /webhooks/confluence    a Confluence page event
+        POST /reports                sends the reports requested on the command line from the index
+        POST /mark                   marks the documents in the index (if the mark action was given)
+
+    Github webhooks are signed with the webhook secret.  The other requests (apart from /status) must pass the secret
+    in the X-Decay-Token header or the token query parameter.  Without a secret, the service only listens on a
+    loopback address and every request is accepted.
+    """
+    service: DocService = None
+
+    def log_message(self, fmt, *args):
+        info(f"{self.address_string()} - {fmt % args}", 1)
+
+    def reply(self, status: int, body=None):
+        payload = json.dumps(body).encode("utf-8") if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    @staticmethod
+    def json_payload(body: bytes) -> Union[dict, None]:
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return None
+        return payload if isinstance(payload, dict) else None
+
+    def authorized(self) -> bool:
+        """
+        Whether the request passed the webhook secret (always true if there isn't one).
+        """
+        secret = self.service.context.webhook_secret
+        if not secret:
+            return True
+        token = self.headers.get("X-Decay-Token") or parse_qs(urlparse(self.path).query).get("token", [None])[0]
+        return hmac.compare_digest(secret.encode("utf-8"), (token or "").encode("utf-8"))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if url.path == "/status":
+            return self.reply(200, self.service.status())
+        if url.path == "/stale":
+            if not self.authorized():
+                return self.reply(401, {"message": "Bad token"})
+            stale = self.service.index.stale(query.get("owner"))
+            return self.reply(200, [analysis_json(a) for a in stale])
+        self.reply(404, {"message": "Not Found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        ctx = self.service.context
+
+        if url.path == "/webhooks/github":
+            if not verify_github_signature(ctx.webhook_secret, body, self.headers.get("X-Hub-Signature-256")):
+                return self.reply(401, {"message": "Bad signature"})
+            event = self.headers.get("X-GitHub-Event")
+            if event != "push":
+                return self.reply(200, {"message": f"Ignored {event}"})
+            payload = self.json_payload(body)
+            if payload is None:
+                return self.reply(400, {"message": "The body isn't a JSON object"})
+            self.service.submit("update from a push", lambda: update_from_github_push(self.service.index, payload,
+                                                                                      ctx))
+            return self.reply(202, {"message": "Queued"})
+
+        if url.path == "/webhooks/confluence":
+            if not self.authorized():
+                return self.reply(401, {"message": "Bad token"})
+            payload = self.json_payload(body)
+            if payload is None:
+                return self.reply(400, {"message": "The body isn't a JSON object"})
+            self.service.submit("update from a page event",
+                                lambda: update_from_confluence_event(self.service.index, payload, ctx))
+            return self.reply(202, {"message": "Queued"})
+
+        if url.path in ("/reports", "/mark") and not self.authorized():
+            return self.reply(401, {"message": "Bad token"})
+
+        if url.path == "/reports":
+            if not (ctx.should_take_action(ACTION_EMAIL_OWNER) or ctx.should_take_action(ACTION_SEND_ADMIN_REPORT)):
+                return self.reply(400, {"message": "No report actions were given"})
+            self.service.submit("send reports", self.service.report)
+            return self.reply(202, {"message": "Queued"})
+
+        if url.path == "/mark":
+            if not ctx.should_take_action(ACTION_MARK):
+                return self.reply(400, {"message": "The mark action wasn't given"})
+            self.service.submit("mark", self.service.mark)
+            return self.reply(202, {"message": "Queued"})
+
+        self.reply(404, {"message": "Not Found"})
+
+
+def create_server(service: DocService, host: str, port: int) -> ThreadingHTTPServer:
+    handler = type("BoundServiceHandler", (ServiceHandler,), {"service": service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def serve(context: DocCheckerContext):
+    """
+    Crawls the source given in the context once and then serves the index until interrupted.
+    """
+    service = DocService(context)
+    server = create_server(service, context.serve_host, context.serve_port)
+    service.start()
+    info(f"Serving on http://{context.serve_host}:{server.server_port} - indexing in the background")
+    if not context.webhook_secret:
+        warning("No webhook secret was given so requests aren't verified", 1)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
@@ -0,0 +1,64 @@
+import json
+import os
+from typing import Dict, Union
+
+from decay.analyzers import FileAnalysis
+from decay.feedback import warning
+
+STATE_VERSION = 1
+
+
+class AnalysisState(object):
+    """
+    The results of a previous run: which target was analyzed, the sha of the head of the branch at the time and
+    the analysis of every file keyed by the file identifier.
+    """
+    def __init__(self, target: str, head_sha: str, analyses: Dict[str, FileAnalysis]):
+        self.target = target
+        self.head_sha = head_sha
+        self.analyses = analyses
+
+
+def load_state(path: str) -> Union[AnalysisState, None]:
+    """
+    Loads the state saved by a previous run.
+    :param path: The path to the state file
+    :return: The state or None if there is no (usable) state at the given path.
+    """
+    if not path or not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        if data.get("version") != STATE_VERSION:
+            return None
+
+        analyses = [FileAnalysis.from_dict(a) for a in data["analyses"]]
+        return AnalysisState(data["target"], data["head_sha"], {a.file_identifier: a for a in analyses})
+
+    except Exception as e:
+        warning(f"Ignoring the state in {path} because it could not be read: {str(e)}", 1)
+        return None
+
+
+def save_state(path: str, state: AnalysisState):
+    """
+    Saves the state so that the next run can reuse it.  The file is replaced atomically so that an interrupted
+    run never leaves a partial state behind.
+    :param path: The path to the state file
+    :param state: The state to save
+    """
+    data = {
+        "version": STATE_VERSION,
+        "target": state.target,
+        "head_sha": state.head_sha,
+        "analyses": [a.to_dict() for a in state.analyses.values()]
+    }
+
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+    os.replace(temp_path, path)
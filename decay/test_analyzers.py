@@ -0,0 +1,50 @@
+import datetime
+
+from decay.analyzers import AnalysisSet
+from decay.analyzers.metadata import read_frontmatter_header
+
+NEW_YEAR = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def test_analysis_set_column_operations(make_analysis):
+    analyses = AnalysisSet([
+        make_analysis("a", "ann@example.com", 10, True, now=NEW_YEAR),
+        make_analysis("b", "", 30, True, now=NEW_YEAR),
+        make_analysis("c", "ann@example.com", 5, False, now=NEW_YEAR),
+        make_analysis("d", "ann@example.com", None, True, now=NEW_YEAR),
+        make_analysis("e", "bob@example.com", 20, True, now=NEW_YEAR),
+    ])
+
+    assert len(analyses) == 5
+    assert analyses.stale_indexes() == [0, 1, 3, 4]
+    assert [analyses.doc_names[i] for i in analyses.order_by_last_change()] == ["d", "b", "e", "a", "c"]
+
+    groups = analyses.group_by_owner(analyses.stale_indexes(), default="admin@example.com")
+    assert groups == {"ann@example.com": [0, 3], "admin@example.com": [1], "bob@example.com": [4]}
+
+    first = analyses[0]
+    assert first.last_change == datetime.datetime(2019, 12, 22, tzinfo=datetime.timezone.utc)
+    assert not first.file_changed_recently
+    assert analyses[3].last_change is None
+    assert [a.file_identifier for a in analyses] == ["a", "b", "c", "d", "e"]
+
+
+class BodyMustNotBeRead(object):
+    """
+    Yields the lines of a document and fails if anything past the header is requested.
+    """
+    def __init__(self, header_lines):
+        self.header_lines = header_lines
+
+    def __iter__(self):
+        yield from self.header_lines
+        raise AssertionError("the body was read")
+
+
+def test_frontmatter_header_stops_at_the_closing_delimiter():
+    lines = [b"---\n", b"title: Hello\n", b"owner: ann@example.com\n", b"---\n"]
+    assert read_frontmatter_header(BodyMustNotBeRead(lines)) == {"title": "Hello", "owner": "ann@example.com"}
+
+    assert read_frontmatter_header([b"# No header\n", b"---\n"]) == {}
+    assert read_frontmatter_header([b"---\r\n", b"title: [unclosed\r\n", b"---\r\n"]) is None
+    assert read_frontmatter_header([b"---\n", b"title: Never closed\n"]) is None
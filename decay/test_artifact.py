@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+from decay.analyzers import FileAnalysis
+from decay.artifact import AnalysisWriter, read_analyses
+from decay.main import main
+from decay.pipeline import run_pipeline
+
+
+SOURCE = {"kind": "local", "id": "/repo:docs"}
+
+
+@pytest.mark.parametrize("name", ["results.jsonl", "results.jsonl.gz"])
+def test_analyses_are_replayed_with_their_staleness_recalculated(tmp_path, name, make_analysis):
+    path = str(tmp_path / name)
+    failed = FileAnalysis()
+
+    run_pipeline([make_analysis("a.md", "ann@example.com", 10), failed, make_analysis("b.md", "ann@example.com", 40)],
+                 [AnalysisWriter(path, SOURCE)])
+
+    assert os.listdir(tmp_path) == [name]
+    analyses = list(read_analyses(path, 30))
+    assert [(a.file_identifier, a.file_changed_recently) for a in analyses] == [("a.md", True), ("b.md", False)]
+    assert analyses[0].owner == "ann@example.com"
+    assert [a.file_changed_recently for a in read_analyses(path, 5)] == [False, False]
+
+
+def test_other_files_are_rejected(tmp_path):
+    path = tmp_path / "results.jsonl"
+    path.write_text('{"file_identifier": "a.md"}\n')
+
+    with pytest.raises(ValueError):
+        read_analyses(str(path), 30)
+
+
+def test_one_analysis_feeds_a_later_mark(tmp_path, make_repo):
+    repo = make_repo(tmp_path / "repo")
+    path = str(tmp_path / "results.jsonl.gz")
+    source = ["-l", repo, "--local_repo_folder", "docs", "--email_validation", "syntax"]
+
+    main(["analyze", "--output", path] + source)
+
+    with open(os.path.join(repo, "docs/old.md")) as f:
+        assert "out_of_date" not in f.read()
+    assert sorted(a.file_identifier for a in read_analyses(path, 30)) == ["docs/new.md", "docs/old.md"]
+
+    main(["mark", "--input", path] + source)
+
+    with open(os.path.join(repo, "docs/old.md")) as f:
+        assert "out_of_date: true" in f.read()
+
+
+def test_analyses_are_only_replayed_against_their_source(tmp_path, make_repo, make_analysis):
+    path = str(tmp_path / "results.jsonl")
+    run_pipeline([make_analysis("a.md", "ann@example.com", 40)], [AnalysisWriter(path, SOURCE)])
+
+    assert len(list(read_analyses(path, 30, dict(SOURCE)))) == 1
+    assert len(list(read_analyses(path, 30))) == 1
+    with pytest.raises(ValueError, match="/repo:docs"):
+        read_analyses(path, 30, {"kind": "local", "id": "/other:docs"})
+    with pytest.raises(ValueError):
+        read_analyses(path, 30, {"kind": "github", "id": "/repo:docs"})
+
+    other = make_repo(tmp_path / "other")
+    with pytest.raises(SystemExit):
+        main(["mark", "--input", path, "-l", other, "--email_validation", "syntax"])
+    with pytest.raises(SystemExit):
+        main(["analyze", "-l", other, "--email_validation", "syntax"])
@@ -0,0 +1,20 @@
+from benchmarks.run import SOURCE_CONFLUENCE, SOURCE_GITHUB, run_scenario
+
+
+def test_github_benchmark_runs_end_to_end():
+    result = run_scenario(SOURCE_GITHUB, docs=12, depth=2, breadth=2, doc_size=100)
+
+    assert result["analyses"] == 12
+    # the repo, one tree per folder level, one history batch and the content of each file
+    assert result["requests_by_api"]["github"] <= 20
+    assert result["requests_by_api"]["sendgrid"] >= 1
+
+
+def test_confluence_benchmark_runs_end_to_end():
+    result = run_scenario(SOURCE_CONFLUENCE, docs=12, depth=2, actions=["send_admin_report"],
+                          extra=["--confluence_page_size", "5"])
+
+    # the root page is analyzed too
+    assert result["analyses"] == 13
+    assert result["requests_by_api"] == {"confluence": 4, "sendgrid": 1}
+    assert result["emails"] == 1
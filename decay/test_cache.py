@@ -0,0 +1,80 @@
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from decay.cache import ResponseCache, CachingSession
+
+
+class EtagHandler(BaseHTTPRequestHandler):
+    """
+    Serves a fixed body with an ETag and answers 304 when the client already has it.
+    """
+    statuses = []
+
+    def do_GET(self):
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.statuses.append(304)
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body = b'{"path": "%s"}' % self.path.encode()
+        self.statuses.append(200)
+        self.send_response(200)
+        self.send_header("ETag", '"v1"')
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server_url(serve):
+    EtagHandler.statuses = []
+    return serve(EtagHandler)
+
+
+def test_conditional_requests_are_served_from_the_cache(tmp_path, server_url):
+    path = str(tmp_path / "cache.db")
+    session = CachingSession(ResponseCache(path, 1024 * 1024))
+    first = session.get(server_url + "/commits", params={"path": "a.md"})
+
+    # a new run with the same cache file
+    session = CachingSession(ResponseCache(path, 1024 * 1024))
+    second = session.get(server_url + "/commits", params={"path": "a.md"})
+
+    assert EtagHandler.statuses == [200, 304]
+    assert first.json() == second.json() == {"path": "/commits?path=a.md"}
+    assert second.from_cache
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.db"), 25)
+    cache.put("blob:a", b"a" * 10)
+    cache.put("blob:b", b"b" * 10)
+    assert cache.get("blob:a")
+
+    cache.put("blob:c", b"c" * 10)
+
+    assert cache.get("blob:b") is None
+    assert cache.get("blob:a").body == b"a" * 10
+    assert cache.get("blob:c").body == b"c" * 10
+    assert cache.size() == 20
+
+
+def test_caches_shared_by_processes_stay_under_the_limit(tmp_path):
+    path = str(tmp_path / "cache.db")
+    first, second = ResponseCache(path, 25), ResponseCache(path, 25)
+    first.put("blob:a", b"a" * 10)
+    second.put("blob:b", b"b" * 10)
+    assert first.get("blob:a")
+    first.close()
+
+    # the total is shared so the entry of the first cache counts too
+    second.put("blob:c", b"c" * 10)
+
+    assert second.get("blob:b") is None
+    assert second.get("blob:a") and second.get("blob:c")
+    assert second.size() == 20
@@ -0,0 +1,237 @@
+import datetime
+import json
+from http.server import BaseHTTPRequestHandler
+from types import SimpleNamespace
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+from decay.analyzers.confluence import analyze_confluence_page_tree
+from decay.clients import ConfluenceClient
+from decay.context import CONFLUENCE_FETCH_CQL, CONFLUENCE_FETCH_CRAWL
+from decay.markers.confluence import ConfluenceMarker
+from decay.metrics import metrics
+from decay.pipeline import run_pipeline
+from decay.throttle import BudgetLane, RateLimitBudget
+from decay.transport import Transport
+
+
+def make_pages(depth, breadth):
+    """
+    Generates a tree of pages as a dict of page id to (parent id, title, last change).
+    """
+    pages = {"1": (None, "Root", "2020-01-01T00:00:00.000Z")}
+    parents = ["1"]
+    for level in range(depth):
+        children = []
+        for parent in parents:
+            for i in range(breadth):
+                page_id = f"{parent}{i}"
+                pages[page_id] = (parent, f"Page {page_id}", "2099-01-01T00:00:00.000Z")
+                children.append(page_id)
+        parents = children
+    return pages
+
+
+class FakeConfluenceHandler(BaseHTTPRequestHandler):
+    """
+    A tiny stand-in for the parts of the Confluence REST API used by decay.  Searches are paginated with a cursor in
+    the next link like Confluence Cloud does.
+    """
+    pages = {}
+    paths = []
+    puts = []
+    # the version number, message and author of the pages that were changed since they were created (as version 1)
+    versions = {}
+
+    def page(self, page_id, expand):
+        parent, title, when = self.pages[page_id]
+        page = {"id": page_id, "type": "page", "title": title,
+                "_links": {"webui": f"/pages/{page_id}"}}
+        if "version" in expand:
+            number, message, by = self.versions.get(page_id, (1, "", {"publicName": "Ann", "email": "ann@example.com"}))
+            page["version"] = {"when": when, "number": number, "message": message, "by": by}
+        return page
+
+    def descendants(self, page_id):
+        found = []
+        for child, (parent, _, _) in self.pages.items():
+            ancestor = parent
+            while ancestor:
+                if ancestor == page_id:
+                    found.append(child)
+                    break
+                ancestor = self.pages[ancestor][0]
+        return sorted(found)
+
+    def paginate(self, found, query, base, path, expand):
+        limit = int(query["limit"])
+        start = int(query.get("cursor", 0))
+        results = [self.page(p, expand) for p in found[start:start + limit]]
+        links = {"base": base}
+        if start + limit < len(found):
+            cql = f"cql={query['cql']}&" if "cql" in query else ""
+            links["next"] = f"{path[len('/wiki'):]}?{cql}expand={expand}&limit={limit}&cursor={start + limit}"
+        return {"results": results, "size": len(results), "_links": links}
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        self.paths.append(url.path)
+        expand = query.get("expand", "")
+        base = f"http://{self.headers['Host']}/wiki"
+        parts = url.path.split("/")
+
+        if url.path == "/wiki/rest/api/content/search":
+            page_id = query["cql"].split("=")[1].split()[0]
+            body = self.paginate(self.descendants(page_id), query, base, url.path, expand)
+
+        elif url.path.endswith("/child/page"):
+            children = sorted(p for p, v in self.pages.items() if v[0] == parts[-3])
+            body = self.paginate(children, query, base, url.path, expand)
+
+        else:
+            body = self.page(parts[-1], expand)
+            body["_links"]["base"] = base
+
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_PUT(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        page_id = urlparse(self.path).path.split("/")[-1]
+        number = body["version"]["number"]
+        if number != self.versions.get(page_id, (1,))[0] + 1:
+            self.send_response(409)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        self.puts.append((page_id, body["title"], number))
+        parent, _, _ = self.pages[page_id]
+        self.pages[page_id] = (parent, body["title"], datetime.datetime.now(datetime.timezone.utc).isoformat())
+        self.versions[page_id] = (number, body["version"].get("message", ""), {"publicName": "Decay"})
+
+        payload = json.dumps({"id": page_id, "title": body["title"]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def confluence(serve):
+    FakeConfluenceHandler.pages = make_pages(depth=3, breadth=3)
+    FakeConfluenceHandler.paths = []
+    FakeConfluenceHandler.puts = []
+    FakeConfluenceHandler.versions = {}
+    return ConfluenceClient("user", "token", serve(FakeConfluenceHandler) + "/wiki", session=Transport(retries=0))
+
+
+def make_context(confluence, fetch):
+    budget = RateLimitBudget(max_in_flight=4)
+    confluence.session.limit(confluence.host, budget)
+    return SimpleNamespace(confluence=confluence, confluence_fetch=fetch, confluence_page_size=10,
+                           confluence_concurrency=4, confluence_budget=budget, http=confluence.session,
+                           doc_is_stale_after_days=30)
+
+
+class CountingLane(BudgetLane):
+    count = 0
+
+    def __enter__(self):
+        self.count += 1
+        return super().__enter__()
+
+
+def test_cql_fetch_returns_every_descendant(confluence):
+    analyses = analyze_confluence_page_tree("1", make_context(confluence, CONFLUENCE_FETCH_CQL))
+
+    assert len(analyses) == len(FakeConfluenceHandler.pages)
+    assert sorted(a.file_identifier for a in analyses) == sorted(FakeConfluenceHandler.pages.keys())
+    # 39 descendants in pages of 10 and one request for the root page
+    assert len(FakeConfluenceHandler.paths) == 5
+
+    root = analyses[-1]
+    assert root.doc_name == "Root"
+    assert not root.file_changed_recently
+    assert root.file_link == confluence.host + "/pages/1"
+    assert all(a.file_changed_recently for a in analyses[:-1])
+    assert analyses[0].changed_by_email == "ann@example.com"
+
+
+def test_crawl_visits_every_page_without_recursion(confluence):
+    FakeConfluenceHandler.pages = make_pages(depth=4, breadth=4)
+
+    analyses = analyze_confluence_page_tree("1", make_context(confluence, CONFLUENCE_FETCH_CRAWL))
+
+    assert len(analyses) == len(FakeConfluenceHandler.pages) == 341
+    assert sorted(a.file_identifier for a in analyses) == sorted(FakeConfluenceHandler.pages.keys())
+    # breadth first: the root comes first
+    assert analyses[0].file_identifier == "1"
+
+
+def test_marker_only_writes_titles_that_need_to_change(confluence):
+    FakeConfluenceHandler.pages["10"] = ("1", "Page 10 (Stale)", "2099-01-01T00:00:00.000Z")
+    FakeConfluenceHandler.pages["11"] = ("1", "Page 11 (Stale)", "2000-01-01T00:00:00.000Z")
+    ctx = make_context(confluence, CONFLUENCE_FETCH_CQL)
+    analyses = analyze_confluence_page_tree("1", ctx)
+    FakeConfluenceHandler.paths = []
+
+    run_pipeline(analyses, [ConfluenceMarker(ctx)])
+
+    # the root is stale and page 10 was changed recently - page 11 is already marked
+    assert sorted(FakeConfluenceHandler.puts) == [("1", "Root (Stale)", 2), ("10", "Page 10", 2)]
+    assert FakeConfluenceHandler.paths == []
+
+
+def test_marked_pages_stay_marked(confluence):
+    ctx = make_context(confluence, CONFLUENCE_FETCH_CQL)
+    run_pipeline(analyze_confluence_page_tree("1", ctx), [ConfluenceMarker(ctx)])
+    assert FakeConfluenceHandler.puts == [("1", "Root (Stale)", 2)]
+
+    # the rename doesn't count as a change so the page is still stale (and still changed by Ann) the next time
+    analyses = analyze_confluence_page_tree("1", ctx)
+    root = next(a for a in analyses if a.file_identifier == "1")
+    assert not root.file_changed_recently
+    assert root.changed_by_email == "ann@example.com"
+
+    run_pipeline(analyses, [ConfluenceMarker(ctx)])
+    assert FakeConfluenceHandler.puts == [("1", "Root (Stale)", 2)]
+
+
+def test_a_page_renamed_after_the_analysis_keeps_its_new_title(confluence):
+    ctx = make_context(confluence, CONFLUENCE_FETCH_CQL)
+    analyses = analyze_confluence_page_tree("1", ctx)
+    FakeConfluenceHandler.pages["1"] = (None, "Handbook", "2020-01-01T00:00:00.000Z")
+    FakeConfluenceHandler.versions["1"] = (2, "", {"publicName": "Bob"})
+
+    run_pipeline(analyses, [ConfluenceMarker(ctx)])
+
+    assert FakeConfluenceHandler.puts == [("1", "Handbook (Stale)", 3)]
+
+
+def test_marker_requests_are_counted_against_the_budget(confluence):
+    ctx = make_context(confluence, CONFLUENCE_FETCH_CQL)
+    analyses = analyze_confluence_page_tree("1", ctx)
+    FakeConfluenceHandler.pages["1"] = (None, "Handbook", "2020-01-01T00:00:00.000Z")
+    FakeConfluenceHandler.versions["1"] = (2, "", {"publicName": "Bob"})
+    lane = CountingLane(ctx.confluence_budget, 2)
+    ctx.confluence_budget.lane = lambda max_in_flight: lane
+    metrics.reset()
+
+    run_pipeline(analyses, [ConfluenceMarker(ctx)])
+
+    # the refused update, the page read again and the update that went through
+    assert lane.count == 3
+    requests = metrics.snapshot()["requests"]
+    assert sum(r["count"] for name, r in requests.items() if name.startswith("PUT ")) == 2
+    assert sum(r["count"] for name, r in requests.items() if name.startswith("GET ")) == 1
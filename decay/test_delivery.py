@@ -0,0 +1,86 @@
+import json
+import socket
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+from decay.delivery import Message, SendGridDelivery, SmtpDelivery, SENDGRID_TEXT_TAG
+from decay.transport import Transport
+
+
+class FakeSendGridHandler(BaseHTTPRequestHandler):
+    """
+    Throttles the first request and accepts the ones after that, recording the body of every request.
+    """
+    bodies = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.bodies.append(body)
+        self.send_response(429 if len(self.bodies) == 1 else 202)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def sendgrid_url(serve):
+    FakeSendGridHandler.bodies = []
+    return serve(FakeSendGridHandler) + "/v3/mail/send"
+
+
+def make_messages(count, size=10):
+    return [Message([f"owner{i}@example.com"], f"Report {i}", "t" * size, "<p>h</p>") for i in range(count)]
+
+
+def test_sendgrid_packs_reports_into_personalizations_and_retries(sendgrid_url):
+    delivery = SendGridDelivery("key", "noreply@example.com", session=Transport(backoff=0), url=sendgrid_url)
+    with delivery:
+        for message in make_messages(3) + make_messages(1, size=20000):
+            delivery.send(message)
+
+    # the throttled packed request is retried and the large report is sent on its own
+    assert len(FakeSendGridHandler.bodies) == 3
+    packed = FakeSendGridHandler.bodies[1]
+    assert packed == FakeSendGridHandler.bodies[0]
+    assert [p["to"][0]["email"] for p in packed["personalizations"]] == \
+        ["owner0@example.com", "owner1@example.com", "owner2@example.com"]
+    assert packed["personalizations"][2]["subject"] == "Report 2"
+    assert packed["personalizations"][2]["substitutions"][SENDGRID_TEXT_TAG] == "t" * 10
+    assert FakeSendGridHandler.bodies[2]["content"][0]["value"] == "t" * 20000
+    assert delivery.sent == 4 and delivery.failed == 0
+
+
+def test_smtp_reuses_pooled_connections():
+    aiosmtpd_controller = pytest.importorskip("aiosmtpd.controller")
+
+    class Recorder(object):
+        def __init__(self):
+            self.sessions = set()
+            self.recipients = []
+
+        async def handle_DATA(self, server, session, envelope):
+            self.sessions.add(id(session))
+            self.recipients.extend(envelope.rcpt_tos)
+            return "250 OK"
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+
+    handler = Recorder()
+    controller = aiosmtpd_controller.Controller(handler, hostname="127.0.0.1", port=port)
+    controller.start()
+    try:
+        delivery = SmtpDelivery("127.0.0.1", port, "noreply@example.com", connections=2)
+        with delivery:
+            for message in make_messages(10):
+                delivery.send(message)
+    finally:
+        controller.stop()
+
+    assert sorted(handler.recipients) == sorted(f"owner{i}@example.com" for i in range(10))
+    assert len(handler.sessions) <= 2
+    assert delivery.sent == 10
@@ -0,0 +1,248 @@
+import datetime
+import json
+from http.server import BaseHTTPRequestHandler
+from types import SimpleNamespace
+
+from decay.analyzers import FileAnalysis
+from decay.analyzers import github as github_analyzer
+from decay.analyzers.github import enumerate_github_files, analyze_github_path
+from decay.context import ENUMERATE_TREE, ENUMERATE_WALK
+from decay.matcher import PathMatcher
+from decay.throttle import RateLimitBudget
+from decay.transport import github_client_options
+
+
+def make_context(repo, ignore_paths=(), ignore_files=()):
+    return SimpleNamespace(repo_ob=repo, github=None, github_branch="master", github_enumeration=ENUMERATE_TREE,
+                           github_repo_owner="owner", github_repo="repo", github_history_batch_size=0,
+                           github_budget=RateLimitBudget(), workers=1, state_path=None, doc_is_stale_after_days=30,
+                           extensions=[".md", ".html"], ignore_paths=list(ignore_paths),
+                           ignore_files=list(ignore_files),
+                           path_matcher=PathMatcher([".md", ".html"], ignore_paths, ignore_files))
+
+
+def element(path, type_, sha):
+    return SimpleNamespace(path=path, type=type_, sha=sha)
+
+
+class FakeTreeRepo(object):
+    """
+    Serves a fixed set of git trees.  Recursive listings of the trees named in `truncated` are reported as
+    truncated to exercise the fallback.
+    """
+    def __init__(self, trees, truncated=()):
+        self.trees = trees
+        self.truncated = truncated
+        self.requests = []
+
+    def get_git_tree(self, sha, recursive=False):
+        self.requests.append((sha, recursive))
+        elements = []
+        if recursive:
+            def walk(tree_sha, prefix):
+                for e in self.trees[tree_sha]:
+                    elements.append(element(prefix + e.path, e.type, e.sha))
+                    if e.type == "tree":
+                        walk(e.sha, prefix + e.path + "/")
+            walk(sha, "")
+        else:
+            elements = self.trees[sha]
+
+        is_truncated = recursive and sha in self.truncated
+        return SimpleNamespace(tree=elements, raw_data={"truncated": is_truncated})
+
+
+TREES = {
+    "master": [element("docs", "tree", "t-docs"), element("README.md", "blob", "b-readme")],
+    "t-docs": [element("index.md", "blob", "b-index"), element("guide", "tree", "t-guide"),
+               element("legacy", "tree", "t-legacy"), element("image.png", "blob", "b-png")],
+    "t-guide": [element("start.md", "blob", "b-start"), element("deep", "tree", "t-deep")],
+    "t-deep": [element("more.html", "blob", "b-more")],
+    "t-legacy": [element("old.md", "blob", "b-old")],
+}
+
+
+def test_tree_enumeration_filters_locally():
+    ctx = make_context(FakeTreeRepo(TREES), ignore_paths=["docs/legacy"], ignore_files=["docs/index.md"])
+
+    files = enumerate_github_files("/docs", ctx)
+
+    assert sorted(files) == [("docs/guide/deep/more.html", "b-more"), ("docs/guide/start.md", "b-start")]
+    # one request to find the folder and one for the whole subtree
+    assert ctx.repo_ob.requests == [("master", False), ("t-docs", True)]
+
+
+def test_tree_enumeration_falls_back_when_truncated():
+    ctx = make_context(FakeTreeRepo(TREES, truncated=("master", "t-docs")))
+
+    files = enumerate_github_files("/", ctx)
+
+    assert sorted(f.path for f in files) == ["README.md", "docs/guide/deep/more.html", "docs/guide/start.md",
+                                             "docs/index.md", "docs/legacy/old.md"]
+
+
+def test_truncated_tree_skips_ignored_subtrees():
+    repo = FakeTreeRepo(TREES, truncated=("master", "t-docs"))
+    ctx = make_context(repo, ignore_paths=["**/legacy", "docs/guide"])
+
+    files = enumerate_github_files("/", ctx)
+
+    assert sorted(f.path for f in files) == ["README.md", "docs/index.md"]
+    assert ("t-legacy", True) not in repo.requests
+    assert ("t-guide", True) not in repo.requests
+
+
+class FakeContentsRepo(FakeTreeRepo):
+    def get_contents(self, path, ref=None):
+        self.requests.append(path)
+        sha = "master"
+        for component in [c for c in path.split("/") if c]:
+            sha = [e.sha for e in self.trees[sha] if e.path == component][0]
+        prefix = path.strip("/") + "/" if path.strip("/") else ""
+        return [SimpleNamespace(path=prefix + e.path, sha=e.sha, type="dir" if e.type == "tree" else "file")
+                for e in self.trees[sha]]
+
+
+def test_walk_does_not_descend_into_ignored_folders():
+    repo = FakeContentsRepo(TREES)
+    ctx = make_context(repo, ignore_paths=["docs/guide/*"])
+    ctx.github_enumeration = ENUMERATE_WALK
+
+    files = enumerate_github_files("/", ctx)
+
+    assert sorted(f.path for f in files) == ["README.md", "docs/guide/start.md", "docs/index.md",
+                                             "docs/legacy/old.md"]
+    assert repo.requests == ["/", "docs", "docs/guide", "docs/legacy"]
+
+
+class CountingBudget(RateLimitBudget):
+    def __init__(self):
+        super().__init__()
+        self.used = 0
+
+    def __enter__(self):
+        self.used += 1
+        return super().__enter__()
+
+
+def test_enumeration_requests_count_against_the_budget():
+    for enumeration, repo in ((ENUMERATE_TREE, FakeTreeRepo(TREES, truncated=("master",))),
+                              (ENUMERATE_WALK, FakeContentsRepo(TREES))):
+        ctx = make_context(repo)
+        ctx.github_enumeration = enumeration
+        ctx.github_budget = CountingBudget()
+
+        enumerate_github_files("/", ctx)
+
+        assert ctx.github_budget.used == len(repo.requests) > 0
+
+
+class FakeIncrementalRepo(FakeTreeRepo):
+    def __init__(self, trees, head_sha, changed_files):
+        super().__init__(trees)
+        self.head_sha = head_sha
+        self.changed_files = changed_files
+
+    def get_branch(self, name):
+        return SimpleNamespace(commit=SimpleNamespace(sha=self.head_sha))
+
+    def compare(self, base, head):
+        files = [SimpleNamespace(filename=f, status="modified", previous_filename=None) for f in self.changed_files]
+        return SimpleNamespace(status="ahead", files=files)
+
+
+def test_incremental_analysis_only_analyzes_changed_files(tmp_path, monkeypatch):
+    analyzed = []
+
+    def fake_analyze(repo, path_to_file, context, last_change=None, sha=None):
+        analyzed.append(path_to_file)
+        analysis = FileAnalysis()
+        analysis.file_identifier = path_to_file
+        analysis.last_change = datetime.datetime.now(tz=datetime.timezone.utc) - datetime.timedelta(days=20)
+        analysis.file_changed_recently = True
+        return analysis
+
+    monkeypatch.setattr(github_analyzer, "analyze_github_file", fake_analyze)
+    ctx = make_context(FakeIncrementalRepo(TREES, "sha-1", []))
+    ctx.state_path = str(tmp_path / "state.json")
+
+    first = analyze_github_path("/docs", ctx)
+    assert sorted(analyzed) == ["docs/guide/deep/more.html", "docs/guide/start.md", "docs/index.md",
+                                "docs/legacy/old.md"]
+
+    # the next run sees a new head where one file changed and a stricter stale age
+    analyzed.clear()
+    ctx.repo_ob = FakeIncrementalRepo(TREES, "sha-2", ["docs/index.md"])
+    ctx.doc_is_stale_after_days = 10
+    second = analyze_github_path("/docs", ctx)
+
+    assert analyzed == ["docs/index.md"]
+    assert len(second) == len(first) == 4
+    stale = sorted(a.file_identifier for a in second if not a.file_changed_recently)
+    assert stale == ["docs/guide/deep/more.html", "docs/guide/start.md", "docs/legacy/old.md"]
+
+
+def test_a_comparison_at_the_file_limit_analyzes_everything(tmp_path, monkeypatch):
+    analyzed = []
+
+    def fake_analyze(repo, path_to_file, context, last_change=None, sha=None):
+        analyzed.append(path_to_file)
+        analysis = FileAnalysis()
+        analysis.file_identifier = path_to_file
+        return analysis
+
+    monkeypatch.setattr(github_analyzer, "analyze_github_file", fake_analyze)
+    ctx = make_context(FakeIncrementalRepo(TREES, "sha-1", []))
+    ctx.state_path = str(tmp_path / "state.json")
+    analyze_github_path("/docs", ctx)
+
+    # Github lists no more than 300 files in a comparison so the ones changed in docs may be missing from the list
+    analyzed.clear()
+    changed = ["docs/index.md"] + [f"src/file-{i}.py" for i in range(github_analyzer.COMPARE_FILE_LIMIT - 1)]
+    ctx.repo_ob = FakeIncrementalRepo(TREES, "sha-2", changed)
+    analyze_github_path("/docs", ctx)
+
+    assert sorted(analyzed) == ["docs/guide/deep/more.html", "docs/guide/start.md", "docs/index.md",
+                                "docs/legacy/old.md"]
+
+
+class NoRateLimitHandler(BaseHTTPRequestHandler):
+    """
+    A Github Enterprise server with rate limiting turned off: no rate limit headers and no /rate_limit.
+    """
+    base = ""
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        body = None
+        if path == "/repos/owner/repo":
+            body = {"full_name": "owner/repo", "url": f"{self.base}/repos/owner/repo"}
+        elif path == "/repos/owner/repo/contents/":
+            body = [{"type": "dir", "path": "docs", "name": "docs", "sha": "t-docs"},
+                    {"type": "file", "path": "README.md", "name": "README.md", "sha": "b-readme"}]
+        elif path == "/repos/owner/repo/contents/docs":
+            body = [{"type": "file", "path": "docs/index.md", "name": "index.md", "sha": "b-index"}]
+
+        data = json.dumps(body if body is not None else {"message": "Rate limiting is not enabled."}).encode("utf-8")
+        self.send_response(200 if body is not None else 404)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_responses_without_rate_limit_headers_are_fine(serve):
+    from github import Github
+
+    NoRateLimitHandler.base = serve(NoRateLimitHandler)
+    github = Github(base_url=NoRateLimitHandler.base, **github_client_options(100, retries=0))
+    ctx = make_context(github.get_repo("owner/repo"))
+    ctx.github = github
+    ctx.github_enumeration = ENUMERATE_WALK
+
+    files = enumerate_github_files("/", ctx)
+
+    assert sorted(f.path for f in files) == ["README.md", "docs/index.md"]
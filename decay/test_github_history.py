@@ -0,0 +1,63 @@
+import datetime
+import json
+from http.server import BaseHTTPRequestHandler
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+from decay.analyzers.github_history import fetch_last_changes
+from decay.throttle import RateLimitBudget
+
+HISTORY = {
+    "docs/a.md": {"date": "2020-01-02T03:04:05Z", "name": "Ann", "email": "ann@example.com"},
+    "docs/b.md": {"date": "2020-02-03T04:05:06+02:00", "name": "Bob", "email": "bob@example.com"},
+}
+
+
+class FakeGraphQLHandler(BaseHTTPRequestHandler):
+    """
+    Answers aliased `history` queries from the HISTORY table and records every request that was made.
+    """
+    requests = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.requests.append(body)
+        histories = {}
+        for name, value in body["variables"].items():
+            if name.startswith("p"):
+                nodes = [{"committer": HISTORY[value]}] if value in HISTORY else []
+                histories[name] = {"nodes": nodes}
+
+        payload = json.dumps({"data": {"repository": {"object": histories}}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def graphql_url(serve):
+    FakeGraphQLHandler.requests = []
+    return serve(FakeGraphQLHandler) + "/graphql"
+
+
+def test_last_changes_are_fetched_in_batches(graphql_url):
+    ctx = SimpleNamespace(github_graphql_url=graphql_url, github_history_batch_size=2, github_token="token",
+                          github_repo_owner="owner", github_repo="repo", github_branch="master",
+                          github_budget=RateLimitBudget(), http=requests.Session())
+
+    changes = fetch_last_changes(["docs/a.md", "docs/b.md", "docs/missing.md"], ctx)
+
+    assert len(FakeGraphQLHandler.requests) == 2
+    assert FakeGraphQLHandler.requests[0]["variables"]["ref"] == "master"
+    assert set(changes.keys()) == {"docs/a.md", "docs/b.md"}
+    assert changes["docs/a.md"].date == datetime.datetime(2020, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc)
+    assert changes["docs/b.md"].date == datetime.datetime(2020, 2, 3, 2, 5, 6, tzinfo=datetime.timezone.utc)
+    assert changes["docs/b.md"].name == "Bob"
+    assert changes["docs/b.md"].email == "bob@example.com"
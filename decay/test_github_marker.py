@@ -0,0 +1,142 @@
+from types import SimpleNamespace
+
+import frontmatter
+
+from decay.analyzers import FileAnalysis
+from decay.cache import ContentStore
+from decay.markers.github import BulkGithubMarker, update_file
+from decay.metrics import metrics
+from decay.throttle import RateLimitBudget
+
+
+class FakeMarkedRepo(object):
+    """
+    Records file updates and the git objects that are created and fails if a file is downloaded again.
+    """
+    def __init__(self, files=None):
+        # the blob sha and mode of each file at the head of the branch
+        self.files = files or {}
+        self.listed = []
+        self.updates = []
+        self.blobs = {}
+        self.trees = []
+        self.commits = []
+        self.ref = SimpleNamespace(ref="refs/heads/decay-marker-1", object=SimpleNamespace(sha="head"),
+                                   edit=lambda sha: setattr(self.ref, "object", SimpleNamespace(sha=sha)))
+        self.pulls = []
+
+    def get_branch(self, name):
+        return SimpleNamespace(commit=SimpleNamespace(sha="head"))
+
+    def create_git_ref(self, ref, sha):
+        return self.ref
+
+    def get_git_commit(self, sha):
+        return SimpleNamespace(sha=sha, tree=SimpleNamespace(sha="tree-" + sha))
+
+    def get_git_tree(self, sha):
+        # the tree of a folder is "tree-head" for the root and "tree:<folder>" for the others
+        folder = "" if sha == "tree-head" else sha[len("tree:"):]
+        self.listed.append(folder)
+        prefix = folder + "/" if folder else ""
+        entries = {}
+        for path, (blob_sha, mode) in self.files.items():
+            if not path.startswith(prefix):
+                continue
+            name, _, rest = path[len(prefix):].partition("/")
+            entries[name] = SimpleNamespace(path=name, type="tree", mode="040000", sha="tree:" + prefix + name) \
+                if rest else SimpleNamespace(path=name, type="blob", mode=mode, sha=blob_sha)
+        return SimpleNamespace(sha=sha, tree=list(entries.values()))
+
+    def create_git_blob(self, content, encoding):
+        sha = f"blob-{len(self.blobs)}"
+        self.blobs[sha] = content
+        return SimpleNamespace(sha=sha)
+
+    def create_git_tree(self, elements, base_tree):
+        self.trees.append((elements, base_tree.sha))
+        return SimpleNamespace(sha="new-tree")
+
+    def create_git_commit(self, message, tree, parents):
+        self.commits.append((message, tree.sha, [p.sha for p in parents]))
+        return SimpleNamespace(sha="new-commit")
+
+    def create_pull(self, title, body, head, base):
+        self.pulls.append((head, base))
+        return SimpleNamespace(head=head)
+
+    def get_contents(self, path, ref=None):
+        raise AssertionError(f"{path} was downloaded again")
+
+    def update_file(self, path, message, content, sha, branch):
+        self.updates.append((path, content, sha, branch))
+        return {"sha": "new-commit"}, None
+
+
+def test_update_file_reuses_the_analyzed_content():
+    repo = FakeMarkedRepo()
+    contents = ContentStore()
+    contents.put("docs/a.md", b"---\ntitle: A\n---\nBody\n", "blob-a")
+    ctx = SimpleNamespace(repo_ob=repo, github=None, contents=contents, github_branch="master",
+                          ref_with_changes=SimpleNamespace(ref="refs/heads/decay-marker-1"),
+                          github_budget=RateLimitBudget())
+
+    analysis = FileAnalysis()
+    analysis.file_identifier = "docs/a.md"
+    analysis.file_changed_recently = False
+
+    assert update_file(ctx, analysis) == {"sha": "new-commit"}
+    path, content, sha, branch = repo.updates[0]
+    assert (path, sha, branch) == ("docs/a.md", "blob-a", "decay-marker-1")
+    assert frontmatter.loads(content)["out_of_date"] is True
+    assert len(contents) == 0
+
+
+def test_bulk_marker_creates_a_single_commit():
+    repo = FakeMarkedRepo({"docs/0.md": ("old-0", "100755"), "docs/1.md": ("old-1", "100644"),
+                           "docs/2.md": ("changed-since", "100644"), "docs/3.md": ("old-3", "100644"),
+                           "README.md": ("readme", "100644")})
+    contents = ContentStore()
+    ctx = SimpleNamespace(repo_ob=repo, github=None, contents=contents, github_branch="master",
+                          ref_with_changes=None, github_budget=RateLimitBudget())
+
+    marker = BulkGithubMarker(ctx)
+    for i, stale in enumerate([True, False, True, True]):
+        path = f"docs/{i}.md"
+        contents.put(path, b"---\ntitle: Doc\n---\nBody\n", f"old-{i}")
+        analysis = FileAnalysis()
+        analysis.file_identifier = path
+        analysis.file_changed_recently = not stale
+        marker.consume(analysis)
+    marker.finish()
+
+    assert len(repo.blobs) == 3
+    assert all(frontmatter.loads(c)["out_of_date"] is True for c in repo.blobs.values())
+    assert len(repo.trees) == 1 and len(repo.commits) == 1
+    elements, base_tree = repo.trees[0]
+    # docs/2.md was changed after it was read so it's left alone and each file keeps its mode
+    assert sorted((e._identity["path"], e._identity["mode"]) for e in elements) == \
+        [("docs/0.md", "100755"), ("docs/3.md", "100644")]
+    assert sorted(set(repo.listed)) == ["", "docs"]
+    assert base_tree == "tree-head"
+    assert repo.commits[0][1:] == ("new-tree", ["head"])
+    assert repo.ref.object.sha == "new-commit"
+    assert repo.pulls == [("decay-marker-1", "master")]
+
+
+def test_files_that_werent_kept_are_read_within_the_budget():
+    repo = FakeMarkedRepo()
+    repo.get_contents = lambda path, ref=None: SimpleNamespace(decoded_content=b"---\ntitle: A\n---\nBody\n",
+                                                               sha="blob-a")
+    ctx = SimpleNamespace(repo_ob=repo, github=None, contents=None, github_branch="master", ref_with_changes=None,
+                          github_budget=RateLimitBudget())
+    analysis = FileAnalysis()
+    analysis.file_identifier = "docs/a.md"
+    analysis.file_changed_recently = False
+
+    metrics.reset()
+    update_file(ctx, analysis)
+
+    assert repo.updates[0][2] == "blob-a"
+    assert {"github-client get_contents", "github-client get_branch", "github-client create_git_ref",
+            "github-client update_file"} <= set(metrics.snapshot()["requests"])
@@ -0,0 +1,66 @@
+import time
+from types import SimpleNamespace
+
+from decay.history import HistoryRecorder, HistoryStore
+from decay.pipeline import run_pipeline
+from decay.reports import AdminReport
+
+DAY = 24 * 60 * 60
+
+
+def add_run(history, target, started_at, analyses, finish=True):
+    run_id = history.start_run(target, started_at)
+    history.add_results(run_id, analyses)
+    if finish:
+        history.finish_run(run_id)
+    return run_id
+
+
+def test_trends_compare_the_latest_runs(tmp_path, make_analysis):
+    history = HistoryStore(str(tmp_path / "history.db"))
+    now = time.time()
+    add_run(history, "docs", now - 15 * DAY, [make_analysis("a", "ann@example.com", stale=True),
+                                              make_analysis("b", "ann@example.com", stale=False)])
+    add_run(history, "docs", now - 8 * DAY, [make_analysis("a", "ann@example.com", stale=True),
+                                             make_analysis("b", "ann@example.com", stale=False),
+                                             make_analysis("c", None, stale=False)])
+    add_run(history, "docs", now - DAY, [make_analysis("a", "ann@example.com", stale=True),
+                                         make_analysis("b", "ann@example.com", stale=True),
+                                         make_analysis("c", None, stale=True),
+                                         make_analysis("d", "bob@example.com", stale=True)])
+    # an unfinished run is never used
+    add_run(history, "docs", now, [make_analysis("a", "ann@example.com", stale=False)], finish=False)
+    add_run(history, "wiki", now - DAY, [make_analysis("p", "bob@example.com", stale=True)])
+
+    assert [(d.document, d.owner) for d in history.newly_stale("docs", 7, now)] == [("b", "ann@example.com"),
+                                                                                  ("c", None)]
+    assert history.newly_stale("wiki", 7, now) == []
+
+    assert history.owner_backlog("docs", 7, 3, now) == {"ann@example.com": [2, 1, 1], "": [1, 0, 0],
+                                                        "bob@example.com": [1, 0, 0]}
+    assert history.owner_backlog(None, 7, 1, now) == {"ann@example.com": [2], "": [1], "bob@example.com": [2]}
+
+
+def test_recorder_stores_a_run_and_the_admin_report_shows_the_trends(tmp_path, make_analysis):
+    history = HistoryStore(str(tmp_path / "history.db"))
+    add_run(history, "docs", time.time() - 10 * DAY, [make_analysis("a", "ann@example.com", stale=False)])
+    add_run(history, "docs", time.time() - 40 * DAY, [make_analysis("a", "ann@example.com", stale=False)])
+    ctx = SimpleNamespace(history=history, history_keep_days=30, report_max_rows=10, github_repo="repo",
+                          github_repo_path="/docs", doc_is_stale_after_days=30)
+
+    recorder = HistoryRecorder(ctx, "docs")
+    recorder.batch_size = 1
+    run_pipeline([make_analysis("a", "ann@example.com", stale=True, doc_name="A", file_link="https://example.com/a"),
+                  make_analysis("b", None, stale=True)], [recorder])
+
+    trends = history.trends("docs", 7)
+    assert [d.document for d in trends.newly_stale] == ["a"]
+    # the run older than history_keep_days was pruned
+    assert dict(trends.backlog) == {"ann@example.com": [1, 0, 0, 0], "": [1, 0, 0, 0]}
+
+    message = AdminReport(["admin@example.com"], ctx, trends).message()
+
+    assert "### Became Stale In The Last 7 Days" in message.text
+    assert "| A | ann@example.com | [https://example.com/a](https://example.com/a) |" in message.text
+    assert "| (no owner) | 1 | 0 | 0 | 0 |" in message.text
+    assert "<tr><td>ann@example.com</td><td>1</td><td>0</td><td>0</td><td>0</td></tr>" in message.html
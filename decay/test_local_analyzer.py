@@ -0,0 +1,68 @@
+import datetime
+import os
+import subprocess
+from types import SimpleNamespace
+
+from decay.analyzers.local import analyze_local_path, local_link_base, read_last_changes
+from decay.matcher import PathMatcher
+from decay.validation import EmailValidator
+
+
+def test_last_changes_come_from_a_single_log_pass(tmp_path, make_repo):
+    repo = make_repo(tmp_path)
+
+    changes = read_last_changes(repo, ["docs/old.md", "docs/new.md"], "docs")
+
+    assert changes["docs/old.md"].date == datetime.datetime(2019, 5, 1, 10, tzinfo=datetime.timezone.utc)
+    assert changes["docs/old.md"].name == "ann"
+    assert changes["docs/new.md"].email == "bob@example.com"
+
+
+def test_local_analysis(tmp_path, make_repo):
+    repo = make_repo(tmp_path)
+    ctx = SimpleNamespace(local_repo_path=repo, extensions=[".md"], ignore_paths=[], ignore_files=[],
+                          path_matcher=PathMatcher([".md"]), email_validator=EmailValidator(False),
+                          doc_is_stale_after_days=30, github_repo_owner=None, github_repo=None)
+
+    analyses = analyze_local_path("/docs/", ctx)
+
+    assert [a.file_identifier for a in analyses] == ["docs/old.md", "docs/new.md"]
+    old, new = analyses
+    assert not old.file_changed_recently
+    assert old.doc_name == "Old"
+    assert old.owner is None
+    assert old.file_link == os.path.join(repo, "docs/old.md")
+    assert new.file_changed_recently
+    assert new.changed_by_name == "bob"
+
+
+def test_shallow_clones_only_attribute_the_fetched_history(tmp_path, make_repo, commit):
+    repo = make_repo(tmp_path / "full")
+    commit(repo, {"other/outside.md": "changed"}, datetime.datetime.now(tz=datetime.timezone.utc).isoformat(), "cy")
+    clone = str(tmp_path / "shallow")
+    subprocess.run(["git", "clone", "-q", "--depth", "2", f"file://{repo}", clone], check=True)
+
+    changes = read_last_changes(clone, ["docs/old.md", "docs/new.md", "other/outside.md"], "/")
+
+    assert sorted(changes) == ["other/outside.md"]
+    assert read_last_changes(repo, ["docs/old.md"], "docs")["docs/old.md"].name == "ann"
+
+
+def test_links_point_to_the_host_of_the_repo(tmp_path, make_repo):
+    repo = make_repo(tmp_path)
+    ctx = SimpleNamespace(local_repo_path=repo, github_repo_owner=None, github_repo=None,
+                          github_api_url="https://api.github.com")
+
+    assert local_link_base(ctx) is None
+    for remote, base in (("git@ghe.example.com:docs/handbook.git", "https://ghe.example.com/docs/handbook"),
+                         ("https://user@gitlab.example.com/docs/handbook.git/",
+                          "https://gitlab.example.com/docs/handbook"),
+                         ("ssh://git@ghe.example.com:2222/docs/handbook", "https://ghe.example.com/docs/handbook")):
+        subprocess.run(["git", "-C", repo, "remote", "remove", "origin"], stderr=subprocess.DEVNULL)
+        subprocess.run(["git", "-C", repo, "remote", "add", "origin", remote], check=True)
+        assert local_link_base(ctx) == base
+
+    ctx.github_repo_owner, ctx.github_repo = "acme", "handbook"
+    assert local_link_base(ctx) == "https://github.com/acme/handbook"
+    ctx.github_api_url = "https://ghe.example.com/api/v3"
+    assert local_link_base(ctx) == "https://ghe.example.com/acme/handbook"
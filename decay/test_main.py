@@ -1,6 +1,9 @@
 import argparse
+import subprocess
+import sys
+
 import pytest
-from decay.main import get_parser, DocCheckerContext
+from decay.main import get_parser, main, DocCheckerContext
 
 
 def test_arg_dependencies():
@@ -38,3 +41,22 @@ def test_arg_dependencies():
              '--sengrid_api_key', 'test'])
         DocCheckerContext(args,parser)
 
+
+
+def test_backends_are_imported_lazily():
+    # a fresh interpreter is needed since other tests have already imported the backends
+    loaded = subprocess.run(
+        [sys.executable, "-c", "import sys, decay.main; "
+                               "print(','.join(m for m in ('github', 'pyfluence', 'frontmatter', 'email_validator', "
+                               "'requests') if m in sys.modules))"],
+        check=True, stdout=subprocess.PIPE).stdout.decode("utf-8").strip()
+
+    assert loaded == ""
+
+
+def test_input_cant_be_served(tmp_path, monkeypatch, make_repo):
+    monkeypatch.setattr("decay.service.serve", lambda ctx: pytest.fail("the service was started"))
+    repo = make_repo(tmp_path / "repo")
+
+    with pytest.raises(SystemExit):
+        main(["serve", "--local_repo_path", repo, "--input", str(tmp_path / "analyses.jsonl")])
@@ -0,0 +1,22 @@
+from decay.matcher import PathMatcher, glob_to_regex
+
+
+def test_ignored_folders_and_files():
+    matcher = PathMatcher([".md", ".html"], ignore_paths=["legacy", "docs/old/", "**/_posts", "*/drafts"],
+                          ignore_files=["README.md", "**/CHANGELOG.md", "docs/tmp-[0-9].md"])
+
+    analyzed = ["x/legacy/a.md", "docs/new.html", "k/l/drafts/a.md", "docs/README.md", "docs/tmp-a.md"]
+    skipped = ["legacy/a.md", "legacy/deep/er/a.md", "docs/old/b/c.md", "_posts/q.md", "z/y/_posts/q.md",
+               "k/drafts/a.md", "README.md", "CHANGELOG.md", "d/e/CHANGELOG.md", "docs/tmp-1.md", "docs/a.txt"]
+
+    assert [p for p in analyzed if matcher.matches(p)] == analyzed
+    assert [p for p in skipped if matcher.matches(p)] == []
+    assert matcher.is_pruned("legacy/deep")
+    assert not matcher.is_pruned("docs")
+
+
+def test_glob_translation():
+    assert glob_to_regex("a/*.md") == "a/[^/]*\\.md"
+    assert glob_to_regex("**/x") == "(?:.*/)?x"
+    assert glob_to_regex("[!ab]") == "[^ab]"
+    assert glob_to_regex("[x") == "\\[x"
@@ -0,0 +1,55 @@
+import json
+import os
+import tempfile
+
+from decay.metrics import Metrics, endpoint_name, profiled
+
+
+def test_endpoint_name_groups_items():
+    assert endpoint_name("get", "https://api.github.com/repos/a/b/git/blobs/" + "a" * 40) == \
+        "GET api.github.com/repos/a/b/git/blobs/:id"
+    assert endpoint_name("put", "https://wiki.example.com/rest/api/content/12345") == \
+        "PUT wiki.example.com/rest/api/content/:id"
+
+
+def test_merge_and_export():
+    worker = Metrics()
+    with worker.phase("analyze"):
+        pass
+    worker.observe_request("GET host/x", 0.07)
+    worker.observe_request("GET host/x", 20, failed=True)
+    worker.increment("cache_hits", 3)
+    worker.increment("cache_misses")
+    worker.set_gauge("rate_limit_remaining_host", 42)
+
+    combined = Metrics()
+    combined.observe_request("GET host/x", 0.01)
+    combined.merge(worker.snapshot())
+
+    stats = combined.snapshot()["requests"]["GET host/x"]
+    assert stats["count"] == 3
+    assert stats["errors"] == 1
+    assert stats["buckets"][0] == 1 and stats["buckets"][1] == 1 and stats["buckets"][-1] == 1
+
+    exported = json.loads(combined.to_json())
+    assert exported["cache_hit_ratio"] == 0.75
+    assert "analyze" in exported["phases"]
+
+    text = combined.to_prometheus()
+    assert 'decay_request_duration_seconds_bucket{endpoint="GET host/x",le="0.05"} 1' in text
+    assert 'decay_request_duration_seconds_bucket{endpoint="GET host/x",le="+Inf"} 3' in text
+    assert 'decay_request_errors_total{endpoint="GET host/x"} 1' in text
+    assert "decay_rate_limit_remaining_host 42.0" in text
+
+
+def test_profiled_writes_summary():
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "run.prof")
+        with profiled(path):
+            sorted(str(i) for i in range(1000))
+
+        assert os.path.getsize(path)
+        with open(path + ".txt", encoding="utf-8") as f:
+            summary = f.read()
+        assert "Peak memory" in summary
+        assert "cumulative" in summary
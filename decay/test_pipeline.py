@@ -0,0 +1,41 @@
+import random
+
+from decay.pipeline import Consumer, run_pipeline, sorted_merge, by_last_change
+
+
+class Recorder(Consumer):
+    def __init__(self, events):
+        self.events = events
+
+    def consume(self, analysis):
+        self.events.append(("consume", analysis.file_identifier))
+
+    def finish(self):
+        self.events.append(("finish", None))
+
+
+def test_consumers_see_each_analysis_as_it_is_produced(make_analysis):
+    events = []
+
+    def produce():
+        for i in range(3):
+            events.append(("produce", f"doc-{i}"))
+            yield make_analysis(f"doc-{i}", days_ago=i)
+
+    count = run_pipeline(produce(), [Recorder(events)])
+
+    assert count == 3
+    assert events == [("produce", "doc-0"), ("consume", "doc-0"), ("produce", "doc-1"), ("consume", "doc-1"),
+                      ("produce", "doc-2"), ("consume", "doc-2"), ("finish", None)]
+
+
+def test_sorted_merge_spills_runs_and_merges_them(make_analysis):
+    rng = random.Random(4)
+    analyses = [make_analysis(f"doc-{i}", days_ago=rng.randint(0, 1000)) for i in range(95)]
+    analyses.append(make_analysis("doc-95"))
+
+    merged = list(sorted_merge(iter(analyses), run_size=10))
+
+    expected = sorted(analyses, key=by_last_change)
+    assert [a.file_identifier for a in merged] == [a.file_identifier for a in expected]
+    assert [a.last_change for a in merged] == [a.last_change for a in expected]
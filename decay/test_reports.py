@@ -0,0 +1,61 @@
+import csv
+import datetime
+import gzip
+import io
+from types import SimpleNamespace
+
+from decay.analyzers import FileAnalysis
+from decay.comms import OwnerDigest
+from decay.reports import AdminReport, OwnerReport, CSV_FILENAME
+
+
+def make_analyses(count):
+    for i in range(count):
+        analysis = FileAnalysis()
+        analysis.doc_name = f"Doc <{i}>"
+        analysis.file_link = f"https://example.com/{i}"
+        analysis.changed_by_email = "ann@example.com"
+        analysis.last_change = datetime.datetime.now(tz=datetime.timezone.utc) - \
+            datetime.timedelta(days=40 + i, hours=1)
+        yield analysis
+
+
+def make_context(max_rows):
+    return SimpleNamespace(report_max_rows=max_rows, github_repo="repo", github_repo_path="/docs",
+                           doc_is_stale_after_days=30)
+
+
+def test_rows_are_rendered_into_both_bodies():
+    report = OwnerReport(["ann@example.com"], make_context(10))
+    report.add_analysis(make_analyses(3))
+
+    message = report.message()
+
+    assert message.subject.startswith("Documentation Checker Owner Report - 3 docs")
+    assert "| Doc <1> | 41 | ann@example.com | [https://example.com/1](https://example.com/1) |" in message.text
+    assert "<tr><td>Doc &lt;1&gt;</td><td>41</td><td>ann@example.com</td>" in message.html
+    assert not message.attachments
+
+
+def test_large_reports_attach_a_gzipped_csv():
+    report = AdminReport(["admin@example.com"], make_context(2))
+    report.add_analysis(make_analyses(5))
+
+    message = report.message()
+
+    assert "5 docs are listed in the attached" in message.text
+    assert "Doc &lt;" not in message.html
+    attachment, = message.attachments
+    assert attachment.filename == CSV_FILENAME
+    rows = list(csv.reader(io.StringIO(gzip.decompress(attachment.content).decode("utf-8"))))
+    assert rows[0] == ["Name", "Age (Days)", "Changed By", "Link"]
+    assert [r[0] for r in rows[1:]] == [f"Doc <{i}>" for i in range(5)]
+
+
+def test_owner_digest_keeps_only_stale_documents():
+    digest = OwnerDigest(make_context(10))
+    for i, analysis in enumerate(make_analyses(4)):
+        analysis.file_changed_recently = i % 2 == 0
+        digest.consume(analysis)
+
+    assert [digest.analyses[i].doc_name for i in range(len(digest.analyses))] == ["Doc <1>", "Doc <3>"]
@@ -0,0 +1,76 @@
+import os
+
+import pytest
+
+from decay.main import get_parser
+from decay.scheduler import LOCAL_HOST, load_targets, run_targets
+
+
+def write_targets(tmp_path, content):
+    path = tmp_path / "targets.yml"
+    path.write_text(content)
+    return str(path)
+
+
+def test_targets_are_analyzed_in_worker_processes(tmp_path, make_repo):
+    first = make_repo(tmp_path / "first")
+    second = make_repo(tmp_path / "second")
+    path = write_targets(tmp_path, f"targets:\n"
+                                   f"  - name: first\n    local_repo_path: {first}\n    local_repo_folder: docs\n"
+                                   f"  - local_repo_path: {second}\n")
+    parser = get_parser()
+    args = parser.parse_args(["mark", "--targets", path, "--state_path", str(tmp_path / "state.json")])
+
+    targets = load_targets(path, args, parser)
+    assert [t.name for t in targets] == ["first", "target-2"]
+    assert {t.host for t in targets} == {LOCAL_HOST}
+    assert targets[0].args.state_path == str(tmp_path / "state-first.json")
+    assert targets[1].args.from_email is None
+
+    analyses = list(run_targets(targets, processes=2, per_host=1))
+
+    assert sorted(a.file_identifier for a in analyses) == \
+        ["docs/new.md", "docs/new.md", "docs/old.md", "docs/old.md", "other/outside.md"]
+    with open(os.path.join(first, "docs/old.md")) as f:
+        assert "out_of_date: true" in f.read()
+
+
+def test_unknown_target_settings_are_rejected(tmp_path):
+    path = write_targets(tmp_path, "targets:\n  - github_repository: typo\n")
+    parser = get_parser()
+    args = parser.parse_args(["mark", "--targets", path])
+
+    with pytest.raises(SystemExit):
+        load_targets(path, args, parser)
+
+
+def test_target_settings_are_converted_like_arguments(tmp_path):
+    path = write_targets(tmp_path, "targets:\n"
+                                   "  - local_repo_path: /docs\n    ignore_path: legacy\n"
+                                   "    ignore_file: [a.md, b.md]\n"
+                                   "    stale_age_in_days: '10'\n    output: out.jsonl\n    smtp_starttls: true\n")
+    parser = get_parser()
+    args = parser.parse_args(["mark", "--targets", path, "--ignore_path", "drafts"])
+
+    target = load_targets(path, args, parser)[0]
+    assert target.args.ignore_paths == ["legacy"]
+    assert target.args.ignore_files == ["a.md", "b.md"]
+    assert target.args.stale_age_in_days == 10
+    assert target.args.output_path == "out.jsonl"
+    assert target.args.smtp_starttls is True
+
+    for setting in ("ignore_paths: [legacy]", "stale_age_in_days: soon", "github_mark_mode: sometimes",
+                    "targets: other.yml"):
+        path = write_targets(tmp_path, f"targets:\n  - {setting}\n")
+        with pytest.raises(SystemExit):
+            load_targets(path, args, parser)
+
+
+def test_a_target_without_a_source_is_reported(tmp_path, capsys):
+    path = write_targets(tmp_path, "targets:\n  - name: empty\n    stale_age_in_days: 10\n")
+    parser = get_parser()
+    args = parser.parse_args(["mark", "--targets", path])
+
+    assert list(run_targets(load_targets(path, args, parser), processes=1, per_host=1)) == []
+    assert "Unable to analyze empty: Unable to determine which documentation source to analyze." \
+        in capsys.readouterr().out
@@ -0,0 +1,210 @@
+import datetime
+import hashlib
+import hmac
+import json
+import threading
+import urllib.error
+import urllib.request
+from types import SimpleNamespace
+
+import pytest
+
+from decay.context import DocCheckerContext
+from decay.main import get_parser
+from decay.matcher import PathMatcher
+from decay.service import DocService, DocIndex, create_server, github_push_changes, update_from_github_push
+from decay.throttle import RateLimitBudget
+
+# A Github push webhook as recorded (trimmed to the fields decay reads).
+PUSH_PAYLOAD = {
+    "ref": "refs/heads/master",
+    "commits": [
+        {"id": "a1", "added": ["docs/new.md"], "modified": ["docs/guide.md", "README.md"], "removed": []},
+        {"id": "b2", "added": [], "modified": ["docs/images/logo.png"], "removed": ["docs/old.md"]},
+    ],
+}
+
+# A Confluence page_updated webhook as recorded.
+PAGE_UPDATED_PAYLOAD = {"event": "page_updated", "timestamp": 1600000000000,
+                        "page": {"id": "12", "title": "Runbook", "spaceKey": "DOC"}}
+
+SECRET = "s3cret"
+
+
+def make_context(**kwargs):
+    actions = kwargs.pop("actions", [])
+    ctx = SimpleNamespace(local=False, github=object(), confluence=None, github_branch="master",
+                          github_repo_path="/docs", path_matcher=PathMatcher([".md"]), doc_is_stale_after_days=30,
+                          administrator="admin@example.com", webhook_secret=SECRET, actions=actions,
+                          should_take_action=lambda action: action in actions)
+    ctx.__dict__.update(kwargs)
+    return ctx
+
+
+@pytest.fixture
+def service():
+    started = []
+
+    def start(ctx):
+        svc = DocService(ctx)
+        svc.start(crawl=False)
+        server = create_server(svc, "127.0.0.1", 0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        started.append((svc, server))
+        return svc, f"http://127.0.0.1:{server.server_port}"
+
+    yield start
+
+    for svc, server in started:
+        server.shutdown()
+        server.server_close()
+        svc.stop()
+
+
+def request(url, body=None, headers=None):
+    data = json.dumps(body).encode("utf-8") if body is not None else None
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data, headers=headers or {})) as response:
+            return response.status, json.loads(response.read() or b"null")
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b"null")
+
+
+def test_push_changes_are_limited_to_the_analyzed_branch_and_files():
+    ctx = make_context()
+
+    assert github_push_changes(PUSH_PAYLOAD, ctx) == ({"docs/new.md", "docs/guide.md"}, {"docs/old.md"})
+    assert github_push_changes(dict(PUSH_PAYLOAD, ref="refs/heads/feature"), ctx) is None
+
+
+def test_push_webhook_updates_the_index(service, monkeypatch, make_analysis):
+    old = datetime.datetime(2019, 1, 1, tzinfo=datetime.timezone.utc)
+    analyzed = []
+
+    def analyze_github_files(files, context):
+        analyzed.extend(f.path for f in files)
+        return [make_analysis(f.path, "ann@example.com", last_change=old) for f in files]
+
+    monkeypatch.setattr("decay.analyzers.github.analyze_github_files", analyze_github_files)
+    svc, base = service(make_context())
+    svc.index.put(make_analysis("docs/old.md", "ann@example.com", last_change=old))
+    svc.index.put(make_analysis("docs/fresh.md", "bob@example.com", days_ago=0))
+
+    body = json.dumps(PUSH_PAYLOAD).encode("utf-8")
+    signature = "sha256=" + hmac.new(SECRET.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    headers = {"X-GitHub-Event": "push", "Content-Type": "application/json"}
+
+    assert request(f"{base}/webhooks/github", PUSH_PAYLOAD, dict(headers, **{"X-Hub-Signature-256": "sha256=0"}))[0] \
+        == 401
+    status, _ = request(f"{base}/webhooks/github", PUSH_PAYLOAD, dict(headers, **{"X-Hub-Signature-256": signature}))
+    assert status == 202
+    svc.wait()
+
+    assert analyzed == ["docs/guide.md", "docs/new.md"]
+    status, stale = request(f"{base}/stale?owner=ANN@example.com&token={SECRET}")
+    assert status == 200
+    assert sorted(d["id"] for d in stale) == ["docs/guide.md", "docs/new.md"]
+    assert request(f"{base}/stale?owner=bob@example.com", headers={"X-Decay-Token": SECRET})[1] == []
+    assert request(f"{base}/status")[1]["documents"] == 3
+
+
+def test_confluence_event_refetches_the_page(service):
+    pages = {"12": {"id": "12", "title": "Runbook", "ancestors": [{"id": "1"}],
+                    "version": {"when": "2019-01-01T00:00:00.000Z", "number": 3,
+                                "by": {"publicName": "Ann", "email": "ann@example.com"}},
+                    "_links": {"base": "https://wiki", "webui": "/pages/12"}}}
+    fetched = []
+
+    def get_content(page_id, expand=()):
+        fetched.append(page_id)
+        return pages[page_id]
+
+    ctx = make_context(github=None, confluence=SimpleNamespace(get_content=get_content),
+                       confluence_parent_page_id="1")
+    svc, base = service(ctx)
+
+    assert request(f"{base}/webhooks/confluence?token=wrong", PAGE_UPDATED_PAYLOAD)[0] == 401
+    assert request(f"{base}/webhooks/confluence?token={SECRET}", PAGE_UPDATED_PAYLOAD)[0] == 202
+    svc.wait()
+
+    assert fetched == ["12"]
+    stale = request(f"{base}/stale?owner=admin@example.com&token={SECRET}")[1]
+    assert [(d["id"], d["link"]) for d in stale] == [("12", "https://wiki/pages/12")]
+
+    request(f"{base}/webhooks/confluence?token={SECRET}", dict(PAGE_UPDATED_PAYLOAD, event="page_trashed"))
+    svc.wait()
+    assert request(f"{base}/status")[1]["documents"] == 0
+
+
+def test_reports_and_marking_need_their_actions(service):
+    svc, base = service(make_context())
+
+    assert request(f"{base}/reports?token={SECRET}", {})[0] == 400
+    assert request(f"{base}/mark?token={SECRET}", {})[0] == 400
+
+
+def test_requests_need_the_secret(service):
+    svc, base = service(make_context(actions=["mark", "email_owner"]))
+    svc.report = svc.mark = lambda: pytest.fail("the request was accepted")
+
+    for path in ("/reports", "/mark", "/reports?token=wrong"):
+        assert request(f"{base}{path}", {})[0] == 401
+    assert request(f"{base}/stale?owner=ann@example.com")[0] == 401
+    assert request(f"{base}/status")[0] == 200
+
+    # the service only listens on the local machine when there is no secret
+    parser = get_parser()
+    for host in ("0.0.0.0", "10.1.2.3", "docs.example.com"):
+        with pytest.raises(SystemExit):
+            DocCheckerContext(parser.parse_args(["serve", "--serve_host", host]), parser)
+    for host in ("127.0.0.1", "localhost", "::1"):
+        assert DocCheckerContext(parser.parse_args(["serve", "--serve_host", host]), parser).serve_host == host
+    assert DocCheckerContext(parser.parse_args(["serve", "--serve_host", "0.0.0.0", "--webhook_secret", SECRET]),
+                             parser).webhook_secret == SECRET
+
+
+def test_truncated_pushes_are_compared_or_analyzed_again(monkeypatch, make_analysis):
+    old = datetime.datetime(2019, 1, 1, tzinfo=datetime.timezone.utc)
+    compared = []
+
+    def compare(base, head):
+        compared.append((base, head))
+        return SimpleNamespace(status="ahead", files=[
+            SimpleNamespace(filename="docs/late.md", status="modified", previous_filename=None),
+            SimpleNamespace(filename="docs/moved.md", status="renamed", previous_filename="docs/guide.md"),
+            SimpleNamespace(filename="docs/old.md", status="removed", previous_filename=None)])
+
+    monkeypatch.setattr("decay.analyzers.github.analyze_github_files",
+                        lambda files, context: [make_analysis(f.path, None, last_change=old) for f in files])
+    monkeypatch.setattr("decay.scheduler.open_target",
+                        lambda context: ([make_analysis("docs/all.md", None, last_change=old)], None))
+    ctx = make_context(github=SimpleNamespace(),
+                       repo_ob=SimpleNamespace(compare=compare), github_budget=RateLimitBudget())
+    index = DocIndex(ctx)
+    for identifier in ("docs/guide.md", "docs/old.md", "docs/kept.md"):
+        index.put(make_analysis(identifier, None, last_change=old))
+
+    commits = [{"id": str(i), "added": [], "modified": ["docs/kept.md"], "removed": []} for i in range(20)]
+    push = {"ref": "refs/heads/master", "before": "b" * 40, "after": "a" * 40, "commits": commits}
+    update_from_github_push(index, push, ctx)
+
+    assert compared == [("b" * 40, "a" * 40)]
+    assert sorted(a.file_identifier for a in index.analyses()) == ["docs/kept.md", "docs/late.md", "docs/moved.md"]
+
+    update_from_github_push(index, dict(push, forced=True), ctx)
+
+    assert len(compared) == 1
+    assert [a.file_identifier for a in index.analyses()] == ["docs/all.md"]
+
+
+def test_malformed_webhooks_are_rejected(service):
+    svc, base = service(make_context(webhook_secret=None))
+    request_body = urllib.request.Request(f"{base}/webhooks/confluence", data=b"{not json",
+                                          headers={"Content-Type": "application/json"})
+
+    with pytest.raises(urllib.error.HTTPError) as e:
+        urllib.request.urlopen(request_body)
+    assert e.value.code == 400
+
+    status, _ = request(f"{base}/webhooks/github", ["not", "an", "object"], {"X-GitHub-Event": "push"})
+    assert status == 400
@@ -0,0 +1,156 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+from urllib3 import HTTPResponse
+from urllib3.exceptions import MaxRetryError
+
+from decay.throttle import RateLimitBudget
+from decay.transport import Transport, build_retry
+
+
+def test_budget_limits_requests_in_flight_across_workers():
+    budget = RateLimitBudget(max_in_flight=3)
+    lock = threading.Lock()
+    in_flight = []
+    peak = []
+
+    def request(_):
+        with budget:
+            with lock:
+                in_flight.append(1)
+                peak.append(len(in_flight))
+            time.sleep(0.01)
+            with lock:
+                in_flight.pop()
+
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        list(executor.map(request, range(30)))
+
+    assert max(peak) == 3
+
+
+def test_lane_has_its_own_requests_in_flight():
+    budget = RateLimitBudget(max_in_flight=1)
+    lane = budget.lane(4)
+    lock = threading.Lock()
+    in_flight = []
+    peak = []
+
+    def upload(_):
+        with lane:
+            with lock:
+                in_flight.append(1)
+                peak.append(len(in_flight))
+            time.sleep(0.01)
+            with lock:
+                in_flight.pop()
+
+    # the budget's only slot is taken for the whole time
+    with budget, ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(upload, range(16)))
+
+    assert max(peak) == 4
+    assert budget.lane(50).max_in_flight == 19
+
+
+def test_budget_spaces_out_requests():
+    budget = RateLimitBudget(max_in_flight=5, requests_per_second=100)
+    start = time.monotonic()
+    for _ in range(6):
+        with budget:
+            pass
+
+    assert time.monotonic() - start >= 0.05
+
+
+def test_budget_pauses_when_remaining_is_low():
+    budget = RateLimitBudget(reserve=10)
+    budget.observe("100", time.time() + 60)
+    start = time.monotonic()
+    with budget:
+        pass
+    assert time.monotonic() - start < 0.05
+
+    budget.observe("5", time.time() + 0.1)
+    with budget:
+        pass
+    assert time.monotonic() - start >= 0.08
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    """
+    Fails the first request and then reports that the rate limit is used up.
+    """
+    count = 0
+
+    def do_GET(self):
+        FlakyHandler.count += 1
+        self.send_response(503 if FlakyHandler.count == 1 else 200)
+        self.send_header("X-RateLimit-Remaining", "0")
+        self.send_header("X-RateLimit-Reset", str(int(time.time()) + 60))
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def test_transport_retries_and_throttles_by_host(serve):
+    url = serve(FlakyHandler) + "/items"
+    budget = RateLimitBudget(max_in_flight=2)
+    transport = Transport(retries=2, backoff=0)
+    transport.limit(url, budget)
+
+    response = transport.get(url)
+
+    assert response.status_code == 200
+    assert FlakyHandler.count == 2
+    assert transport.budget_for(url) is budget
+    assert budget._paused_until > time.monotonic() + 30
+
+
+class WriteHandler(BaseHTTPRequestHandler):
+    """
+    Answers every POST with the next status in `statuses` (200 once they run out).
+    """
+    statuses = []
+    count = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        WriteHandler.count += 1
+        status = WriteHandler.statuses.pop(0) if WriteHandler.statuses else 200
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def test_writes_are_only_retried_when_rate_limited(serve):
+    url = serve(WriteHandler) + "/v3/mail/send"
+    transport = Transport(retries=2, backoff=0)
+
+    # the mail may have been sent even though the server failed
+    WriteHandler.statuses, WriteHandler.count = [503], 0
+    assert transport.post(url, json={}).status_code == 503
+    assert WriteHandler.count == 1
+
+    WriteHandler.statuses, WriteHandler.count = [429], 0
+    assert transport.post(url, json={}).status_code == 200
+    assert WriteHandler.count == 2
+
+
+def test_a_refused_write_is_only_retried_when_rate_limited():
+    retry = build_retry(2, 0).new(status_forcelist=[403, 429])
+
+    with pytest.raises(MaxRetryError):
+        retry.increment("POST", "/repos/o/r/git/refs", response=HTTPResponse(status=403))
+    for headers in ({"Retry-After": "1"}, {"X-RateLimit-Remaining": "0"}):
+        assert retry.increment("POST", "/repos/o/r/git/refs", response=HTTPResponse(status=403, headers=headers)) \
+            .total == 1
+    assert retry.increment("GET", "/repos/o/r", response=HTTPResponse(status=403)).total == 1
@@ -0,0 +1,61 @@
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import email_validator
+import pytest
+
+from decay.cache import ResponseCache
+from decay.validation import EmailValidator, InvalidEmail
+
+
+def test_each_address_is_checked_once():
+    validator = EmailValidator(check_deliverability=False)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(validator.validate, ["Ann@Example.com", " Ann@EXAMPLE.COM "] * 500))
+
+    assert set(results) == {"Ann@example.com"}
+    assert validator.checks == 1
+
+    for _ in range(3):
+        with pytest.raises(InvalidEmail):
+            validator.validate("not an address")
+    assert validator.checks == 2
+
+
+def test_deliverability_results_are_cached_on_disk(tmp_path, monkeypatch):
+    lookups = []
+
+    def fake_validate(address, check_deliverability=True):
+        lookups.append(address)
+        if address.endswith("@nowhere.invalid"):
+            raise email_validator.EmailUndeliverableError("The domain name nowhere.invalid does not exist.")
+        if "@" not in address:
+            raise email_validator.EmailSyntaxError("An email address must have an @-sign.")
+        return SimpleNamespace(email=address)
+
+    monkeypatch.setattr(email_validator, "validate_email", fake_validate)
+    cache = ResponseCache(str(tmp_path / "cache.db"), 1024 * 1024)
+
+    first = EmailValidator(cache=cache)
+    assert first.validate("ann@example.com") == "ann@example.com"
+    with pytest.raises(InvalidEmail):
+        first.validate("bob@nowhere.invalid")
+    with pytest.raises(InvalidEmail):
+        first.validate("carol")
+    with pytest.raises(InvalidEmail):
+        first.validate("bob@nowhere.invalid")
+    assert len(lookups) == 3
+
+    # the next run reuses the results until they expire, except for the domain that may only have been down
+    second = EmailValidator(cache=cache)
+    assert second.validate("ann@example.com") == "ann@example.com"
+    with pytest.raises(InvalidEmail, match="@-sign"):
+        second.validate("carol")
+    with pytest.raises(InvalidEmail, match="does not exist"):
+        second.validate("bob@nowhere.invalid")
+    assert lookups[3:] == ["bob@nowhere.invalid"]
+
+    expired = EmailValidator(cache=cache, cache_days=0)
+    expired.validate("ann@example.com")
+    assert len(lookups) == 5
@@ -0,0 +1,110 @@
+import threading
+import time
+
+# Github's secondary rate limits kick in well before its documented cap of 100 concurrent requests, so no matter
+#   how many workers are used, we never have more than this many requests in flight.
+MAX_CONCURRENT_REQUESTS = 20
+
+
+class RateLimitBudget(object):
+    """
+    A request budget that is shared by all the workers talking to the same API.  It limits the number of requests
+    in flight and the rate at which new requests are started, and pauses everyone once the API reports that the
+    remaining budget is nearly exhausted.  Use it as a context manager around each request:
+
+        with budget:
+            repo.get_contents(...)
+    """
+    def __init__(self, max_in_flight: int = 1, requests_per_second: float = 0, reserve: int = 50):
+        """
+        :param max_in_flight: The maximum number of requests that can be made at the same time
+        :param requests_per_second: The maximum rate at which requests are started (0 for no limit)
+        :param reserve: When the API reports that fewer than this number of requests remain, new requests are held
+            until the budget resets.
+        """
+        self.max_in_flight = max(1, min(max_in_flight, MAX_CONCURRENT_REQUESTS))
+        self.interval = 1.0 / requests_per_second if requests_per_second > 0 else 0
+        self.reserve = reserve
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+        self._paused_until = 0.0
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def acquire(self):
+        """
+        Waits until a new request can be started without going over the budget.
+        """
+        self._slots.acquire()
+        self._wait_turn()
+
+    def _wait_turn(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start, self._paused_until)
+            self._next_start = start + self.interval
+
+        if start > now:
+            time.sleep(start - now)
+
+    def release(self):
+        self._slots.release()
+
+    def lane(self, max_in_flight: int) -> "BudgetLane":
+        """
+        Creates a lane with its own allowance of requests in flight for requests that shouldn't wait for the
+        workers' slots (e.g. uploads made while the analysis is still going).  Requests in a lane still share the
+        rate and pauses of this budget.  Together with this budget's slots, no more than MAX_CONCURRENT_REQUESTS are
+        in flight.
+        """
+        return BudgetLane(self, min(max_in_flight, MAX_CONCURRENT_REQUESTS - self.max_in_flight))
+
+    def pause(self, seconds: float):
+        """
+        Holds all new requests for the given number of seconds (e.g. because the API sent a Retry-After header).
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def observe(self, remaining, reset_at):
+        """
+        Updates the budget with the rate limit information reported by the API.
+        :param remaining: The number of requests remaining in the current window (None if unknown)
+        :param reset_at: The epoch time at which the window resets (None if unknown)
+        """
+        if remaining is None or reset_at is None:
+            return
+
+        if int(remaining) <= self.reserve:
+            self.pause(max(0.0, float(reset_at) - time.time()))
+
+
+class BudgetLane(object):
+    """
+    A separate allowance of requests in flight that shares the rate and pauses of a RateLimitBudget.  It's used the
+    same way as the budget.
+    """
+    def __init__(self, budget: RateLimitBudget, max_in_flight: int):
+        self.budget = budget
+        self.max_in_flight = max(1, max_in_flight)
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+
+    def __enter__(self):
+        self._slots.acquire()
+        self.budget._wait_turn()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._slots.release()
+
+    def pause(self, seconds: float):
+        self.budget.pause(seconds)
+
+    def observe(self, remaining, reset_at):
+        self.budget.observe(remaining, reset_at)
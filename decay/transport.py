@@ -0,0 +1,194 @@
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Union
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, ResponseError
+from urllib3.util.retry import Retry
+
+from decay.cache import CachingSession, ResponseCache
+from decay.metrics import metrics, endpoint_name, metric_name
+from decay.throttle import BudgetLane, RateLimitBudget, MAX_CONCURRENT_REQUESTS
+
+# Responses with these status codes are retried.
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Only these methods are retried after a read error or a server error.  Every write made here (sending mail, creating
+#   git objects, refs and PRs and saving a new version of a page) may have been carried out even though the response
+#   never arrived so retrying it could make it twice.
+SAFE_METHODS = frozenset(["GET", "HEAD", "OPTIONS", "TRACE"])
+
+# Writes are only retried when the server refused them because of a rate limit.  Github also refuses requests with
+#   a 403 when a rate limit is used up but a 403 is usually a permission error so it's only retried if the response
+#   says it's a rate limit (see is_rate_limited).
+WRITE_RETRY_STATUS_CODES = (403, 429)
+
+DEFAULT_RETRIES = 4
+
+# The delay before the first retry (it doubles after each attempt) unless the server asks for something else.
+DEFAULT_BACKOFF_SECONDS = 0.5
+
+# A random delay of up to this many seconds is added to every backoff so that workers don't retry in lockstep.
+BACKOFF_JITTER_SECONDS = 0.5
+
+
+def is_rate_limited(headers) -> bool:
+    """
+    Whether a response refused the request because of a rate limit: either the limit is used up or the server says
+    when to try again.
+    """
+    return headers.get("X-RateLimit-Remaining") == "0" or "Retry-After" in headers
+
+
+def _is_write(method: Union[str, None]) -> bool:
+    return bool(method) and method.upper() not in SAFE_METHODS
+
+
+class _WriteSafeRetry(object):
+    """
+    Mixed into a retry policy so that writes are only retried when they were refused because of a rate limit.
+    """
+    def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+        if _is_write(method):
+            return bool(self.total) and status_code in WRITE_RETRY_STATUS_CODES and \
+                status_code in self.status_forcelist
+        return super().is_retry(method, status_code, has_retry_after)
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        if response is not None and response.status == 403 and _is_write(method) and \
+                not is_rate_limited(response.headers):
+            # no retries left for this one - the response is returned as it is (raise_on_status is off)
+            raise MaxRetryError(_pool, url, ResponseError("403 that isn't a rate limit"))
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+
+def build_retry(retries: int = DEFAULT_RETRIES, backoff: float = DEFAULT_BACKOFF_SECONDS,
+                retry_class: type = Retry) -> Retry:
+    """
+    Creates the retry policy used for every connection.  Connection errors (the request was never sent) are retried
+    for any method.  Read errors and responses with one of the RETRY_STATUS_CODES are only retried for SAFE_METHODS -
+    writes are only retried when they were refused because of a rate limit.  Retries wait with a jittered exponential
+    backoff, unless the response says how long to wait with a Retry-After header.  Once the retries are used up, the
+    last response is returned.
+    """
+    options = dict(total=retries, connect=retries, read=retries, status=retries, backoff_factor=backoff,
+                   status_forcelist=list(RETRY_STATUS_CODES), raise_on_status=False, respect_retry_after_header=True)
+    parameters = inspect.signature(Retry.__init__).parameters
+    if "allowed_methods" in parameters:
+        options["allowed_methods"] = SAFE_METHODS
+    else:
+        # urllib3 before 1.26
+        options["method_whitelist"] = SAFE_METHODS
+    if "backoff_jitter" in parameters:
+        # older versions of urllib3 don't support jitter
+        options["backoff_jitter"] = BACKOFF_JITTER_SECONDS if backoff else 0
+
+    return type(f"WriteSafe{retry_class.__name__}", (_WriteSafeRetry, retry_class), {})(**options)
+
+
+def github_retry(retries: int = DEFAULT_RETRIES) -> Retry:
+    """
+    The retry policy for the github client.  Newer versions of PyGithub come with a policy that also understands
+    Github's secondary rate limits so that one is used when it's available.
+    """
+    import github
+
+    return build_retry(retries, retry_class=getattr(github, "GithubRetry", Retry))
+
+
+def github_client_options(page_size: int, retries: int = DEFAULT_RETRIES) -> dict:
+    """
+    The options for creating the github client.  Newer versions of PyGithub wait a quarter of a second between
+    requests by default - the shared request budget already paces them so that pause is turned off.
+    """
+    import github
+
+    options = dict(per_page=page_size, retry=github_retry(retries))
+    if "seconds_between_requests" in inspect.signature(github.Github.__init__).parameters:
+        options["seconds_between_requests"] = None
+    return options
+
+
+class Transport(CachingSession):
+    """
+    The session shared by everything that talks to an API (apart from the Github client which has its own
+    connections).  Connections are kept alive in a pool per host, failed requests are retried (see build_retry) and
+    every request is counted against the RateLimitBudget of its host.  The rate limit headers of each response
+    (X-RateLimit-Remaining/X-RateLimit-Reset and Retry-After) are passed on to the budget so that everyone slows
+    down when an API asks for it.  Hosts without a budget given to `limit` get a default one.
+    """
+    def __init__(self, cache: Union[ResponseCache, None] = None, retries: int = DEFAULT_RETRIES,
+                 backoff: float = DEFAULT_BACKOFF_SECONDS, pool_size: int = MAX_CONCURRENT_REQUESTS):
+        super().__init__(cache)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                              max_retries=build_retry(retries, backoff))
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+        self.budgets: Dict[str, RateLimitBudget] = {}
+        self._local = threading.local()
+
+    def limit(self, url: str, budget: RateLimitBudget):
+        """
+        Counts all the requests made to the host of the given url against the given budget.
+        """
+        self.budgets[urlparse(url).netloc] = budget
+
+    @contextmanager
+    def counted_against(self, budget: Union[RateLimitBudget, BudgetLane]):
+        """
+        Counts the requests made by the current thread inside the block against the given budget (usually a lane of
+        the budget of the host) instead of the budget of their host.
+        """
+        previous = getattr(self._local, "budget", None)
+        self._local.budget = budget
+        try:
+            yield
+        finally:
+            self._local.budget = previous
+
+    def budget_for(self, url: str) -> Union[RateLimitBudget, BudgetLane]:
+        override = getattr(self._local, "budget", None)
+        if override:
+            return override
+
+        host = urlparse(url).netloc
+        budget = self.budgets.get(host)
+        if not budget:
+            budget = self.budgets.setdefault(host, RateLimitBudget(max_in_flight=MAX_CONCURRENT_REQUESTS))
+        return budget
+
+    def request(self, method, url, *args, **kwargs):
+        budget = self.budget_for(url)
+        endpoint = endpoint_name(method, url)
+        with budget:
+            start = time.perf_counter()
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except Exception:
+                metrics.observe_request(endpoint, time.perf_counter() - start, failed=True)
+                raise
+        metrics.observe_request(endpoint, time.perf_counter() - start, failed=response.status_code >= 400)
+
+        if getattr(response, "from_cache", False):
+            metrics.increment("not_modified_responses")
+
+        observe_response(budget, response)
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        if remaining is not None and remaining.isdigit():
+            metrics.set_gauge(f"rate_limit_remaining_{metric_name(urlparse(url).netloc)}", int(remaining))
+        return response
+
+
+def observe_response(budget: Union[RateLimitBudget, BudgetLane], response: requests.Response):
+    """
+    Passes the rate limit information in the headers of a response on to a budget.
+    """
+    budget.observe(response.headers.get("X-RateLimit-Remaining"), response.headers.get("X-RateLimit-Reset"))
+
+    retry_after = response.headers.get("Retry-After")
+    if response.status_code in RETRY_STATUS_CODES and retry_after and retry_after.isdigit():
+        budget.pause(float(retry_after))
@@ -1,3 +1,6 @@
+import datetime
+import ipaddress
+
 
 def remove_leading_trailing_slashes(path):
     """
@@ -22,3 +25,43 @@ def remove_leading_trailing_slashes(path):
         path = path[0:-1]
 
     return path
+
+
+def as_utc(when):
+    """
+    Normalizes a datetime to an aware datetime in UTC.  Naive datetimes (as returned by some versions of the
+    github client) are assumed to already be in UTC.
+    :param when: The datetime to normalize (or None)
+    :return: The aware datetime or None if none was given.
+    """
+    if when is None:
+        return None
+
+    if when.tzinfo is None:
+        return when.replace(tzinfo=datetime.timezone.utc)
+
+    return when.astimezone(datetime.timezone.utc)
+
+
+def changed_within_days(when, days):
+    """
+    Determines whether the given date of change is within the given number of days from now.  Works with both
+    naive and aware datetimes.
+    :param when: The date of the change
+    :param days: The number of days after which a change is no longer recent
+    :return: True if the change happened within the last `days` days
+    """
+    now = datetime.datetime.now(tz=when.tzinfo)
+    return when >= now - datetime.timedelta(days=days)
+
+
+def is_loopback(host: str) -> bool:
+    """
+    Whether the given address (or host name) only accepts connections from the local machine.
+    """
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
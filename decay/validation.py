@@ -0,0 +1,118 @@
+import json
+import threading
+import time
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Dict, Union
+
+if TYPE_CHECKING:
+    from decay.cache import ResponseCache
+
+DEFAULT_CACHE_DAYS = 7
+
+# Results stored in the response cache are keyed by the address with this prefix.
+_CACHE_KEY_PREFIX = "email:"
+
+
+class InvalidEmail(ValueError):
+    """
+    Raised for an address that isn't valid (or, when deliverability is checked, can't receive email).
+    """
+
+
+def normalized_key(address: str) -> str:
+    """
+    The key results are remembered under.  Domains are case insensitive (the local part isn't necessarily).
+    """
+    local, at, domain = address.strip().rpartition("@")
+    return f"{local}{at}{domain.lower()}" if at else address.strip()
+
+
+class EmailValidator(object):
+    """
+    Checks email addresses and remembers the result of each address for the rest of the run, so an owner of
+    thousands of documents costs a single check.  When deliverability is checked (which needs a DNS lookup of the
+    domain), the results are also kept in the response cache (if there is one) for `cache_days` so later runs don't
+    repeat the lookups.  Addresses that couldn't be delivered to aren't kept since the domain (or the DNS server)
+    may only have been failing for a moment.  In syntax-only mode no lookups are made at all - use it where there is
+    no DNS.
+
+    Several threads can check addresses at once: only the first one to ask about an address checks it and the
+    others wait for its result.
+    """
+    def __init__(self, check_deliverability: bool = True, cache: Union["ResponseCache", None] = None,
+                 cache_days: float = DEFAULT_CACHE_DAYS):
+        self.check_deliverability = check_deliverability
+        self.cache = cache if check_deliverability else None
+        self.cache_seconds = cache_days * 24 * 60 * 60
+        self.checks = 0
+        self._results: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def validate(self, address: str) -> str:
+        """
+        Checks an address.
+        :param address: The address to check
+        :return: The normalized form of the address.
+        :raises InvalidEmail: If the address isn't valid (the message says why).
+        """
+        key = normalized_key(address)
+        with self._lock:
+            result = self._results.get(key)
+            owner = result is None
+            if owner:
+                result = self._results[key] = Future()
+
+        if owner:
+            try:
+                result.set_result(self._check(key))
+            except BaseException as e:
+                result.set_exception(e)
+                raise
+
+        email, reason = result.result()
+        if reason is not None:
+            raise InvalidEmail(reason)
+        return email
+
+    def _check(self, key: str):
+        stored = self._load(key)
+        if stored:
+            return stored
+
+        from email_validator import validate_email, EmailNotValidError, EmailUndeliverableError
+
+        self.checks += 1
+        try:
+            valid = validate_email(key, check_deliverability=self.check_deliverability)
+            # newer versions of email_validator renamed `email` to `normalized`
+            checked = (valid.normalized if hasattr(valid, "normalized") else valid.email), None
+        except EmailUndeliverableError as e:
+            return None, str(e)
+        except EmailNotValidError as e:
+            checked = None, str(e)
+
+        self._store(key, checked)
+        return checked
+
+    def _load(self, key: str):
+        if not self.cache:
+            return None
+
+        entry = self.cache.get(_CACHE_KEY_PREFIX + key)
+        if not entry:
+            return None
+
+        try:
+            stored = json.loads(entry.body)
+        except ValueError:
+            return None
+
+        if time.time() - stored.get("checked_at", 0) > self.cache_seconds:
+            return None
+        return stored.get("email"), stored.get("reason")
+
+    def _store(self, key: str, checked):
+        if self.cache:
+            email, reason = checked
+            body = json.dumps({"email": email, "reason": reason, "checked_at": time.time()})
+            self.cache.put(_CACHE_KEY_PREFIX + key, body.encode("utf-8"))
@@ -25,15 +25,16 @@ setup(
     ],
     packages=["decay","decay.markers","decay.analyzers"],
     include_package_data=True,
+    python_requires=">=3.7",
     install_requires=[
         "python-frontmatter",
-        "sendgrid",
+        "PyYAML",
         "PyGithub",
-        "markdown2",
         "email_validator",
         "configargparse",
         "pyfluence",
-        "arrow"
+        "arrow",
+        "requests"
     ],
     entry_points={
         "console_scripts": [